@@ -17,6 +17,50 @@ ARK_MODEL_NAME = os.getenv("ARK_MODEL_NAME", "doubao-seed-1-6-251015")
 if not ARK_API_KEY:
     raise ValueError("ARK_API_KEY is not set. Please set it in environment or .env.")
 
+# 大模型 HTTP 连接池（services/llm_client.py 进程内共享）
+LLM_TIMEOUT_S = float(os.getenv("LLM_TIMEOUT_S", "60"))
+LLM_CONNECT_TIMEOUT_S = float(os.getenv("LLM_CONNECT_TIMEOUT_S", "10"))
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "50"))
+LLM_MAX_KEEPALIVE = int(os.getenv("LLM_MAX_KEEPALIVE", "20"))
+LLM_KEEPALIVE_EXPIRY_S = float(os.getenv("LLM_KEEPALIVE_EXPIRY_S", "60"))
+# 安装 h2 时才会真正启用 HTTP/2
+LLM_HTTP2 = os.getenv("LLM_HTTP2", "true").lower() in ("1", "true", "yes")
+
+# ai_agent 节点：默认并发数、合批行数，进程级速率上限（次/分钟）与突发量，重试次数与退避基数
+AI_AGENT_CONCURRENCY = int(os.getenv("AI_AGENT_CONCURRENCY", "8"))
+AI_AGENT_BATCH_SIZE = int(os.getenv("AI_AGENT_BATCH_SIZE", "1"))
+AI_AGENT_RPM = float(os.getenv("AI_AGENT_RPM", "300"))
+AI_AGENT_BURST = float(os.getenv("AI_AGENT_BURST", "10"))
+AI_AGENT_MAX_RETRIES = int(os.getenv("AI_AGENT_MAX_RETRIES", "3"))
+AI_AGENT_RETRY_BASE_S = float(os.getenv("AI_AGENT_RETRY_BASE_S", "1.0"))
+
+# 大模型响应缓存（DATA_DIR/llm_cache.db）：是否启用、有效期（秒）、总大小上限（字节）
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+LLM_CACHE_TTL_S = float(os.getenv("LLM_CACHE_TTL_S", str(30 * 24 * 3600)))
+LLM_CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+
+# 识图：PDF 渲染 DPI 与渲染进程数，批量任务同时识别的页数，单个 PDF 最多页数，单次批量最多文件数
+VISION_PDF_DPI = int(os.getenv("VISION_PDF_DPI", "144"))
+VISION_RENDER_WORKERS = int(os.getenv("VISION_RENDER_WORKERS", str(min(4, os.cpu_count() or 1))))
+VISION_PAGE_CONCURRENCY = int(os.getenv("VISION_PAGE_CONCURRENCY", "4"))
+VISION_MAX_PAGES = int(os.getenv("VISION_MAX_PAGES", "50"))
+VISION_MAX_BATCH_FILES = int(os.getenv("VISION_MAX_BATCH_FILES", "20"))
+# 识图：发送前图片预处理 - 长边上限（像素）、编码格式（jpeg/webp/png/off）、有损编码质量、灰度（auto/always/never）
+VISION_IMAGE_MAX_SIDE = int(os.getenv("VISION_IMAGE_MAX_SIDE", "2048"))
+VISION_IMAGE_FORMAT = os.getenv("VISION_IMAGE_FORMAT", "jpeg").lower()
+VISION_IMAGE_QUALITY = int(os.getenv("VISION_IMAGE_QUALITY", "85"))
+VISION_IMAGE_GRAYSCALE = os.getenv("VISION_IMAGE_GRAYSCALE", "auto").lower()
+# 识图任务：同时执行的任务数、最多排队数、排队任务持有的上传内容总大小上限、任务表上限（含已结束）、
+# 全局同时进行的模型调用数、每个任务缓存的事件条数、已结束任务保留时间（秒）、过期清理间隔（秒）
+VISION_MAX_CONCURRENT_JOBS = int(os.getenv("VISION_MAX_CONCURRENT_JOBS", "4"))
+VISION_MAX_QUEUED_JOBS = int(os.getenv("VISION_MAX_QUEUED_JOBS", "50"))
+VISION_MAX_QUEUED_BYTES = int(os.getenv("VISION_MAX_QUEUED_MB", "256")) * 1024 * 1024
+VISION_MAX_JOBS = int(os.getenv("VISION_MAX_JOBS", "500"))
+VISION_MAX_MODEL_CALLS = int(os.getenv("VISION_MAX_MODEL_CALLS", "16"))
+VISION_JOB_EVENT_BUFFER = int(os.getenv("VISION_JOB_EVENT_BUFFER", "2000"))
+VISION_JOB_TTL_S = float(os.getenv("VISION_JOB_TTL_S", "1800"))
+VISION_JOB_SWEEP_INTERVAL_S = float(os.getenv("VISION_JOB_SWEEP_INTERVAL_S", "60"))
+
 # 文件存储配置
 UPLOAD_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "uploads")
 DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data")
@@ -25,5 +69,65 @@ DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data")
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 os.makedirs(DATA_DIR, exist_ok=True)
 
+# 上传限制：请求体超过 MAX_UPLOAD_BYTES（另加 multipart 开销）时在解析前以 413 拒绝，落盘时再按文件大小检查
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_MB", "200")) * 1024 * 1024
+UPLOAD_CHUNK_BYTES = int(os.getenv("UPLOAD_CHUNK_KB", "1024")) * 1024
+
+# 列表接口（文件/工作流/执行历史）键集分页的默认与最大页大小
+LIST_PAGE_DEFAULT = int(os.getenv("LIST_PAGE_DEFAULT", "50"))
+LIST_PAGE_MAX = int(os.getenv("LIST_PAGE_MAX", "200"))
+
+# 节点耗时分位数统计只看最近的 N 次运行
+HISTORY_STATS_MAX_RUNS = int(os.getenv("HISTORY_STATS_MAX_RUNS", "500"))
+
+# Sheet 预览单次最多返回的行数
+SHEET_PREVIEW_MAX_ROWS = int(os.getenv("SHEET_PREVIEW_MAX_ROWS", "5000"))
+
+# 列式缓存配置（上传时把各Sheet物化为 Parquet，后续读取直接走缓存）
+COLUMNAR_CACHE_DIR = os.path.join(DATA_DIR, "columnar_cache")
+COLUMNAR_CACHE_WORKERS = int(os.getenv("COLUMNAR_CACHE_WORKERS", "2"))
+os.makedirs(COLUMNAR_CACHE_DIR, exist_ok=True)
+
+# 文件注册表（file_id → 路径）进程内 LRU 容量
+FILE_REGISTRY_CACHE_SIZE = int(os.getenv("FILE_REGISTRY_CACHE_SIZE", "4096"))
+
+# 工作流调度：节点线程池大小（整个服务同时执行的节点上限）与单个工作流的并发上限
+WORKFLOW_MAX_WORKERS = int(os.getenv("WORKFLOW_MAX_WORKERS", str(min(8, (os.cpu_count() or 1) + 2))))
+WORKFLOW_MAX_CONCURRENCY = int(os.getenv("WORKFLOW_MAX_CONCURRENCY", "4"))
+# 异步运行（/workflow/runs）：每次运行缓存的事件条数、结束后保留时间（秒）、过期清理间隔（秒）
+WORKFLOW_RUN_EVENT_BUFFER = int(os.getenv("WORKFLOW_RUN_EVENT_BUFFER", "2000"))
+WORKFLOW_RUN_TTL_S = float(os.getenv("WORKFLOW_RUN_TTL_S", "1800"))
+WORKFLOW_RUN_SWEEP_INTERVAL_S = float(os.getenv("WORKFLOW_RUN_SWEEP_INTERVAL_S", "60"))
+
+# 运行结果存储：执行接口只返回样本，完整结果留在服务端分页读取
+RUN_RESULT_DIR = os.path.join(DATA_DIR, "run_results")
+RUN_RESULT_MEMORY_BYTES = int(os.getenv("RUN_RESULT_MEMORY_MB", "512")) * 1024 * 1024
+RUN_RESULT_MAX_RUNS = int(os.getenv("RUN_RESULT_MAX_RUNS", "20"))
+RUN_RESULT_SAMPLE_ROWS = int(os.getenv("RUN_RESULT_SAMPLE_ROWS", "100"))
+RUN_RESULT_PAGE_MAX = int(os.getenv("RUN_RESULT_PAGE_MAX", "1000"))
+
+# 工作簿会话：列式缓存命中时并行读取的线程数
+WORKBOOK_SESSION_WORKERS = int(os.getenv("WORKBOOK_SESSION_WORKERS", "4"))
+
+# 节点预览缓存（按上游子图内容哈希复用样本结果）
+PREVIEW_CACHE_MAX_ENTRIES = int(os.getenv("PREVIEW_CACHE_MAX_ENTRIES", "256"))
+PREVIEW_CACHE_MEMORY_BYTES = int(os.getenv("PREVIEW_CACHE_MEMORY_MB", "256")) * 1024 * 1024
+
 # 数据库配置
 DATABASE_URL = f"sqlite:///{os.path.join(DATA_DIR, 'app.db')}"
+# SQLite 连接池：读连接数、忙等待超时、每个连接的语句缓存大小
+DB_READ_POOL_SIZE = int(os.getenv("DB_READ_POOL_SIZE", "4"))
+DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+DB_CACHED_STATEMENTS = int(os.getenv("DB_CACHED_STATEMENTS", "256"))
+
+# AI 对话会话存储：sqlite（存 app.db，多个 worker 共享）或 memory（进程内 LRU）；
+# 会话有效期（秒，按最后活动时间）、内存模式最多保留的会话数、单个会话的消息条数与字节上限
+CHAT_SESSION_STORE = os.getenv("CHAT_SESSION_STORE", "sqlite").lower()
+CHAT_SESSION_TTL_S = float(os.getenv("CHAT_SESSION_TTL_S", str(24 * 3600)))
+CHAT_SESSION_MAX_SESSIONS = int(os.getenv("CHAT_SESSION_MAX_SESSIONS", "1000"))
+CHAT_SESSION_MAX_MESSAGES = int(os.getenv("CHAT_SESSION_MAX_MESSAGES", "60"))
+CHAT_SESSION_MAX_BYTES = int(os.getenv("CHAT_SESSION_MAX_BYTES", str(512 * 1024)))
+# AI 对话上下文预算（估算 token）：超出时把较早的对话压缩为摘要；始终原样保留的最近消息数；摘要长度上限
+CHAT_CONTEXT_TOKEN_BUDGET = int(os.getenv("CHAT_CONTEXT_TOKEN_BUDGET", "12000"))
+CHAT_KEEP_RECENT_MESSAGES = int(os.getenv("CHAT_KEEP_RECENT_MESSAGES", "6"))
+CHAT_SUMMARY_MAX_TOKENS = int(os.getenv("CHAT_SUMMARY_MAX_TOKENS", "600"))
@@ -1,57 +1,294 @@
 """
 数据库初始化和操作
+
+所有服务通过 db_pool 访问 SQLite：
+- WAL 模式 + 调优后的 PRAGMA，读写互不阻塞；
+- 写操作共用一个写连接，经 asyncio.Lock 排队串行执行（SQLite 同一时刻只允许一个写者），成功提交、异常回滚；
+- 读操作从固定大小的读连接池中借用连接；
+- 连接开启 sqlite3 语句缓存（cached_statements），重复 SQL 不再重新编译。
 """
-import aiosqlite
+import asyncio
+import base64
+import json
+import logging
 import os
-from config import DATA_DIR
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import aiosqlite
+from config import DATA_DIR, DB_BUSY_TIMEOUT_MS, DB_CACHED_STATEMENTS, DB_READ_POOL_SIZE
 
 DATABASE_PATH = os.path.join(DATA_DIR, "app.db")
 
+logger = logging.getLogger(__name__)
+
+
+class DatabasePool:
+    """单写者 + 读连接池"""
+
+    def __init__(self, path: str = DATABASE_PATH, read_pool_size: int = DB_READ_POOL_SIZE):
+        self.path = path
+        self.read_pool_size = max(1, int(read_pool_size))
+        self._writer: Optional[aiosqlite.Connection] = None
+        self._write_lock: Optional[asyncio.Lock] = None
+        self._readers: Optional["asyncio.Queue[aiosqlite.Connection]"] = None
+        self._all_readers: List[aiosqlite.Connection] = []
+        self._open_lock: Optional[asyncio.Lock] = None
+
+    @staticmethod
+    async def _pragma(conn: aiosqlite.Connection, sql: str) -> None:
+        # 读完并关闭游标：未完成的 PRAGMA 语句会一直持有锁
+        async with conn.execute(sql) as cursor:
+            await cursor.fetchall()
+
+    async def _connect(self) -> aiosqlite.Connection:
+        conn = await aiosqlite.connect(self.path, cached_statements=DB_CACHED_STATEMENTS)
+        try:
+            conn.row_factory = aiosqlite.Row
+            await self._pragma(conn, f"PRAGMA busy_timeout = {int(DB_BUSY_TIMEOUT_MS)}")
+            await self._pragma(conn, "PRAGMA synchronous = NORMAL")
+            await self._pragma(conn, "PRAGMA temp_store = MEMORY")
+            await self._pragma(conn, "PRAGMA cache_size = -16000")
+            await self._pragma(conn, "PRAGMA mmap_size = 134217728")
+        except BaseException:
+            await conn.close()
+            raise
+        return conn
+
+    async def open(self) -> None:
+        if self._writer is not None:
+            return
+        if self._open_lock is None:
+            self._open_lock = asyncio.Lock()
+        async with self._open_lock:
+            if self._writer is not None:
+                return
+            writer = await self._connect()
+            readers: "asyncio.Queue[aiosqlite.Connection]" = asyncio.Queue()
+            opened: List[aiosqlite.Connection] = []
+            try:
+                # WAL 是数据库文件级别的持久设置，写连接设置一次即可
+                await self._pragma(writer, "PRAGMA journal_mode = WAL")
+                for _ in range(self.read_pool_size):
+                    conn = await self._connect()
+                    opened.append(conn)
+                    readers.put_nowait(conn)
+            except BaseException:
+                for conn in [writer] + opened:
+                    await conn.close()
+                raise
+            self._all_readers = opened
+            self._readers = readers
+            self._write_lock = asyncio.Lock()
+            self._writer = writer
+            logger.info("[Database] 连接池已打开: path=%s readers=%s", self.path, self.read_pool_size)
+
+    async def close(self) -> None:
+        writer, readers = self._writer, self._all_readers
+        self._writer = None
+        self._readers = None
+        self._all_readers = []
+        self._write_lock = None
+        self._open_lock = None
+        for conn in ([writer] if writer else []) + readers:
+            try:
+                await conn.close()
+            except Exception as e:
+                logger.warning("[Database] 关闭连接失败: %s", e)
+
+    @asynccontextmanager
+    async def read(self) -> AsyncIterator[aiosqlite.Connection]:
+        """借用一个读连接"""
+        await self.open()
+        readers = self._readers
+        conn = await readers.get()
+        try:
+            yield conn
+        finally:
+            readers.put_nowait(conn)
+
+    @asynccontextmanager
+    async def write(self) -> AsyncIterator[aiosqlite.Connection]:
+        """排队获取写连接；块内正常结束自动提交，异常回滚"""
+        await self.open()
+        async with self._write_lock:
+            try:
+                yield self._writer
+                await self._writer.commit()
+            except BaseException:
+                await self._writer.rollback()
+                raise
+
+
+# 单例
+db_pool = DatabasePool()
+
+
+# ========== 表结构迁移 ==========
+# 每个迁移只执行一次，已执行到的版本记录在 PRAGMA user_version；新增迁移只能追加到末尾
+async def _create_base_tables(db: aiosqlite.Connection) -> None:
+    # 工作流表
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS workflows (
+            id TEXT PRIMARY KEY,
+            name TEXT NOT NULL,
+            description TEXT,
+            config TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+    # 执行历史表
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS execution_history (
+            id TEXT PRIMARY KEY,
+            workflow_id TEXT,
+            input_files TEXT,
+            output_file TEXT,
+            status TEXT,
+            result_summary TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (workflow_id) REFERENCES workflows (id)
+        )
+    """)
+
+    # 上传文件记录表
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS uploaded_files (
+            id TEXT PRIMARY KEY,
+            filename TEXT NOT NULL,
+            original_name TEXT NOT NULL,
+            file_path TEXT NOT NULL,
+            sheets TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+
+async def _add_content_hash(db: aiosqlite.Connection) -> None:
+    # 上传内容的 SHA-256（去重、缓存键）；早期版本可能已通过启动检查补过该列
+    async with db.execute("PRAGMA table_info(uploaded_files)") as cursor:
+        columns = {row[1] for row in await cursor.fetchall()}
+    if "content_hash" not in columns:
+        await db.execute("ALTER TABLE uploaded_files ADD COLUMN content_hash TEXT")
+
+
+async def _add_list_indexes(db: aiosqlite.Connection) -> None:
+    # 列表排序/分页与按条件查找用到的列
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_uploaded_files_created ON uploaded_files (created_at, id)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_uploaded_files_hash ON uploaded_files (content_hash)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_uploaded_files_path ON uploaded_files (file_path)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_workflows_updated ON workflows (updated_at, id)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_history_created ON execution_history (created_at, id)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_history_workflow ON execution_history (workflow_id)")
+
+
+async def _add_run_metrics(db: aiosqlite.Connection) -> None:
+    # 运行级耗时与内存估计；节点级明细单独成表，供按节点类型统计耗时分位数
+    async with db.execute("PRAGMA table_info(execution_history)") as cursor:
+        columns = {row[1] for row in await cursor.fetchall()}
+    if "duration_ms" not in columns:
+        await db.execute("ALTER TABLE execution_history ADD COLUMN duration_ms REAL")
+    if "peak_memory_bytes" not in columns:
+        await db.execute("ALTER TABLE execution_history ADD COLUMN peak_memory_bytes INTEGER")
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS node_executions (
+            run_id TEXT NOT NULL,
+            node_id TEXT NOT NULL,
+            node_type TEXT,
+            status TEXT,
+            duration_ms REAL,
+            input_rows INTEGER,
+            output_rows INTEGER,
+            output_bytes INTEGER,
+            error TEXT,
+            PRIMARY KEY (run_id, node_id),
+            FOREIGN KEY (run_id) REFERENCES execution_history (id)
+        )
+    """)
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_node_executions_type ON node_executions (node_type, status)")
+
+
+async def _add_chat_sessions(db: aiosqlite.Connection) -> None:
+    # AI 对话会话（JSON），多个 worker 共享；updated_at 为 Unix 秒，用于过期清理
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS chat_sessions (
+            id TEXT PRIMARY KEY,
+            data TEXT NOT NULL,
+            updated_at REAL NOT NULL
+        )
+    """)
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_chat_sessions_updated ON chat_sessions (updated_at)")
+
+
+_MIGRATIONS: List[Tuple[int, Callable[[aiosqlite.Connection], Awaitable[None]]]] = [
+    (1, _create_base_tables),
+    (2, _add_content_hash),
+    (3, _add_list_indexes),
+    (4, _add_run_metrics),
+    (5, _add_chat_sessions),
+]
+
 
 async def init_db():
-    """初始化数据库表"""
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        # 工作流表
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS workflows (
-                id TEXT PRIMARY KEY,
-                name TEXT NOT NULL,
-                description TEXT,
-                config TEXT NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        
-        # 执行历史表
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS execution_history (
-                id TEXT PRIMARY KEY,
-                workflow_id TEXT,
-                input_files TEXT,
-                output_file TEXT,
-                status TEXT,
-                result_summary TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (workflow_id) REFERENCES workflows (id)
-            )
-        """)
-        
-        # 上传文件记录表
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS uploaded_files (
-                id TEXT PRIMARY KEY,
-                filename TEXT NOT NULL,
-                original_name TEXT NOT NULL,
-                file_path TEXT NOT NULL,
-                sheets TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        
-        await db.commit()
-
-
-async def get_db():
-    """获取数据库连接"""
-    return aiosqlite.connect(DATABASE_PATH)
+    """初始化数据库（打开连接池并执行未完成的迁移）"""
+    async with db_pool.write() as db:
+        async with db.execute("PRAGMA user_version") as cursor:
+            current = (await cursor.fetchone())[0]
+        for version, migrate in _MIGRATIONS:
+            if version <= current:
+                continue
+            await migrate(db)
+            await db.execute(f"PRAGMA user_version = {int(version)}")
+            await db.commit()
+            logger.info("[Database] 已迁移到版本 %s: %s", version, migrate.__name__)
+
+
+# ========== 键集分页 ==========
+def encode_cursor(sort_value: Any, row_id: str) -> str:
+    """把最后一行的 (排序值, id) 编码为不透明的分页游标"""
+    raw = json.dumps([sort_value, row_id], ensure_ascii=False, default=str)
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> Tuple[Any, str]:
+    try:
+        sort_value, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8"))
+        return sort_value, str(row_id)
+    except Exception:
+        raise ValueError("无效的分页游标") from None
+
+
+async def fetch_page(columns: str, table: str, sort_column: str, limit: int,
+                     cursor: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """
+    按 (sort_column, id) 倒序的键集分页（走 (sort_column, id) 索引，不随页码变慢）。
+    columns/table/sort_column 只能是代码内的常量。返回 (本页行, 下一页游标或 None)。
+    """
+    sql = f"SELECT {columns}, {sort_column} AS _sort, id AS _id FROM {table}"
+    params: List[Any] = []
+    if cursor:
+        sort_value, row_id = decode_cursor(cursor)
+        sql += f" WHERE ({sort_column}, id) < (?, ?)"
+        params.extend([sort_value, row_id])
+    sql += f" ORDER BY {sort_column} DESC, id DESC LIMIT ?"
+    params.append(int(limit) + 1)
+
+    async with db_pool.read() as db:
+        async with db.execute(sql, params) as cur:
+            rows = [dict(row) for row in await cur.fetchall()]
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]["_sort"], rows[-1]["_id"])
+    for row in rows:
+        row.pop("_sort", None)
+        row.pop("_id", None)
+    return rows, next_cursor
+
+
+async def close_db():
+    """关闭连接池（应用退出时调用）"""
+    await db_pool.close()
@@ -7,7 +7,14 @@ from contextlib import asynccontextmanager
 
 from routers import excel, workflow, ai
 from routers import vision
-from database import init_db
+from config import MAX_UPLOAD_BYTES
+from database import close_db, init_db
+from services.llm_client import close_llm_clients
+from services.pdf_render import shutdown_render_pool
+from services.prompt_cache import prompt_cache
+from services.run_result_store import run_result_store
+from services.upload_storage import UploadSizeLimit
+from services.vision_jobs import vision_jobs
 
 
 @asynccontextmanager
@@ -15,6 +22,13 @@ async def lifespan(app: FastAPI):
     """应用生命周期管理"""
     await init_db()
     yield
+    await workflow.close_runs()
+    await vision_jobs.close()
+    await close_llm_clients()
+    shutdown_render_pool()
+    await prompt_cache.close()
+    run_result_store.close()
+    await close_db()
 
 
 app = FastAPI(
@@ -24,6 +38,9 @@ app = FastAPI(
     lifespan=lifespan
 )
 
+# 上传请求体大小限制（在 multipart 解析之前拒绝超限上传；需位于 CORS 内层）
+app.add_middleware(UploadSizeLimit, limits={"/api/excel/upload": MAX_UPLOAD_BYTES})
+
 # 配置CORS
 app.add_middleware(
     CORSMiddleware,
@@ -3,7 +3,8 @@ AI对话API - 将自然语言转换为工作流
 """
 import json
 import logging
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from typing import Dict, List, Any, Optional
 from services.ai_service import ai_service
@@ -92,7 +93,8 @@ async def chat_start(request: ChatStartRequest):
                         "sheet_name": sheet_name,
                         "columns": sheet_info.get("columns", []),
                         "row_count": sheet_info.get("row_count", 0),
-                        "sample_data": sheet_info.get("sample_data", [])[:3]
+                        # 文件记录中的样例行为 preview（按列顺序的值列表）
+                        "sample_data": (sheet_info.get("sample_data") or sheet_info.get("preview") or [])[:3]
                     })
                     logger.debug(f"[AI-Chat] 获取成功: {file_record['original_name']}/{sheet_name}, {len(sheet_info.get('columns', []))}列")
         except Exception as e:
@@ -102,7 +104,7 @@ async def chat_start(request: ChatStartRequest):
         raise HTTPException(status_code=400, detail="无法获取所选表的信息")
     
     # 启动对话
-    result = ai_chat_service.start_session(request.selected_files, file_metadata)
+    result = await ai_chat_service.start_session(request.selected_files, file_metadata)
     logger.info(f"[AI-Chat] 对话已开始: session_id={result.get('session_id')}")
     
     return result
@@ -118,7 +120,7 @@ async def chat_message(request: ChatMessageRequest):
     if not request.message.strip():
         raise HTTPException(status_code=400, detail="消息不能为空")
     
-    result = ai_chat_service.send_message(request.session_id, request.message)
+    result = await ai_chat_service.send_message(request.session_id, request.message)
     
     if result.get("status") == "error":
         raise HTTPException(status_code=400, detail=result.get("error", "发送失败"))
@@ -127,6 +129,36 @@ async def chat_message(request: ChatMessageRequest):
     return result
 
 
+def _sse(event: str, data: Any) -> str:
+    payload = json.dumps(data, ensure_ascii=False)
+    return f"event: {event}\ndata: {payload}\n\n"
+
+
+@router.post("/chat/message/stream")
+async def chat_message_stream(request: ChatMessageRequest, http_request: Request):
+    """
+    发送消息到AI对话（SSE 流式回复）
+    事件：delta {"text"} → done {"message", "status"}；失败时为 chat_error {"error"}
+    """
+    logger.info(f"[AI-Chat] 收到消息(流式): session={request.session_id}, msg={request.message[:50]}...")
+    
+    if not request.message.strip():
+        raise HTTPException(status_code=400, detail="消息不能为空")
+    
+    async def gen():
+        events = ai_chat_service.stream_message(request.session_id, request.message)
+        try:
+            async for event, data in events:
+                if await http_request.is_disconnected():
+                    logger.info(f"[AI-Chat] 客户端已断开: session={request.session_id}")
+                    break
+                yield _sse("chat_error" if event == "error" else event, data)
+        finally:
+            await events.aclose()
+    
+    return StreamingResponse(gen(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
 @router.post("/chat/generate")
 async def chat_generate(request: ChatGenerateRequest):
     """
@@ -134,7 +166,7 @@ async def chat_generate(request: ChatGenerateRequest):
     """
     logger.info(f"[AI-Chat] 确认生成: session={request.session_id}")
     
-    result = ai_chat_service.generate_workflow(request.session_id)
+    result = await ai_chat_service.generate_workflow(request.session_id)
     
     if result.get("status") == "error":
         raise HTTPException(status_code=400, detail=result.get("error", "生成失败"))
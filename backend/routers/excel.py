@@ -4,14 +4,25 @@ Excel文件上传和解析API
 import os
 import uuid
 import json
+import asyncio
+import logging
 from fastapi import APIRouter, UploadFile, File, HTTPException
 from fastapi.responses import FileResponse
-from typing import List
+from typing import List, Optional, Set
 from services.excel_service import ExcelService
-from config import UPLOAD_DIR
+from services.columnar_cache import columnar_cache
+from services.file_registry import file_registry
+from services.upload_storage import UploadTooLarge, commit_upload, discard, stage_upload
+from config import LIST_PAGE_DEFAULT, LIST_PAGE_MAX, SHEET_PREVIEW_MAX_ROWS, UPLOAD_DIR
 
 router = APIRouter()
 excel_service = ExcelService()
+logger = logging.getLogger(__name__)
+
+# 去重查找 + 写记录、删记录 + 引用计数 需要互斥，避免并发上传/删除同一内容时误删文件
+_blob_lock = asyncio.Lock()
+# 后台行数统计任务的引用（事件循环只持有弱引用，未被引用的任务可能在完成前被回收）
+_background_tasks: Set[asyncio.Task] = set()
 
 
 @router.post("/upload")
@@ -35,47 +46,117 @@ async def upload_excel(file: UploadFile = File(...)):
     saved_filename = f"{file_id}_{file.filename}"
     file_path = os.path.join(UPLOAD_DIR, saved_filename)
     
-    # 保存文件
-    content = await file.read()
-    with open(file_path, "wb") as f:
-        f.write(content)
-    
-    # 解析Excel获取Sheet信息
+    # 分块流式写入临时文件（边写边算 SHA-256，超限中止）
     try:
-        parsed_info = excel_service.parse_excel(file_path)
-    except Exception as e:
-        os.remove(file_path)
-        raise HTTPException(status_code=400, detail=f"解析Excel失败: {str(e)}")
-    
-    # 保存文件记录
-    await excel_service.save_file_record(
-        file_id=file_id,
-        filename=saved_filename,
-        original_name=file.filename,
-        file_path=file_path,
-        sheets=parsed_info["sheets"]
-    )
+        staged = await stage_upload(file)
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+
+    # Sheet 元数据在锁外解析（直接读临时文件，线程中执行）；锁内只做去重查找、改名/丢弃、写记录。
+    # 预查时已有相同内容的文件则不解析；若该文件在取得锁之前被删除，解析后再进锁一次
+    parsed_info = None
+    while True:
+        if parsed_info is None and not await _find_blob(staged.sha256):
+            try:
+                parsed_info = await asyncio.to_thread(excel_service.parse_excel, staged.tmp_path)
+            except Exception as e:
+                discard(staged.tmp_path)
+                raise HTTPException(status_code=400, detail=f"解析Excel失败: {str(e)}")
+
+        async with _blob_lock:
+            # 内容相同的文件已存在：复用已存文件、Sheet 元数据与列式缓存，只新增一条记录
+            existing = await _find_blob(staged.sha256)
+            if existing:
+                discard(staged.tmp_path)
+                file_path = existing["file_path"]
+                saved_filename = existing["filename"]
+                sheets = json.loads(existing["sheets"]) if existing["sheets"] else []
+                timings = None
+                deduplicated = True
+            elif parsed_info is not None:
+                commit_upload(staged, file_path)
+                sheets = parsed_info["sheets"]
+                timings = parsed_info.get("timings")
+                deduplicated = False
+            else:
+                continue
+
+            # 保存文件记录
+            await excel_service.save_file_record(
+                file_id=file_id,
+                filename=saved_filename,
+                original_name=file.filename,
+                file_path=file_path,
+                sheets=sheets,
+                content_hash=staged.sha256
+            )
+            break
+    file_registry.register(file_id, file_path, staged.sha256)
+
+    # 后台统计精确行数（dimension 给出的行数可能不准）
+    inexact = [s["name"] for s in sheets if not s.get("row_count_exact", True)]
+    if inexact:
+        task = asyncio.create_task(_refresh_row_counts(file_path, inexact))
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
+
+    # 后台把各Sheet物化为列式缓存（按内容哈希存放，已有的条目会跳过），后续预览/数据源节点直接读缓存
+    columnar_cache.schedule_materialize(staged.sha256, file_path, [s["name"] for s in sheets])
     
     return {
         "file_id": file_id,
         "filename": file.filename,
-        "sheets": parsed_info["sheets"]
+        "sheets": sheets,
+        "content_hash": staged.sha256,
+        "size": staged.size,
+        "deduplicated": deduplicated,
+        "timings": timings
     }
 
 
+async def _find_blob(content_hash: str) -> Optional[dict]:
+    """内容哈希相同且文件仍在的已有记录"""
+    existing = await excel_service.find_by_content_hash(content_hash)
+    if existing and os.path.exists(existing["file_path"]):
+        return existing
+    return None
+
+
+async def _refresh_row_counts(file_path: str, sheet_names: List[str]) -> None:
+    try:
+        counts = await asyncio.to_thread(excel_service.count_exact_rows, file_path, sheet_names)
+        await excel_service.update_sheet_row_counts(file_path, counts)
+    except Exception as e:
+        logger.warning("[Excel] 精确行数统计失败: file=%s error=%s", file_path, e)
+
+
 @router.get("/files")
-async def get_uploaded_files():
-    """获取所有已上传的文件列表"""
-    files = await excel_service.get_all_files()
+async def get_uploaded_files(limit: int = LIST_PAGE_DEFAULT, cursor: Optional[str] = None, include_sheets: bool = False):
+    """
+    分页获取已上传的文件列表（按上传时间倒序）
+
+    Args:
+        limit: 每页条数，最大 LIST_PAGE_MAX
+        cursor: 上一页返回的 next_cursor
+        include_sheets: 是否返回 sheets 元数据（含预览，较大）
+    """
+    limit = max(1, min(limit, LIST_PAGE_MAX))
+    try:
+        files, next_cursor = await excel_service.list_files(limit, cursor, include_sheets)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     result = []
     for f in files:
-        result.append({
+        item = {
             "file_id": f["id"],
             "filename": f["original_name"],
-            "sheets": json.loads(f["sheets"]) if f["sheets"] else [],
+            "content_hash": f["content_hash"],
             "created_at": f["created_at"]
-        })
-    return {"files": result}
+        }
+        if include_sheets:
+            item["sheets"] = json.loads(f["sheets"]) if f["sheets"] else []
+        result.append(item)
+    return {"files": result, "next_cursor": next_cursor}
 
 
 @router.get("/file/{file_id}")
@@ -94,31 +175,52 @@ async def get_file_info(file_id: str):
 
 
 @router.get("/file/{file_id}/sheet/{sheet_name}/preview")
-async def preview_sheet(file_id: str, sheet_name: str, rows: int = 10):
+async def preview_sheet(file_id: str, sheet_name: str, rows: int = 10, offset: int = 0):
     """
-    预览Sheet数据
+    预览Sheet数据（只读取请求的行窗口）
     
     Args:
         file_id: 文件ID
         sheet_name: Sheet名称
-        rows: 预览行数，默认10行
+        rows: 预览行数，默认10行，最大 SHEET_PREVIEW_MAX_ROWS
+        offset: 起始数据行（从0开始），用于分页
     """
     file_record = await excel_service.get_file_record(file_id)
     if not file_record:
         raise HTTPException(status_code=404, detail="文件不存在")
+
+    rows = max(1, min(rows, SHEET_PREVIEW_MAX_ROWS))
+    offset = max(0, offset)
     
     try:
-        df = excel_service.read_sheet_as_dataframe(file_record["file_path"], sheet_name)
-        preview_df = df.head(rows)
-        
-        return {
-            "columns": list(df.columns),
-            "data": preview_df.fillna("").to_dict(orient="records"),
-            "total_rows": len(df)
-        }
+        cache_key = file_record.get("content_hash") or file_id
+        df, cached_rows = await asyncio.to_thread(
+            excel_service.read_sheet_window, file_record["file_path"], sheet_name, offset, rows, cache_key
+        )
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"读取Sheet失败: {str(e)}")
 
+    # 总行数：列式缓存记录的精确值优先，其次上传时的元数据
+    sheet_meta = next(
+        (s for s in (json.loads(file_record["sheets"]) if file_record["sheets"] else []) if s.get("name") == sheet_name),
+        {}
+    )
+    if cached_rows is not None:
+        total_rows, total_exact = cached_rows, True
+    else:
+        total_rows = int(sheet_meta.get("row_count") or 0)
+        total_exact = bool(sheet_meta.get("row_count_exact", False))
+        total_rows = max(total_rows, offset + len(df))
+
+    return {
+        "columns": list(df.columns),
+        "data": df.fillna("").to_dict(orient="records"),
+        "total_rows": total_rows,
+        "total_exact": total_exact,
+        "offset": offset,
+        "rows": len(df)
+    }
+
 
 @router.delete("/file/{file_id}")
 async def delete_file(file_id: str):
@@ -127,11 +229,15 @@ async def delete_file(file_id: str):
     if not file_record:
         raise HTTPException(status_code=404, detail="文件不存在")
     
-    # 删除物理文件
-    if os.path.exists(file_record["file_path"]):
-        os.remove(file_record["file_path"])
-    
-    # 从数据库删除记录
-    await excel_service.delete_file_record(file_id)
+    async with _blob_lock:
+        # 从数据库删除记录
+        await excel_service.delete_file_record(file_id)
+        file_registry.forget(file_id)
+
+        # 内容去重后多条记录共用一个文件：最后一条记录删除时才删除物理文件与列式缓存
+        if await excel_service.count_file_path_refs(file_record["file_path"]) == 0:
+            if os.path.exists(file_record["file_path"]):
+                os.remove(file_record["file_path"])
+            columnar_cache.invalidate(file_record.get("content_hash") or file_id)
     
     return {"message": "文件已删除"}
@@ -1,20 +1,28 @@
 """
 Vision API - 识图提取（多模态大模型）
+
+单图任务：/extract-text/start（PDF 只取第一页）；
+批量任务：/extract-text/batch/start，多张图片与多页 PDF（全部页面，进程池渲染），
+各页并发识别（VISION_PAGE_CONCURRENCY），通过同一个 SSE 通道推送带页码的事件。
+发送前统一缩放、重新编码（services/image_prep），大小变化在 image 字段中返回。
+任务的排队、并发上限、事件缓冲与过期清理见 services/vision_jobs。
 """
 
 import asyncio
 import base64
 import json
-import time
-import uuid
-from dataclasses import dataclass
-from typing import Any, Optional
+from typing import Any, Awaitable, Callable, List, Optional, Tuple
 
 from fastapi import APIRouter, File, Form, HTTPException, Request, UploadFile
 from fastapi.responses import StreamingResponse
 
-from config import ARK_API_KEY, ARK_BASE_URL, ARK_MODEL_NAME
-from openai import AsyncOpenAI  # type: ignore
+from config import ARK_API_KEY, ARK_MODEL_NAME, VISION_MAX_BATCH_FILES, VISION_PAGE_CONCURRENCY
+from services.image_prep import PreparedImage, merge_stats, prepare_image
+from services.job_events import TERMINAL_STAGES, iter_events
+from services.llm_client import llm_clients
+from services.pdf_render import PdfRenderError, count_pdf_pages, iter_pdf_pages, render_page
+from services.upload_storage import UploadTooLarge, read_limited
+from services.vision_jobs import JobQueueFull, VisionJob, vision_jobs
 
 router = APIRouter()
 _MAX_IMAGE_BYTES = 8 * 1024 * 1024
@@ -31,21 +39,6 @@ def _sse(event: str, data: Any) -> str:
     return f"event: {event}\ndata: {payload}\n\n"
 
 
-@dataclass
-class _Job:
-    id: str
-    created_at: float
-    queue: "asyncio.Queue[dict]"
-    task: Optional[asyncio.Task]
-    cancelled: bool = False
-    seq: int = 0
-    text_acc: str = ""
-    stage: str = "idle"
-
-
-_JOBS: dict[str, _Job] = {}
-
-
 def _require_key() -> None:
     if not ARK_API_KEY:
         raise HTTPException(status_code=500, detail="ARK_API_KEY 未配置")
@@ -60,6 +53,16 @@ def _validate_image_upload(file: UploadFile, image_bytes: bytes) -> None:
         raise HTTPException(status_code=413, detail="图片过大（请小于 8MB）")
 
 
+async def _read_upload(file: UploadFile) -> bytes:
+    """分块读取上传内容，超过 8MB 立即中止（不先把整个文件读进内存）"""
+    try:
+        return await read_limited(file, _MAX_IMAGE_BYTES)
+    except UploadTooLarge:
+        if _is_pdf_upload(file):
+            raise HTTPException(status_code=413, detail="PDF too large (max 8MB)")
+        raise HTTPException(status_code=413, detail="图片过大（请小于 8MB）")
+
+
 def _is_pdf_upload(file: UploadFile) -> bool:
     content_type = (file.content_type or "").lower()
     if content_type == "application/pdf":
@@ -75,93 +78,70 @@ def _validate_pdf_upload(pdf_bytes: bytes) -> None:
         raise HTTPException(status_code=413, detail="PDF too large (max 8MB)")
 
 
-def _convert_pdf_to_image(pdf_bytes: bytes) -> bytes:
+def _convert_pdf_to_image(pdf_bytes: bytes) -> PreparedImage:
+    """渲染 PDF 第一页（已缩放、重新编码）"""
     try:
-        import fitz  # type: ignore
-    except Exception as e:
+        return render_page(pdf_bytes, 0)
+    except ImportError as e:
         raise HTTPException(status_code=500, detail=f"Missing PDF dependency: {e}")
-
-    try:
-        doc = fitz.open(stream=pdf_bytes, filetype="pdf")
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"PDF open failed: {e}")
-
-    try:
-        if doc.page_count < 1:
-            raise HTTPException(status_code=400, detail="PDF has no pages")
-        page = doc.load_page(0)
-        pix = page.get_pixmap(matrix=fitz.Matrix(2, 2), alpha=False)
-        return pix.tobytes("png")
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"PDF render failed: {e}")
-    finally:
-        try:
-            doc.close()
-        except Exception:
-            pass
+    except PdfRenderError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 
-def _prepare_upload(file: UploadFile, raw_bytes: bytes) -> tuple[bytes, Optional[str]]:
+async def _prepare_upload(file: UploadFile, raw_bytes: bytes) -> PreparedImage:
+    """校验上传内容并预处理为待发送的图片（渲染 / 缩放 / 编码在线程中执行）"""
     if _is_pdf_upload(file):
         _validate_pdf_upload(raw_bytes)
-        image_bytes = _convert_pdf_to_image(raw_bytes)
-        if not image_bytes:
+        image = await asyncio.to_thread(_convert_pdf_to_image, raw_bytes)
+        if not image.data:
             raise HTTPException(status_code=400, detail="PDF render empty")
-        if len(image_bytes) > _MAX_IMAGE_BYTES:
-            raise HTTPException(status_code=413, detail="PDF render too large (max 8MB)")
-        return image_bytes, "image/png"
-    _validate_image_upload(file, raw_bytes)
-    return raw_bytes, file.content_type
+    else:
+        _validate_image_upload(file, raw_bytes)
+        image = await asyncio.to_thread(prepare_image, raw_bytes, file.content_type)
+    if len(image.data) > _MAX_IMAGE_BYTES:
+        raise HTTPException(status_code=413, detail="图片过大（请小于 8MB）")
+    return image
 
 
 def _get_openai_client():
     try:
-        return AsyncOpenAI(api_key=ARK_API_KEY, base_url=ARK_BASE_URL, timeout=60.0)
+        return llm_clients.async_openai().with_options(timeout=60.0)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"缺少 openai 依赖: {e}")
 
 
-async def _emit(job: _Job, event: str, data: dict) -> None:
-    job.seq += 1
-    payload = dict(data or {})
-    payload["seq"] = job.seq
-    await job.queue.put({"event": event, "data": payload, "ts": time.time()})
-
-
-async def _run_job(job: _Job, image_bytes: bytes, content_type: Optional[str], prompt: str) -> None:
-    await _emit(job, "stage", {"stage": "upload_received"})
-    job.stage = "upload_received"
-
-    client = _get_openai_client()
-    data_url = _to_data_url(image_bytes, content_type)
-    safe_prompt = (prompt or "").strip() or "请提取图片中的所有文字，按原顺序输出。只输出文字，不要添加解释。"
-
-    await _emit(job, "stage", {"stage": "model_request_started"})
-    job.stage = "model_request_started"
-
+def _image_messages(data_url: str, prompt: str) -> list:
+    return [
+        {
+            "role": "user",
+            "content": [
+                {"type": "image_url", "image_url": {"url": data_url}},
+                {"type": "text", "text": prompt},
+            ],
+        }
+    ]
+
+
+async def _extract_text(
+    client,
+    job: VisionJob,
+    data_url: str,
+    prompt: str,
+    on_generating: Callable[[], Awaitable[None]],
+    on_delta: Callable[[str, str], Awaitable[None]],
+) -> str:
+    """识别一张图片：优先流式（on_delta(片段, 累计文本)），流式不可用时退回一次性请求；占用一个全局模型调用名额"""
     text_acc = ""
-    try:
-        # Prefer real token streaming if available.
+    async with vision_jobs.model_slots:
         try:
             stream = await client.chat.completions.create(
                 model=ARK_MODEL_NAME,
-                messages=[
-                    {
-                        "role": "user",
-                        "content": [
-                            {"type": "image_url", "image_url": {"url": data_url}},
-                            {"type": "text", "text": safe_prompt},
-                        ],
-                    }
-                ],
+                messages=_image_messages(data_url, prompt),
                 temperature=0.1,
                 stream=True,
             )
 
-            await _emit(job, "stage", {"stage": "generating"})
-            job.stage = "generating"
+            await on_generating()
             async for chunk in stream:
                 if job.cancelled:
                     raise asyncio.CancelledError()
@@ -172,61 +152,165 @@ async def _run_job(job: _Job, image_bytes: bytes, content_type: Optional[str], p
                     delta = ""
                 if delta:
                     text_acc += delta
-                    job.text_acc = text_acc
-                    await _emit(job, "delta", {"text": delta})
-            job.text_acc = text_acc
-            job.stage = "done"
-            await _emit(job, "done", {"text": text_acc})
-            return
+                    await on_delta(delta, text_acc)
+            return text_acc
         except Exception:
             # Fallback to non-streaming response (still returns stages, but no token deltas).
-            await _emit(job, "stage", {"stage": "generating"})
-            job.stage = "generating"
+            await on_generating()
             response = await client.chat.completions.create(
                 model=ARK_MODEL_NAME,
-                messages=[
-                    {
-                        "role": "user",
-                        "content": [
-                            {"type": "image_url", "image_url": {"url": data_url}},
-                            {"type": "text", "text": safe_prompt},
-                        ],
-                    }
-                ],
+                messages=_image_messages(data_url, prompt),
                 temperature=0.1,
                 stream=False,
             )
-            text_acc = response.choices[0].message.content or ""
-            job.text_acc = text_acc
-            job.stage = "done"
-            await _emit(job, "done", {"text": text_acc})
-            return
+            return response.choices[0].message.content or ""
+
+
+def _safe_prompt(prompt: str) -> str:
+    return (prompt or "").strip() or "请提取图片中的所有文字，按原顺序输出。只输出文字，不要添加解释。"
+
+
+async def _run_job(job: VisionJob, image: PreparedImage, prompt: str) -> None:
+    job.emit("stage", {"stage": "upload_received", "image": image.stats()})
+    job.stage = "upload_received"
+
+    client = _get_openai_client()
+    data_url = _to_data_url(image.data, image.mime)
+    safe_prompt = _safe_prompt(prompt)
+
+    job.emit("stage", {"stage": "model_request_started"})
+    job.stage = "model_request_started"
+
+    async def on_generating() -> None:
+        job.emit("stage", {"stage": "generating"})
+        job.stage = "generating"
+
+    async def on_delta(delta: str, text: str) -> None:
+        job.text_acc = text
+        job.emit("delta", {"text": delta})
+
+    try:
+        text_acc = await _extract_text(client, job, data_url, safe_prompt, on_generating, on_delta)
+        job.text_acc = text_acc
+        job.stage = "done"
+        job.emit("done", {"text": text_acc, "image": image.stats()})
     except asyncio.CancelledError:
         job.stage = "cancelled"
-        await _emit(job, "cancelled", {"message": "已取消"})
-        return
+        job.emit("cancelled", {"message": "已取消"})
     except Exception as e:
         job.stage = "job_error"
-        await _emit(job, "job_error", {"message": f"识图提取失败: {e}"})
-        return
-    finally:
-        job.text_acc = text_acc
-        # allow SSE generator to finish, then cleanup
-        await asyncio.sleep(0.1)
+        job.emit("job_error", {"message": f"识图提取失败: {e}"})
+
 
+async def _plan_pages(uploads: List[Tuple[str, bytes, Optional[str], bool]]) -> List[Tuple[int, int]]:
+    """每个上传文件对应的 (起始页下标, 页数)；PDF 只读取页数，不渲染"""
+    plan = []
+    offset = 0
+    for _, data, _, is_pdf in uploads:
+        count = await count_pdf_pages(data) if is_pdf else 1
+        plan.append((offset, count))
+        offset += count
+    return plan
 
-def _cleanup_job_later(job_id: str, delay_s: float = 1800.0) -> None:
-    async def _cleanup():
-        await asyncio.sleep(delay_s)
-        job = _JOBS.get(job_id)
-        if job and job.stage not in {"done", "job_error", "cancelled"}:
-            return
-        _JOBS.pop(job_id, None)
 
+async def _run_batch_job(job: VisionJob, uploads: List[Tuple[str, bytes, Optional[str], bool]], prompt: str) -> None:
+    """
+    批量识别：page_started / page_delta / page_done / page_error 事件带 page（从 0 开始）与 label；
+    全部结束后 done 的 text 为按页拼接的结果，pages 为逐页明细。单页失败不影响其他页。
+    """
     try:
-        asyncio.create_task(_cleanup())
-    except Exception:
-        _JOBS.pop(job_id, None)
+        job.emit("stage", {"stage": "upload_received"})
+        plan = await _plan_pages(uploads)
+        labels: List[str] = []
+        for (name, _, _, _), (_, count) in zip(uploads, plan):
+            labels.extend([name] if count == 1 else [f"{name} 第{i}页" for i in range(1, count + 1)])
+        job.page_labels = labels
+        job.pages = [""] * len(labels)
+        total = len(labels)
+        job.emit("pages", {"total": total, "labels": labels})
+
+        client = _get_openai_client()
+        safe_prompt = _safe_prompt(prompt)
+        sem = asyncio.Semaphore(max(1, VISION_PAGE_CONCURRENCY))
+        errors: dict[int, str] = {}
+        finished = 0
+        job.stage = "model_request_started"
+        job.emit("stage", {"stage": "model_request_started"})
+
+        async def on_generating() -> None:
+            if job.stage != "generating":
+                job.stage = "generating"
+                job.emit("stage", {"stage": "generating"})
+
+        image_stats: dict[int, dict] = {}
+
+        async def run_page(index: int, image: PreparedImage) -> None:
+            nonlocal finished
+            label = labels[index]
+            image_stats[index] = image.stats()
+            async with sem:
+                job.emit("page_started", {"page": index, "label": label, "total": total})
+
+                async def on_delta(delta: str, text: str) -> None:
+                    job.pages[index] = text
+                    job.emit("page_delta", {"page": index, "text": delta})
+
+                try:
+                    text = await _extract_text(
+                        client, job, _to_data_url(image.data, image.mime), safe_prompt, on_generating, on_delta
+                    )
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    errors[index] = str(e)
+                    finished += 1
+                    job.emit("page_error", {"page": index, "label": label, "message": f"识图提取失败: {e}"})
+                    return
+            job.pages[index] = text
+            finished += 1
+            job.emit("page_done", {"page": index, "label": label, "text": text,
+                                           "done": finished, "total": total, "image": image_stats[index]})
+
+        async def prepare_and_run(index: int, data: bytes, content_type: Optional[str]) -> None:
+            await run_page(index, await asyncio.to_thread(prepare_image, data, content_type))
+
+        # PDF 边渲染边识别：每渲染完一页就开始请求模型
+        tasks: List[asyncio.Task] = []
+        try:
+            for (name, data, content_type, is_pdf), (offset, _) in zip(uploads, plan):
+                if not is_pdf:
+                    tasks.append(asyncio.create_task(prepare_and_run(offset, data, content_type)))
+                    continue
+                async for page_index, image in iter_pdf_pages(data):
+                    tasks.append(asyncio.create_task(run_page(offset + page_index, image)))
+            uploads.clear()  # 原始上传内容不再需要
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+        if errors and len(errors) == total:
+            raise RuntimeError(next(iter(errors.values())))
+
+        job.text_acc = job.full_text()
+        job.stage = "done"
+        job.emit("done", {
+            "text": job.text_acc,
+            "pages": [
+                {"page": i, "label": label, "text": job.pages[i], "error": errors.get(i)}
+                for i, label in enumerate(job.page_labels)
+            ],
+            "image": merge_stats(list(image_stats.values())),
+        })
+    except asyncio.CancelledError:
+        job.stage = "cancelled"
+        job.emit("cancelled", {"message": "已取消"})
+    except PdfRenderError as e:
+        job.stage = "job_error"
+        job.emit("job_error", {"message": str(e)})
+    except Exception as e:
+        job.stage = "job_error"
+        job.emit("job_error", {"message": f"识图提取失败: {e}"})
 
 
 # -------------------------
@@ -238,29 +322,22 @@ async def extract_text(file: UploadFile = File(...), prompt: str = Form("请提
     兼容旧版调用：一次性返回结果（无真实进度）
     """
     _require_key()
-    raw_bytes = await file.read()
-    image_bytes, content_type = _prepare_upload(file, raw_bytes)
+    raw_bytes = await _read_upload(file)
+    image = await _prepare_upload(file, raw_bytes)
 
     client = _get_openai_client()
-    data_url = _to_data_url(image_bytes, content_type)
+    data_url = _to_data_url(image.data, image.mime)
     safe_prompt = (prompt or "").strip() or "请提取图片中的所有文字，按原顺序输出。只输出文字，不要添加解释。"
 
     try:
-        response = client.chat.completions.create(
-            model=ARK_MODEL_NAME,
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "image_url", "image_url": {"url": data_url}},
-                        {"type": "text", "text": safe_prompt},
-                    ],
-                }
-            ],
-            temperature=0.1,
-        )
+        async with vision_jobs.model_slots:
+            response = await client.chat.completions.create(
+                model=ARK_MODEL_NAME,
+                messages=_image_messages(data_url, safe_prompt),
+                temperature=0.1,
+            )
         text = response.choices[0].message.content or ""
-        return {"status": "success", "text": text}
+        return {"status": "success", "text": text, "image": image.stats()}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"识图提取失败: {e}")
 
@@ -277,73 +354,85 @@ async def extract_text_start(
     启动识图任务，返回 job_id；前端可用 SSE 订阅真实阶段与流式输出。
     """
     _require_key()
-    raw_bytes = await file.read()
-    image_bytes, content_type = _prepare_upload(file, raw_bytes)
+    _check_capacity()
+    raw_bytes = await _read_upload(file)
+    image = await _prepare_upload(file, raw_bytes)
 
-    job_id = uuid.uuid4().hex[:10]
-    q: "asyncio.Queue[dict]" = asyncio.Queue()
-    job = _Job(id=job_id, created_at=time.time(), queue=q, task=None)
-    _JOBS[job_id] = job
+    job = _submit(lambda job: _run_job(job, image, prompt), len(image.data))
+    return {"status": "success", "job_id": job.id, "position": job.queue_position}
 
-    job.task = asyncio.create_task(_run_job(job, image_bytes, content_type, prompt))
-    _cleanup_job_later(job_id)
-    return {"status": "success", "job_id": job_id}
+
+@router.post("/extract-text/batch/start")
+async def extract_text_batch_start(
+    files: List[UploadFile] = File(...),
+    prompt: str = Form("请提取图片中的所有文字，按原顺序输出。只输出文字，不要添加解释。"),
+):
+    """
+    启动批量识图任务（多张图片 / 多页 PDF），返回 job_id；事件通过 /extract-text/events/{job_id} 订阅。
+    """
+    _require_key()
+    if not files:
+        raise HTTPException(status_code=400, detail="请至少上传一个文件")
+    if len(files) > VISION_MAX_BATCH_FILES:
+        raise HTTPException(status_code=400, detail=f"单次最多上传 {VISION_MAX_BATCH_FILES} 个文件")
+
+    _check_capacity()
+    uploads: List[Tuple[str, bytes, Optional[str], bool]] = []
+    total_bytes = 0
+    for file in files:
+        raw_bytes = await _read_upload(file)
+        total_bytes += len(raw_bytes)
+        _check_capacity(total_bytes)
+        if _is_pdf_upload(file):
+            _validate_pdf_upload(raw_bytes)
+            uploads.append((file.filename or "PDF", raw_bytes, "application/pdf", True))
+        else:
+            _validate_image_upload(file, raw_bytes)
+            uploads.append((file.filename or "图片", raw_bytes, file.content_type, False))
+
+    job = _submit(lambda job: _run_batch_job(job, uploads, prompt), total_bytes)
+    return {"status": "success", "job_id": job.id, "position": job.queue_position}
+
+
+def _check_capacity(nbytes: int = 0) -> None:
+    """读取、预处理上传内容之前预检任务队列，满载时直接 503"""
+    try:
+        vision_jobs.check_capacity(nbytes)
+    except JobQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+
+def _submit(runner, nbytes: int = 0) -> VisionJob:
+    try:
+        return vision_jobs.submit(runner, nbytes)
+    except JobQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e))
 
 
 @router.get("/extract-text/events/{job_id}")
 async def extract_text_events(job_id: str, request: Request, after: int = 0):
     """
-    SSE 事件流：stage/delta/done/job_error/cancelled
-    after：可选，续传序号，大于 0 时先推送一次 snapshot
+    SSE 事件流：stage/queued/delta/done/job_error/cancelled（queued 带排队位置 position）
+    批量任务另有 pages/page_started/page_delta/page_done/page_error（带 page 页码）
+    after：可选，续传序号，大于 0 时先推送一次 snapshot；
+    未带 after 时从缓冲中最早的事件开始推送，订阅方落后到缓冲之外时也改发 snapshot
     """
-    job = _JOBS.get(job_id)
+    job = vision_jobs.get(job_id)
     if not job:
         raise HTTPException(status_code=404, detail="任务不存在或已过期")
 
     async def gen():
         yield _sse("stage", {"stage": "connected"})
-        if after and job.seq >= after:
-            yield _sse(
-                "snapshot",
-                {
-                    "stage": job.stage,
-                    "text": job.text_acc,
-                    "seq": job.seq,
-                    "done": job.stage == "done",
-                    "cancelled": job.stage == "cancelled",
-                },
-            )
-        while True:
-            if await request.is_disconnected():
-                break
-            try:
-                item = await asyncio.wait_for(job.queue.get(), timeout=5.0)
-            except asyncio.TimeoutError:
-                yield _sse("ping", {"ts": time.time()})
-                continue
-
-            event = item.get("event", "message")
-            data = item.get("data", {})
+        async for event, data in iter_events(
+            job.log, after, job.snapshot, lambda: job.stage in TERMINAL_STAGES, request.is_disconnected
+        ):
             yield _sse(event, data)
 
-            if event in {"done", "job_error", "cancelled"}:
-                break
-
     return StreamingResponse(gen(), media_type="text/event-stream")
 
 
 @router.post("/extract-text/cancel/{job_id}")
 async def extract_text_cancel(job_id: str):
-    job = _JOBS.get(job_id)
-    if not job:
+    if not vision_jobs.cancel(job_id):
         return {"status": "success", "message": "任务不存在或已结束"}
-
-    job.cancelled = True
-    job.stage = "cancelled"
-    if job.task and not job.task.done():
-        job.task.cancel()
-    try:
-        await _emit(job, "cancelled", {"message": "已取消"})
-    except Exception:
-        pass
     return {"status": "success", "message": "cancelled"}
@@ -4,14 +4,23 @@
 import os
 import uuid
 import json
+import time
+import asyncio
+from dataclasses import dataclass, field
 from datetime import datetime
-from fastapi import APIRouter, HTTPException
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
 from pydantic import BaseModel
 from typing import Dict, List, Any, Optional
 from services.workflow_engine import workflow_engine
+from services.run_profiler import to_chrome_trace
+from services.job_events import TERMINAL_STAGES as _TERMINAL_STAGES, EventLog, JobSweeper, iter_events
+from services.run_result_store import run_result_store
 from services.excel_service import ExcelService
-from config import UPLOAD_DIR, DATA_DIR
+from config import (
+    UPLOAD_DIR, DATA_DIR, HISTORY_STATS_MAX_RUNS, LIST_PAGE_DEFAULT, LIST_PAGE_MAX, RUN_RESULT_PAGE_MAX,
+    WORKFLOW_RUN_EVENT_BUFFER, WORKFLOW_RUN_SWEEP_INTERVAL_S, WORKFLOW_RUN_TTL_S,
+)
 
 router = APIRouter()
 excel_service = ExcelService()
@@ -28,6 +37,8 @@ class WorkflowExecuteRequest(BaseModel):
     """执行工作流请求"""
     workflow_config: Dict[str, Any]
     file_mapping: Dict[str, str]  # file_id -> file_id（用于查找实际路径）
+    workflow_id: Optional[str] = None  # 已保存的工作流 ID，写入执行历史
+    trace: bool = False  # 同步执行时在响应中附带 Chrome trace
 
 class WorkflowPreviewNodeRequest(BaseModel):
     """预览指定节点输出（样本执行）请求"""
@@ -36,6 +47,7 @@ class WorkflowPreviewNodeRequest(BaseModel):
     node_id: str
     source_rows: Optional[int] = 600  # 数据源最多读取行数
     display_rows: Optional[int] = 50  # 返回展示行数
+    trace: bool = False  # 响应中附带 Chrome trace
 
 
 @router.post("/save")
@@ -74,10 +86,21 @@ async def update_workflow(workflow_id: str, request: WorkflowSaveRequest):
 
 
 @router.get("/list")
-async def list_workflows():
-    """获取所有工作流"""
-    workflows = await workflow_engine.get_all_workflows()
-    return {"workflows": workflows}
+async def list_workflows(limit: int = LIST_PAGE_DEFAULT, cursor: Optional[str] = None, include_config: bool = False):
+    """
+    分页获取工作流（按更新时间倒序）
+
+    Args:
+        limit: 每页条数，最大 LIST_PAGE_MAX
+        cursor: 上一页返回的 next_cursor
+        include_config: 是否返回工作流配置
+    """
+    limit = max(1, min(limit, LIST_PAGE_MAX))
+    try:
+        workflows, next_cursor = await workflow_engine.list_workflows(limit, cursor, include_config)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"workflows": workflows, "next_cursor": next_cursor}
 
 
 @router.get("/{workflow_id}")
@@ -113,8 +136,11 @@ async def execute_workflow(request: WorkflowExecuteRequest):
         # 执行工作流 (使用新的引擎API)
         result = await workflow_engine.execute_workflow(
             request.workflow_config,
-            request.file_mapping
+            request.file_mapping,
+            workflow_id=request.workflow_id
         )
+        if request.trace and result.get("profile"):
+            result["trace"] = to_chrome_trace(result["profile"])
         
         if result.get("success"):
             return result
@@ -129,6 +155,177 @@ async def execute_workflow(request: WorkflowExecuteRequest):
         raise HTTPException(status_code=400, detail={"success": False, "error": f"执行失败: {str(e)}"})
 
 
+# -------------------------
+# 异步运行：提交 → run_id，SSE 订阅节点进度，可取消，结束后取结果
+# -------------------------
+def _sse(event: str, data: Any) -> str:
+    payload = json.dumps(data, ensure_ascii=False)
+    return f"event: {event}\ndata: {payload}\n\n"
+
+
+@dataclass
+class _RunJob:
+    id: str
+    created_at: float
+    task: Optional[asyncio.Task] = None
+    cancelled: bool = False
+    stage: str = "queued"
+    node_status: Optional[Dict[str, str]] = None
+    result: Optional[Dict[str, Any]] = None
+    finished_at: Optional[float] = None
+    log: EventLog = field(default_factory=lambda: EventLog(WORKFLOW_RUN_EVENT_BUFFER))
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {"stage": self.stage, "node_status": self.node_status, "seq": self.log.seq}
+
+
+# 运行结束（进入终态）后保留 WORKFLOW_RUN_TTL_S，由一个周期任务统一清理
+_RUNS: Dict[str, _RunJob] = {}
+_run_sweeper = JobSweeper(_RUNS, WORKFLOW_RUN_TTL_S, WORKFLOW_RUN_SWEEP_INTERVAL_S, "WorkflowRuns")
+
+
+def _emit(job: _RunJob, event: str, data: dict) -> None:
+    if event in _TERMINAL_STAGES:
+        job.finished_at = time.time()
+    job.log.emit(event, data)
+
+
+async def _run_workflow_job(job: _RunJob, workflow_config: Dict[str, Any], file_mapping: Dict[str, str],
+                            workflow_id: Optional[str] = None) -> None:
+    job.stage = "running"
+    _emit(job, "stage", {"stage": "running"})
+
+    async def on_event(event: str, data: Dict[str, Any]) -> None:
+        node_id = data.get("node_id")
+        if node_id:
+            job.node_status[node_id] = {"node_started": "running", "node_progress": "running", "node_done": "success"}.get(event, "error")
+        _emit(job, event, data)
+
+    try:
+        result = await workflow_engine.execute_workflow(
+            workflow_config,
+            file_mapping,
+            run_id=job.id,
+            on_event=on_event,
+            workflow_id=workflow_id
+        )
+        job.result = result
+        if result.get("success"):
+            job.stage = "done"
+            _emit(job, "done", {"success": True, "output_file": result.get("output_file")})
+        else:
+            job.stage = "job_error"
+            _emit(job, "job_error", {"message": result.get("error", "执行失败")})
+    except asyncio.CancelledError:
+        job.stage = "cancelled"
+        for node_id, status in job.node_status.items():
+            if status == "running":
+                job.node_status[node_id] = "cancelled"
+        _emit(job, "cancelled", {"message": "已取消"})
+    except Exception as e:
+        job.stage = "job_error"
+        job.result = {"success": False, "run_id": job.id, "error": f"执行失败: {str(e)}"}
+        _emit(job, "job_error", {"message": f"执行失败: {str(e)}"})
+
+
+def _on_run_task_done(job: _RunJob) -> None:
+    # 兜底：任务异常退出未发终态事件时也能被清理
+    if job.finished_at is None:
+        job.finished_at = time.time()
+
+
+async def close_runs() -> None:
+    """应用退出时取消进行中的运行与清理任务"""
+    tasks = [job.task for job in _RUNS.values() if job.task and not job.task.done()]
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await _run_sweeper.close()
+
+
+@router.post("/runs")
+async def start_run(request: WorkflowExecuteRequest):
+    """
+    异步执行工作流，立即返回 run_id；前端用 SSE 订阅节点进度
+    """
+    run_id = run_result_store.new_run_id()
+    _run_sweeper.ensure_started()
+    job = _RunJob(id=run_id, created_at=time.time())
+    job.node_status = {node.get("id"): "pending" for node in request.workflow_config.get("nodes", []) if node.get("id")}
+    _RUNS[run_id] = job
+
+    job.task = asyncio.create_task(_run_workflow_job(job, request.workflow_config, request.file_mapping, request.workflow_id))
+    job.task.add_done_callback(lambda _: _on_run_task_done(job))
+    return {"status": "success", "run_id": run_id}
+
+
+@router.get("/runs/{run_id}/events")
+async def run_events(run_id: str, request: Request, after: int = 0):
+    """
+    SSE 事件流：stage/node_started/node_progress/node_done/node_error/done/job_error/cancelled
+    after：可选，续传序号，大于 0 时先推送一次 snapshot（各节点当前状态）；
+    未带 after 时从缓冲中最早的事件开始推送，订阅方落后到缓冲之外时也改发 snapshot
+    """
+    job = _RUNS.get(run_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="运行不存在或已过期")
+
+    async def gen():
+        yield _sse("stage", {"stage": "connected"})
+        async for event, data in iter_events(
+            job.log, after, job.snapshot, lambda: job.stage in _TERMINAL_STAGES, request.is_disconnected
+        ):
+            yield _sse(event, data)
+
+    return StreamingResponse(gen(), media_type="text/event-stream")
+
+
+@router.post("/runs/{run_id}/cancel")
+async def cancel_run(run_id: str):
+    """取消运行（已在线程池中执行的节点计算会跑完，但结果被丢弃，后续节点不再启动）"""
+    job = _RUNS.get(run_id)
+    if not job or job.stage in _TERMINAL_STAGES:
+        return {"status": "success", "message": "运行不存在或已结束"}
+
+    job.cancelled = True
+    if job.stage == "queued":
+        # 任务尚未开始执行时取消不会进入 _run_workflow_job 的异常处理，这里直接补发事件
+        job.stage = "cancelled"
+        _emit(job, "cancelled", {"message": "已取消"})
+    if job.task and not job.task.done():
+        job.task.cancel()
+    return {"status": "success", "message": "cancelled"}
+
+
+@router.get("/runs/{run_id}")
+async def get_run(run_id: str):
+    """查询运行状态；结束后附带与 /execute 相同结构的执行结果"""
+    job = _RUNS.get(run_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="运行不存在或已过期")
+    return {
+        "run_id": run_id,
+        "stage": job.stage,
+        "node_status": job.node_status,
+        "result": job.result,
+    }
+
+
+@router.get("/runs/{run_id}/trace")
+async def get_run_trace(run_id: str):
+    """下载运行的 Chrome trace（chrome://tracing 或 Perfetto 打开），运行结束后可用"""
+    job = _RUNS.get(run_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="运行不存在或已过期")
+    profile = (job.result or {}).get("profile")
+    if not profile:
+        raise HTTPException(status_code=409, detail="运行尚未结束或没有剖析数据")
+    return JSONResponse(
+        to_chrome_trace(profile),
+        headers={"Content-Disposition": f'attachment; filename="trace-{run_id}.json"'},
+    )
+
+
 @router.post("/preview-node")
 async def preview_node(request: WorkflowPreviewNodeRequest):
     """
@@ -144,6 +341,8 @@ async def preview_node(request: WorkflowPreviewNodeRequest):
             source_rows=int(request.source_rows or 600),
             display_rows=int(request.display_rows or 50)
         )
+        if request.trace and result.get("profile"):
+            result["trace"] = to_chrome_trace(result["profile"])
 
         if result.get("success"):
             return result
@@ -157,11 +356,51 @@ async def preview_node(request: WorkflowPreviewNodeRequest):
         raise HTTPException(status_code=400, detail={"success": False, "error": f"预览失败: {str(e)}"})
 
 
+@router.get("/runs/{run_id}/nodes/{node_id}/rows")
+def get_run_node_rows(run_id: str, node_id: str, offset: int = 0, limit: int = 100):
+    """
+    分页读取某次运行中某个节点的完整输出
+
+    Args:
+        offset: 起始行（从0开始）
+        limit: 返回行数，最大 RUN_RESULT_PAGE_MAX
+
+    普通函数：FastAPI 在线程池中执行，读取落盘结果不阻塞事件循环
+    """
+    offset = max(0, offset)
+    limit = max(1, min(limit, RUN_RESULT_PAGE_MAX))
+    page = workflow_engine.get_run_rows(run_id, node_id, offset, limit)
+    if page is None:
+        raise HTTPException(status_code=404, detail="运行结果不存在或已过期")
+    return page
+
+
 @router.get("/history/list")
-async def get_execution_history(limit: int = 50):
-    """获取执行历史"""
-    history = await workflow_engine.get_execution_history(limit)
-    return {"history": history}
+async def get_execution_history(limit: int = 50, cursor: Optional[str] = None, include_summary: bool = False):
+    """分页获取执行历史（按执行时间倒序）"""
+    limit = max(1, min(limit, LIST_PAGE_MAX))
+    try:
+        history, next_cursor = await workflow_engine.get_execution_history(limit, cursor, include_summary)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"history": history, "next_cursor": next_cursor}
+
+
+@router.get("/history/node-stats")
+async def get_node_duration_stats(workflow_id: Optional[str] = None, max_runs: int = HISTORY_STATS_MAX_RUNS):
+    """按节点类型汇总最近运行的节点耗时（p50/p95/max），可按工作流过滤"""
+    max_runs = max(1, min(max_runs, HISTORY_STATS_MAX_RUNS))
+    stats = await workflow_engine.get_node_duration_stats(workflow_id, max_runs)
+    return {"stats": stats, "max_runs": max_runs}
+
+
+@router.get("/history/runs/{run_id}")
+async def get_execution_detail(run_id: str):
+    """单次运行的历史记录与各节点耗时、行数"""
+    detail = await workflow_engine.get_execution_detail(run_id)
+    if detail is None:
+        raise HTTPException(status_code=404, detail="执行记录不存在")
+    return detail
 
 
 @router.get("/download/{filename}")
@@ -1,31 +1,54 @@
 """
 AI Chat Service - 交互式工作流生成器
 支持多轮对话，先选表再对话模式
+
+模型调用使用共享连接池上的 AsyncOpenAI，不阻塞事件循环；stream_message 逐段返回回复，供 SSE 推送。
+一轮对话成功后才把用户消息与回复一起写入会话，失败或中途断开不会留下没有回复的用户消息。
+
+上下文控制：
+- 表结构使用精简描述（列名 + 示例值，见 chat_context），按表元数据缓存；
+- 每次请求前估算 token，超过 CHAT_CONTEXT_TOKEN_BUDGET 时把较早的对话交给模型压缩成摘要，
+  摘要附在系统提示词之后，会话中只保留最近的消息；
+- 本轮保存后消息数会超过 CHAT_SESSION_MAX_MESSAGES 时同样先摘要，避免会话存储按条数截断时
+  直接丢掉尚未摘要的早期对话；
+- 生成工作流的长指令只用于当次请求，历史中记一条简短的占位消息。
 """
 import logging
 import uuid
-from typing import Dict, List, Optional
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
 from datetime import datetime
-from openai import OpenAI
-from config import ARK_API_KEY, ARK_BASE_URL, ARK_MODEL_NAME
+from config import (
+    ARK_MODEL_NAME,
+    CHAT_CONTEXT_TOKEN_BUDGET,
+    CHAT_KEEP_RECENT_MESSAGES,
+    CHAT_SESSION_MAX_MESSAGES,
+    CHAT_SUMMARY_MAX_TOKENS,
+)
+from services.chat_context import compact_tables_context, message_tokens, messages_tokens
+from services.chat_session_store import chat_session_store
+from services.llm_client import llm_clients
+
+# 每轮对话保存时追加的消息数（提问 + 回复）
+_MESSAGES_PER_TURN = 2
 
 # 配置日志
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
-# 会话存储 (生产环境应使用Redis)
-chat_sessions: Dict[str, dict] = {}
-
 
 class AIChatService:
     """AI对话服务 - 交互式工作流生成"""
     
     def __init__(self):
         logger.info("[AIChatService] 初始化AI对话服务")
-        self.client = OpenAI(api_key=ARK_API_KEY, base_url=ARK_BASE_URL)
         self.model = ARK_MODEL_NAME
+
+    @property
+    def client(self):
+        """当前事件循环的共享 AsyncOpenAI"""
+        return llm_clients.async_openai()
         
-    def start_session(self, selected_files: List[dict], file_metadata: List[dict]) -> dict:
+    async def start_session(self, selected_files: List[dict], file_metadata: List[dict]) -> dict:
         """
         开始新的对话会话
         
@@ -49,7 +72,7 @@ class AIChatService:
         system_prompt = self._build_system_prompt(tables_context)
         
         # 初始化会话
-        chat_sessions[session_id] = {
+        session = {
             "created_at": datetime.now().isoformat(),
             "selected_files": selected_files,
             "file_metadata": file_metadata,
@@ -66,10 +89,11 @@ class AIChatService:
         logger.info(f"[AIChatService] AI开场白: {opening_message[:100]}...")
         
         # 保存AI消息
-        chat_sessions[session_id]["messages"].append({
+        session["messages"].append({
             "role": "assistant",
             "content": opening_message
         })
+        await chat_session_store.save(session_id, session)
         
         return {
             "session_id": session_id,
@@ -77,7 +101,7 @@ class AIChatService:
             "status": "clarifying"
         }
     
-    def send_message(self, session_id: str, user_message: str) -> dict:
+    async def send_message(self, session_id: str, user_message: str) -> dict:
         """
         发送用户消息，获取AI回复
         
@@ -90,52 +114,90 @@ class AIChatService:
         """
         logger.info(f"[AIChatService] 收到用户消息: session={session_id}, msg={user_message[:50]}...")
         
-        if session_id not in chat_sessions:
+        session = await chat_session_store.get(session_id)
+        if session is None:
             logger.error(f"[AIChatService] 会话不存在: {session_id}")
             return {"error": "会话不存在或已过期", "status": "error"}
         
-        session = chat_sessions[session_id]
-        
-        # 添加用户消息
-        session["messages"].append({
-            "role": "user",
-            "content": user_message
-        })
-        
         # 调用AI
         try:
-            logger.debug(f"[AIChatService] 调用AI，消息数: {len(session['messages'])}")
+            messages = await self._prepare_messages(session, [{"role": "user", "content": user_message}])
             
-            response = self.client.chat.completions.create(
+            response = await self.client.chat.completions.create(
                 model=self.model,
-                messages=session["messages"],
+                messages=messages,
                 temperature=0.7
             )
             
-            ai_reply = response.choices[0].message.content
-            logger.info(f"[AIChatService] AI回复: {ai_reply[:100]}...")
-            
-            # 保存AI回复
-            session["messages"].append({
-                "role": "assistant",
-                "content": ai_reply
-            })
-            
-            # 分析AI回复，判断是否已确认需求
-            status = self._analyze_reply_status(ai_reply)
-            session["status"] = status
-            logger.debug(f"[AIChatService] 当前状态: {status}")
-            
-            return {
-                "message": ai_reply,
-                "status": status
-            }
+            ai_reply = response.choices[0].message.content or ""
+            return await self._finish_turn(session_id, session, user_message, ai_reply)
             
         except Exception as e:
             logger.error(f"[AIChatService] AI调用失败: {e}")
             return {"error": str(e), "status": "error"}
+
+    async def stream_message(self, session_id: str, user_message: str) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+        """
+        流式版本的 send_message，依次产出事件：
+            ("delta", {"text": 片段}) ... ("done", {"message": 完整回复, "status": ...})
+            出错时产出 ("error", {"error": ..., "status": "error"}) 后结束
+        """
+        logger.info(f"[AIChatService] 收到用户消息(流式): session={session_id}, msg={user_message[:50]}...")
+
+        session = await chat_session_store.get(session_id)
+        if session is None:
+            logger.error(f"[AIChatService] 会话不存在: {session_id}")
+            yield "error", {"error": "会话不存在或已过期", "status": "error"}
+            return
+
+        parts: List[str] = []
+        stream = None
+        try:
+            messages = await self._prepare_messages(session, [{"role": "user", "content": user_message}])
+            stream = await self.client.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                temperature=0.7,
+                stream=True
+            )
+            async for chunk in stream:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    parts.append(delta)
+                    yield "delta", {"text": delta}
+        except GeneratorExit:
+            # 调用方提前关闭（客户端断开），本轮不写入会话
+            logger.info(f"[AIChatService] 流式回复被中断: session={session_id}")
+            raise
+        except Exception as e:
+            logger.error(f"[AIChatService] AI流式调用失败: {e}")
+            yield "error", {"error": str(e), "status": "error"}
+            return
+        finally:
+            if stream is not None:
+                # 提前结束时释放连接（连接归还共享连接池）
+                await stream.response.aclose()
+
+        yield "done", await self._finish_turn(session_id, session, user_message, "".join(parts))
+
+    async def _finish_turn(self, session_id: str, session: dict, user_message: str, ai_reply: str) -> dict:
+        """保存一轮对话并更新需求状态"""
+        logger.info(f"[AIChatService] AI回复: {ai_reply[:100]}...")
+        session["messages"].append({"role": "user", "content": user_message})
+        session["messages"].append({"role": "assistant", "content": ai_reply})
+
+        # 分析AI回复，判断是否已确认需求
+        status = self._analyze_reply_status(ai_reply)
+        session["status"] = status
+        logger.debug(f"[AIChatService] 当前状态: {status}")
+        await chat_session_store.save(session_id, session)
+
+        return {
+            "message": ai_reply,
+            "status": status
+        }
     
-    def generate_workflow(self, session_id: str) -> dict:
+    async def generate_workflow(self, session_id: str) -> dict:
         """
         根据对话生成工作流
         
@@ -147,12 +209,11 @@ class AIChatService:
         """
         logger.info(f"[AIChatService] 生成工作流: session={session_id}")
         
-        if session_id not in chat_sessions:
+        session = await chat_session_store.get(session_id)
+        if session is None:
             logger.error(f"[AIChatService] 会话不存在: {session_id}")
             return {"error": "会话不存在", "status": "error"}
         
-        session = chat_sessions[session_id]
-        
         # 构建文件信息映射，供AI使用真实的file_id和列名
         file_info_lines = []
         for i, meta in enumerate(session.get("file_metadata", []), 1):
@@ -303,17 +364,18 @@ output_csv: {{"filename": "结果.csv", "encoding": "utf-8"}}
 }}
 """
         
-        session["messages"].append({
+        generate_message = {
             "role": "user", 
             "content": generate_prompt
-        })
+        }
         
         try:
             logger.debug(f"[AIChatService] 请求生成工作流...")
             
-            response = self.client.chat.completions.create(
+            messages = await self._prepare_messages(session, [generate_message])
+            response = await self.client.chat.completions.create(
                 model=self.model,
-                messages=session["messages"],
+                messages=messages,
                 temperature=0.3
             )
             
@@ -331,12 +393,15 @@ output_csv: {{"filename": "结果.csv", "encoding": "utf-8"}}
                 logger.info(f"[AIChatService] 工作流生成成功: {len(workflow.get('nodes', []))} 个节点")
                 
                 # 【关键修复】将生成的JSON保存到对话历史，供后续修改使用
+                # （生成指令很长且每次相同，历史中只记占位消息）
+                session["messages"].append({"role": "user", "content": "请根据以上对话生成工作流JSON。"})
                 session["messages"].append({
                     "role": "assistant",
                     "content": ai_reply
                 })
                 
                 session["status"] = "generated"
+                await chat_session_store.save(session_id, session)
                 
                 return {
                     "workflow": workflow,
@@ -351,24 +416,91 @@ output_csv: {{"filename": "结果.csv", "encoding": "utf-8"}}
             return {"error": str(e), "status": "error"}
     
     def _build_tables_context(self, file_metadata: List[dict]) -> str:
-        """构建表结构上下文"""
-        context_parts = []
-        
-        for i, meta in enumerate(file_metadata, 1):
-            filename = meta.get("filename", f"表{i}")
-            sheet_name = meta.get("sheet_name", "Sheet1")
-            columns = meta.get("columns", [])
-            sample_data = meta.get("sample_data", [])
-            row_count = meta.get("row_count", 0)
-            
-            part = f"""表{i}: {filename} / {sheet_name}
-  - 行数: {row_count}
-  - 列名: {', '.join(columns[:15])}{'...' if len(columns) > 15 else ''}
-  - 样例数据: {sample_data[:3]}"""
-            
-            context_parts.append(part)
-        
-        return "\n\n".join(context_parts)
+        """构建表结构上下文（精简形式，见 chat_context.compact_tables_context）"""
+        return compact_tables_context(file_metadata)
+
+    async def _prepare_messages(self, session: dict, pending: List[dict]) -> List[dict]:
+        """
+        组装本次请求的消息：系统提示词（附对话摘要）+ 预算内的历史 + 本轮新消息。
+        历史超出预算、或本轮保存后会超过会话条数上限时，先把较早的部分压缩成摘要
+        （写回 session，随本轮一起保存）。
+        """
+        system, history = session["messages"][:1], session["messages"][1:]
+        fixed = messages_tokens(system) + messages_tokens(pending) + CHAT_SUMMARY_MAX_TOKENS
+        keep = max(1, CHAT_KEEP_RECENT_MESSAGES)
+        over_tokens = fixed + messages_tokens(history) > CHAT_CONTEXT_TOKEN_BUDGET
+        over_count = len(session["messages"]) + _MESSAGES_PER_TURN > CHAT_SESSION_MAX_MESSAGES
+        if (over_tokens or over_count) and len(history) > keep:
+            # 摘要后保留的历史不超过可用预算的一半（至少 keep 条），避免每轮都重新摘要
+            room = (CHAT_CONTEXT_TOKEN_BUDGET - fixed) // 2
+            cut = len(history)
+            while cut > 0:
+                room -= message_tokens(history[cut - 1])
+                if room < 0:
+                    break
+                cut -= 1
+            if over_count:
+                # 条数触发：摘要后只留上限的一半，避免之后每轮都重新摘要
+                cut = max(cut, len(history) - CHAT_SESSION_MAX_MESSAGES // 2)
+            cut = min(cut, len(history) - keep)
+            # 从用户消息处切分，保持问答成对
+            while cut > 0 and history[cut].get("role") != "user":
+                cut -= 1
+            if cut > 0:
+                summary = await self._summarize(session.get("summary"), history[:cut])
+                if summary:
+                    session["summary"] = summary
+                    session["summarized_messages"] = session.get("summarized_messages", 0) + cut
+                    session["messages"] = system + history[cut:]
+                    history = history[cut:]
+
+        if session.get("summary"):
+            system = [{
+                "role": "system",
+                "content": f"{system[0]['content']}\n\n========== 此前对话摘要 ==========\n{session['summary']}",
+            }]
+
+        # 摘要失败或最近几轮本身就很长时，请求中只带预算内最近的历史
+        budget = CHAT_CONTEXT_TOKEN_BUDGET - messages_tokens(system) - messages_tokens(pending)
+        start = len(history)
+        while start > 0:
+            budget -= message_tokens(history[start - 1])
+            if budget < 0:
+                break
+            start -= 1
+        messages = system + history[start:] + pending
+        logger.debug(
+            f"[AIChatService] 请求上下文: 消息数={len(messages)} 估算token={messages_tokens(messages)} "
+            f"省略历史={start} 已摘要={session.get('summarized_messages', 0)}"
+        )
+        return messages
+
+    async def _summarize(self, previous: Optional[str], messages: List[dict]) -> Optional[str]:
+        """把较早的对话（连同已有摘要）压缩成摘要；失败返回 None"""
+        transcript = "\n".join(
+            f"{'用户' if m.get('role') == 'user' else 'AI'}: {m.get('content', '')}" for m in messages
+        )
+        prompt = (
+            "请把下面的对话压缩成摘要，供后续继续设计数据处理工作流使用。"
+            "保留用户确认过的需求、涉及的表和列名、关联键、汇总维度、已商定的处理步骤与未解决的问题，"
+            f"省略寒暄，用条目列出，不超过{CHAT_SUMMARY_MAX_TOKENS}字。\n\n"
+        )
+        if previous:
+            prompt += f"已有摘要：\n{previous}\n\n"
+        prompt += f"新增对话：\n{transcript}"
+        try:
+            response = await self.client.chat.completions.create(
+                model=self.model,
+                messages=[{"role": "user", "content": prompt}],
+                temperature=0.2,
+                max_tokens=CHAT_SUMMARY_MAX_TOKENS * 2
+            )
+            summary = (response.choices[0].message.content or "").strip()
+            logger.info(f"[AIChatService] 已压缩 {len(messages)} 条历史消息为摘要（{len(summary)} 字）")
+            return summary or None
+        except Exception as e:
+            logger.warning(f"[AIChatService] 生成对话摘要失败，本次仅截断历史: {e}")
+            return None
     
     def _build_system_prompt(self, tables_context: str) -> str:
         """构建系统提示词"""
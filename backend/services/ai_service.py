@@ -1,12 +1,12 @@
 """
 豆包AI服务 - 将自然语言转换为工作流配置
 """
-import httpx
 import json
 import re
 import logging
 from typing import Dict, Any, List
-from config import ARK_API_KEY, ARK_BASE_URL, ARK_MODEL_NAME
+from config import ARK_MODEL_NAME
+from services.llm_client import llm_clients
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -59,8 +59,6 @@ WORKFLOW_GENERATION_PROMPT = """你是一个Excel工作流生成专家。根据
 
 class AIService:
     def __init__(self):
-        self.api_key = ARK_API_KEY
-        self.base_url = ARK_BASE_URL
         self.model = ARK_MODEL_NAME
     
     def _extract_json(self, content: str) -> Dict[str, Any]:
@@ -89,38 +87,37 @@ class AIService:
         logger.info(f"调用AI生成工作流: {user_input[:100]}...")
         
         try:
-            async with httpx.AsyncClient(timeout=120.0) as client:
-                response = await client.post(
-                    f"{self.base_url}/chat/completions",
-                    headers={"Authorization": f"Bearer {self.api_key}", "Content-Type": "application/json"},
-                    json={
-                        "model": self.model,
-                        "messages": [
-                            {"role": "system", "content": "你是Excel处理专家，只返回JSON格式配置。"},
-                            {"role": "user", "content": prompt}
-                        ],
-                        "max_tokens": 4096,
-                        "temperature": 0.1
-                    }
-                )
-                
-                logger.info(f"AI API响应状态码: {response.status_code}")
-                
-                if response.status_code != 200:
-                    raise Exception(f"AI API调用失败: {response.text[:200]}")
-                
-                result = response.json()
-                content = result["choices"][0]["message"]["content"]
-                logger.info(f"AI返回内容: {content[:300]}...")
-                
-                workflow_config = self._extract_json(content)
-                
-                if "nodes" not in workflow_config:
-                    workflow_config["nodes"] = []
-                if "edges" not in workflow_config:
-                    workflow_config["edges"] = []
-                
-                return workflow_config
+            response = await llm_clients.http().post(
+                "chat/completions",
+                json={
+                    "model": self.model,
+                    "messages": [
+                        {"role": "system", "content": "你是Excel处理专家，只返回JSON格式配置。"},
+                        {"role": "user", "content": prompt}
+                    ],
+                    "max_tokens": 4096,
+                    "temperature": 0.1
+                },
+                timeout=120.0
+            )
+            
+            logger.info(f"AI API响应状态码: {response.status_code}")
+            
+            if response.status_code != 200:
+                raise Exception(f"AI API调用失败: {response.text[:200]}")
+            
+            result = response.json()
+            content = result["choices"][0]["message"]["content"]
+            logger.info(f"AI返回内容: {content[:300]}...")
+            
+            workflow_config = self._extract_json(content)
+            
+            if "nodes" not in workflow_config:
+                workflow_config["nodes"] = []
+            if "edges" not in workflow_config:
+                workflow_config["edges"] = []
+            
+            return workflow_config
                 
         except Exception as e:
             logger.error(f"生成工作流错误: {e}")
@@ -129,15 +126,14 @@ class AIService:
     async def explain_workflow(self, workflow_config: Dict) -> str:
         prompt = f"请用简洁中文解释这个工作流：\n\n{json.dumps(workflow_config, ensure_ascii=False, indent=2)}"
         try:
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.post(
-                    f"{self.base_url}/chat/completions",
-                    headers={"Authorization": f"Bearer {self.api_key}", "Content-Type": "application/json"},
-                    json={"model": self.model, "messages": [{"role": "user", "content": prompt}], "max_tokens": 500}
-                )
-                if response.status_code == 200:
-                    return response.json()["choices"][0]["message"]["content"]
-                return "无法生成解释"
+            response = await llm_clients.http().post(
+                "chat/completions",
+                json={"model": self.model, "messages": [{"role": "user", "content": prompt}], "max_tokens": 500},
+                timeout=30.0
+            )
+            if response.status_code == 200:
+                return response.json()["choices"][0]["message"]["content"]
+            return "无法生成解释"
         except:
             return "无法生成解释"
 
@@ -156,23 +152,22 @@ class AIService:
         )
 
         try:
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.post(
-                    f"{self.base_url}/chat/completions",
-                    headers={"Authorization": f"Bearer {self.api_key}", "Content-Type": "application/json"},
-                    json={
-                        "model": self.model,
-                        "messages": [
-                            {"role": "system", "content": "你是严谨的调试助手，只输出中文建议，不要输出代码块以外的无关内容。"},
-                            {"role": "user", "content": prompt}
-                        ],
-                        "max_tokens": 800,
-                        "temperature": 0.2
-                    }
-                )
-                if response.status_code == 200:
-                    return response.json()["choices"][0]["message"]["content"]
-                return f"AI 建议生成失败（HTTP {response.status_code}）"
+            response = await llm_clients.http().post(
+                "chat/completions",
+                json={
+                    "model": self.model,
+                    "messages": [
+                        {"role": "system", "content": "你是严谨的调试助手，只输出中文建议，不要输出代码块以外的无关内容。"},
+                        {"role": "user", "content": prompt}
+                    ],
+                    "max_tokens": 800,
+                    "temperature": 0.2
+                },
+                timeout=30.0
+            )
+            if response.status_code == 200:
+                return response.json()["choices"][0]["message"]["content"]
+            return f"AI 建议生成失败（HTTP {response.status_code}）"
         except Exception as e:
             logger.error(f"AI suggest_error_fix failed: {e}")
             return "AI 建议生成失败（服务不可用或配置缺失）"
@@ -0,0 +1,82 @@
+"""
+AI 对话上下文 - token 估算与精简表结构
+
+- estimate_tokens：不依赖分词器的估算（中日韩字符约 1 token/字，其余约 4 字符/token），
+  只用于预算判断，偏保守；
+- compact_tables_context：把所选表整理为「列名(示例值)」形式的精简结构描述，
+  按表元数据缓存，同一批表的多个会话不重复构建。
+"""
+import json
+import re
+from collections import OrderedDict
+from typing import Any, Dict, List
+
+_CJK = re.compile(r"[⺀-鿿가-힯豈-﫿＀-￯]")
+# 每条消息的格式开销（role、分隔符）
+_MESSAGE_OVERHEAD = 4
+# 示例值最长字符数
+_SAMPLE_MAX_CHARS = 24
+_SCHEMA_CACHE_SIZE = 128
+
+_schema_cache: "OrderedDict[str, str]" = OrderedDict()
+
+
+def estimate_tokens(text: str) -> int:
+    if not text:
+        return 0
+    cjk = len(_CJK.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def message_tokens(message: Dict[str, Any]) -> int:
+    content = message.get("content")
+    if not isinstance(content, str):
+        content = json.dumps(content, ensure_ascii=False)
+    return estimate_tokens(content) + _MESSAGE_OVERHEAD
+
+
+def messages_tokens(messages: List[Dict[str, Any]]) -> int:
+    return sum(message_tokens(m) for m in messages)
+
+
+def _sample_text(value: Any) -> str:
+    text = str(value).replace("\n", " ").strip()
+    return text if len(text) <= _SAMPLE_MAX_CHARS else text[:_SAMPLE_MAX_CHARS] + "…"
+
+
+def _column_samples(columns: List[str], sample_data: List[Any]) -> List[str]:
+    """每列取第一个非空示例值：列名(示例)"""
+    items = []
+    for i, col in enumerate(columns):
+        sample = None
+        for row in sample_data:
+            value = row.get(col) if isinstance(row, dict) else (row[i] if isinstance(row, (list, tuple)) and i < len(row) else None)
+            if value not in (None, ""):
+                sample = value
+                break
+        items.append(f"{col}({_sample_text(sample)})" if sample is not None else str(col))
+    return items
+
+
+def compact_tables_context(file_metadata: List[dict]) -> str:
+    """精简表结构描述（全部列名 + 每列一个示例值）"""
+    key = json.dumps(file_metadata, ensure_ascii=False, sort_keys=True, default=str)
+    cached = _schema_cache.get(key)
+    if cached is not None:
+        _schema_cache.move_to_end(key)
+        return cached
+
+    parts = []
+    for i, meta in enumerate(file_metadata, 1):
+        filename = meta.get("filename", f"表{i}")
+        sheet_name = meta.get("sheet_name", "Sheet1")
+        columns = [str(c) for c in meta.get("columns", [])]
+        row_count = meta.get("row_count", 0)
+        samples = _column_samples(columns, meta.get("sample_data") or [])
+        parts.append(f"表{i}: {filename} / {sheet_name}（{row_count}行，{len(columns)}列）\n  - 列(示例): {', '.join(samples)}")
+
+    result = "\n\n".join(parts)
+    _schema_cache[key] = result
+    while len(_schema_cache) > _SCHEMA_CACHE_SIZE:
+        _schema_cache.popitem(last=False)
+    return result
@@ -0,0 +1,184 @@
+"""
+AI 对话会话存储
+
+- SQLiteSessionStore：会话以 JSON 存在 app.db 的 chat_sessions 表，多个 uvicorn worker 共享；
+- MemorySessionStore：进程内 LRU，只适合单 worker（重启后会话丢失）；
+- 两者都按最后活动时间过期（CHAT_SESSION_TTL_S），保存时按消息条数 / 字节上限压缩历史：
+  保留 system 消息，从最早的对话开始丢弃，丢弃条数记在 session["compacted_messages"]。
+
+通过 CHAT_SESSION_STORE 选择实现，调用方只使用 get / save / delete。
+"""
+import json
+import logging
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from config import (
+    CHAT_SESSION_MAX_BYTES,
+    CHAT_SESSION_MAX_MESSAGES,
+    CHAT_SESSION_MAX_SESSIONS,
+    CHAT_SESSION_STORE,
+    CHAT_SESSION_TTL_S,
+)
+from database import db_pool
+
+logger = logging.getLogger(__name__)
+
+# SQLite 模式下两次过期清理的最小间隔
+_SWEEP_INTERVAL_S = 600.0
+# SQLite 模式下读取会话时刷新最后活动时间的最小间隔（避免每次读取都写库）
+_TOUCH_INTERVAL_S = 60.0
+
+
+def compact_history(session: dict, max_messages: int = CHAT_SESSION_MAX_MESSAGES,
+                    max_bytes: int = CHAT_SESSION_MAX_BYTES) -> int:
+    """按上限就地压缩 session["messages"]，返回丢弃的消息数"""
+    messages = session.get("messages") or []
+    head = [m for m in messages[:1] if m.get("role") == "system"]
+    body = messages[len(head):]
+
+    def _size(message: dict) -> int:
+        return len(json.dumps(message, ensure_ascii=False).encode("utf-8"))
+
+    total = len(json.dumps(session, ensure_ascii=False, default=str).encode("utf-8"))
+    dropped = 0
+    # 至少保留最后一条消息（最新的回复）
+    while len(body) > 1 and (len(head) + len(body) > max_messages or total > max_bytes):
+        total -= _size(body[0]) + 2
+        body.pop(0)
+        dropped += 1
+    if dropped:
+        # 从完整的一轮开始，不留下没有提问的回复
+        while len(body) > 1 and body[0].get("role") == "assistant":
+            body.pop(0)
+            dropped += 1
+
+    if dropped:
+        session["messages"] = head + body
+        session["compacted_messages"] = session.get("compacted_messages", 0) + dropped
+        logger.info("[ChatSessionStore] 压缩会话历史: 丢弃 %s 条消息", dropped)
+    return dropped
+
+
+class ChatSessionStore(ABC):
+    """会话存储接口"""
+
+    def __init__(self, ttl_s: float = CHAT_SESSION_TTL_S):
+        self.ttl_s = float(ttl_s)
+
+    @abstractmethod
+    async def get(self, session_id: str) -> Optional[dict]:
+        """读取会话并刷新最后活动时间，不存在或已过期返回 None"""
+
+    @abstractmethod
+    async def save(self, session_id: str, session: dict) -> None:
+        """压缩历史后保存会话"""
+
+    @abstractmethod
+    async def delete(self, session_id: str) -> None:
+        """删除会话"""
+
+
+class MemorySessionStore(ChatSessionStore):
+    """进程内 LRU + TTL"""
+
+    def __init__(self, max_sessions: int = CHAT_SESSION_MAX_SESSIONS, ttl_s: float = CHAT_SESSION_TTL_S):
+        super().__init__(ttl_s)
+        self.max_sessions = max(1, int(max_sessions))
+        # session_id → (最后活动时间, 会话)
+        self._sessions: "OrderedDict[str, tuple]" = OrderedDict()
+
+    def _expire(self, now: float) -> None:
+        while self._sessions:
+            session_id, (updated_at, _) = next(iter(self._sessions.items()))
+            if now - updated_at <= self.ttl_s:
+                break
+            self._sessions.pop(session_id)
+
+    async def get(self, session_id: str) -> Optional[dict]:
+        now = time.time()
+        self._expire(now)
+        item = self._sessions.get(session_id)
+        if item is None:
+            return None
+        self._sessions[session_id] = (now, item[1])
+        self._sessions.move_to_end(session_id)
+        return item[1]
+
+    async def save(self, session_id: str, session: dict) -> None:
+        compact_history(session)
+        now = time.time()
+        self._sessions[session_id] = (now, session)
+        self._sessions.move_to_end(session_id)
+        self._expire(now)
+        while len(self._sessions) > self.max_sessions:
+            evicted, _ = self._sessions.popitem(last=False)
+            logger.info("[ChatSessionStore] 会话数超过上限，淘汰: %s", evicted)
+
+    async def delete(self, session_id: str) -> None:
+        self._sessions.pop(session_id, None)
+
+
+class SQLiteSessionStore(ChatSessionStore):
+    """会话存 app.db（chat_sessions 表），多个 worker 共享"""
+
+    def __init__(self, ttl_s: float = CHAT_SESSION_TTL_S):
+        super().__init__(ttl_s)
+        self._last_sweep = 0.0
+
+    async def get(self, session_id: str) -> Optional[dict]:
+        now = time.time()
+        async with db_pool.read() as db:
+            async with db.execute(
+                "SELECT data, updated_at FROM chat_sessions WHERE id = ? AND updated_at >= ?",
+                (session_id, now - self.ttl_s),
+            ) as cursor:
+                row = await cursor.fetchone()
+        if not row:
+            return None
+        if now - row[1] >= _TOUCH_INTERVAL_S:
+            # 只读取、未保存的会话（如本轮失败）也按最后活动时间续期
+            async with db_pool.write() as db:
+                await db.execute(
+                    "UPDATE chat_sessions SET updated_at = MAX(updated_at, ?) WHERE id = ?",
+                    (now, session_id),
+                )
+        return json.loads(row[0])
+
+    async def save(self, session_id: str, session: dict) -> None:
+        compact_history(session)
+        data = json.dumps(session, ensure_ascii=False, default=str)
+        now = time.time()
+        async with db_pool.write() as db:
+            await db.execute(
+                "INSERT OR REPLACE INTO chat_sessions (id, data, updated_at) VALUES (?, ?, ?)",
+                (session_id, data, now),
+            )
+            if now - self._last_sweep >= _SWEEP_INTERVAL_S:
+                self._last_sweep = now
+                cursor = await db.execute("DELETE FROM chat_sessions WHERE updated_at < ?", (now - self.ttl_s,))
+                if cursor.rowcount:
+                    logger.info("[ChatSessionStore] 清理过期会话 %s 个", cursor.rowcount)
+                await cursor.close()
+
+    async def delete(self, session_id: str) -> None:
+        async with db_pool.write() as db:
+            await db.execute("DELETE FROM chat_sessions WHERE id = ?", (session_id,))
+
+
+_STORES: Dict[str, type] = {
+    "memory": MemorySessionStore,
+    "sqlite": SQLiteSessionStore,
+}
+
+
+def create_session_store(kind: str = CHAT_SESSION_STORE) -> ChatSessionStore:
+    if kind not in _STORES:
+        raise ValueError(f"不支持的会话存储类型: {kind}（可选 {', '.join(_STORES)}）")
+    return _STORES[kind]()
+
+
+# 单例
+chat_session_store = create_session_store()
@@ -0,0 +1,302 @@
+"""
+列式缓存服务 - 上传时把工作簿的每个Sheet物化为 Parquet，后续读取直接走缓存
+
+缓存按 (缓存键, Sheet, 表头行) 存放在 COLUMNAR_CACHE_DIR 下：
+- 缓存键通常是 file_id；
+- 每个条目带一个 .meta.json，记录源文件的大小/修改时间，源文件变化即视为过期；
+- 缓存缺失或过期时，读取方回退到 pd.read_excel，同时在后台重建缓存。
+
+pyarrow 不可用，或某张表无法写成 Parquet（如列名不是字符串、object 列混合类型）时，
+该条目退化为 pickle 存储，保证读出的 DataFrame 与 read_excel 一致。
+"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, Optional, Tuple, Union
+
+import pandas as pd
+
+from config import COLUMNAR_CACHE_DIR, COLUMNAR_CACHE_WORKERS
+
+try:
+    import pyarrow as pa  # type: ignore
+    import pyarrow.parquet as pq  # type: ignore
+except Exception:  # pragma: no cover - 可选依赖
+    pa = None
+    pq = None
+
+logger = logging.getLogger(__name__)
+
+SheetRef = Union[str, int]
+
+# 分组写入 Parquet，窗口读取时只需解码与窗口重叠的分组
+_ROW_GROUP_ROWS = 50_000
+
+
+def write_frame(df: pd.DataFrame, base: str) -> Tuple[str, str]:
+    """
+    把 DataFrame 原子写入 base.parquet（失败则 base.pkl），返回 (data_path, format)。
+    """
+    os.makedirs(os.path.dirname(base), exist_ok=True)
+    if pq is not None:
+        tmp = base + ".parquet.tmp"
+        try:
+            df.to_parquet(tmp, engine="pyarrow", index=False, row_group_size=_ROW_GROUP_ROWS)
+            data_path = base + ".parquet"
+            os.replace(tmp, data_path)
+            return data_path, "parquet"
+        except Exception as e:
+            logger.info("[ColumnarCache] Parquet 写入失败，改用 pickle: path=%s error=%s", base, e)
+            if os.path.exists(tmp):
+                os.remove(tmp)
+    tmp = base + ".pkl.tmp"
+    df.to_pickle(tmp)
+    data_path = base + ".pkl"
+    os.replace(tmp, data_path)
+    return data_path, "pickle"
+
+
+def read_frame(data_path: str, fmt: str, offset: int = 0, limit: Optional[int] = None) -> pd.DataFrame:
+    """读取 write_frame 写出的文件；offset/limit 用于只取一段行"""
+    offset = max(0, int(offset or 0))
+    if fmt == "parquet" and pq is not None:
+        if limit and not offset:
+            # 只解码前 limit 行所在的 batch，避免预览时读全表
+            pf = pq.ParquetFile(data_path)
+            batches, rows = [], 0
+            for batch in pf.iter_batches(batch_size=int(limit)):
+                batches.append(batch)
+                rows += batch.num_rows
+                if rows >= limit:
+                    break
+            table = pa.Table.from_batches(batches, schema=pf.schema_arrow)
+            return table.slice(0, int(limit)).to_pandas()
+        if offset or limit:
+            # 按 row group 元数据只读取与窗口重叠的分组
+            pf = pq.ParquetFile(data_path, memory_map=True)
+            end = None if limit is None else offset + int(limit)
+            groups, first_row, start = [], None, 0
+            for i in range(pf.metadata.num_row_groups):
+                n = pf.metadata.row_group(i).num_rows
+                if start + n > offset and (end is None or start < end):
+                    groups.append(i)
+                    first_row = start if first_row is None else first_row
+                start += n
+            if not groups:
+                return pf.schema_arrow.empty_table().to_pandas()
+            table = pf.read_row_groups(groups)
+            skip = offset - first_row
+            length = (table.num_rows - skip) if end is None else (end - offset)
+            return table.slice(skip, max(0, length)).to_pandas()
+        return pd.read_parquet(data_path, engine="pyarrow")
+    df = pd.read_pickle(data_path)
+    if offset or limit:
+        return df.iloc[offset:offset + int(limit)] if limit else df.iloc[offset:]
+    return df
+
+
+class ColumnarCache:
+    """Sheet 级列式缓存"""
+
+    def __init__(self, cache_dir: str = COLUMNAR_CACHE_DIR, max_workers: int = COLUMNAR_CACHE_WORKERS):
+        self.cache_dir = cache_dir
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="columnar-cache")
+        self._pending: set = set()
+        self._lock = threading.Lock()
+
+    # ========== 路径与元数据 ==========
+    @staticmethod
+    def _sheet_token(sheet_name: SheetRef) -> str:
+        # Sheet 名可能包含中文/特殊字符，统一哈希成文件名；按索引读取与按名称读取分开缓存
+        raw = f"index:{sheet_name}" if isinstance(sheet_name, int) else f"name:{sheet_name}"
+        return hashlib.md5(raw.encode("utf-8")).hexdigest()[:16]
+
+    def _entry_base(self, key: str, sheet_name: SheetRef, header_row: int) -> str:
+        return os.path.join(self.cache_dir, str(key), f"{self._sheet_token(sheet_name)}_h{int(header_row)}")
+
+    @staticmethod
+    def _source_signature(file_path: str) -> Dict[str, int]:
+        st = os.stat(file_path)
+        return {"size": int(st.st_size), "mtime_ns": int(st.st_mtime_ns)}
+
+    def _load_meta(self, key: str, sheet_name: SheetRef, header_row: int) -> Optional[Dict[str, Any]]:
+        meta_path = self._entry_base(key, sheet_name, header_row) + ".meta.json"
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception:
+            return None
+
+    def _fresh_meta(self, key: str, file_path: str, sheet_name: SheetRef, header_row: int) -> Optional[Dict[str, Any]]:
+        """返回仍然有效的缓存元数据；缺失或源文件已变化则返回 None"""
+        meta = self._load_meta(key, sheet_name, header_row)
+        if not meta:
+            return None
+        try:
+            if meta.get("source") != self._source_signature(file_path):
+                return None
+        except OSError:
+            return None
+        data_path = meta.get("data_path")
+        if not data_path or not os.path.exists(data_path):
+            return None
+        return meta
+
+    # ========== 写入 ==========
+    def _write_entry(self, key: str, file_path: str, sheet_name: SheetRef, header_row: int, df: pd.DataFrame) -> None:
+        base = self._entry_base(key, sheet_name, header_row)
+        data_path, fmt = write_frame(df, base)
+
+        meta = {
+            "key": str(key),
+            "sheet_name": sheet_name,
+            "header_row": int(header_row),
+            "format": fmt,
+            "data_path": data_path,
+            "rows": int(len(df)),
+            "columns": [str(c) for c in df.columns],
+            "source": self._source_signature(file_path),
+        }
+        meta_tmp = base + ".meta.json.tmp"
+        with open(meta_tmp, "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(meta_tmp, base + ".meta.json")
+
+    def materialize(self, key: str, file_path: str, sheet_names: Optional[Iterable[SheetRef]] = None, header_row: int = 1) -> int:
+        """
+        同步物化：打开一次工作簿，把指定Sheet（默认全部）写入缓存。
+        已有且未过期的条目会跳过。返回本次写入的条目数。
+        """
+        written = 0
+        with pd.ExcelFile(file_path) as xf:
+            targets = list(sheet_names) if sheet_names is not None else list(xf.sheet_names)
+            for sheet_name in targets:
+                if self._fresh_meta(key, file_path, sheet_name, header_row):
+                    continue
+                try:
+                    df = xf.parse(sheet_name, header=int(header_row) - 1)
+                    self._write_entry(key, file_path, sheet_name, header_row, df)
+                    written += 1
+                except Exception as e:
+                    logger.warning("[ColumnarCache] 物化失败: key=%s sheet=%s error=%s", key, sheet_name, e)
+        return written
+
+    def schedule_materialize(self, key: str, file_path: str, sheet_names: Optional[Iterable[SheetRef]] = None, header_row: int = 1) -> None:
+        """后台物化（同一批次已在排队时不重复提交）"""
+        targets = tuple(sheet_names) if sheet_names is not None else None
+        job_key = (str(key), targets, int(header_row))
+        with self._lock:
+            if job_key in self._pending:
+                return
+            self._pending.add(job_key)
+
+        def _run():
+            try:
+                written = self.materialize(key, file_path, targets, header_row)
+                if written:
+                    logger.info("[ColumnarCache] 后台物化完成: key=%s 条目=%s", key, written)
+            except Exception as e:
+                logger.warning("[ColumnarCache] 后台物化失败: key=%s error=%s", key, e)
+            finally:
+                with self._lock:
+                    self._pending.discard(job_key)
+
+        self._executor.submit(_run)
+
+    def schedule_store(self, key: str, file_path: str, sheet_name: SheetRef, header_row: int, df: pd.DataFrame) -> None:
+        """后台把已解析好的整表写入缓存（调用方已读过源文件，无需再次解析）"""
+        job_key = (str(key), (sheet_name,), int(header_row))
+        with self._lock:
+            if job_key in self._pending:
+                return
+            self._pending.add(job_key)
+
+        def _run():
+            try:
+                self._write_entry(key, file_path, sheet_name, header_row, df)
+            except Exception as e:
+                logger.warning("[ColumnarCache] 写入缓存失败: key=%s sheet=%s error=%s", key, sheet_name, e)
+            finally:
+                with self._lock:
+                    self._pending.discard(job_key)
+
+        self._executor.submit(_run)
+
+    # ========== 读取 ==========
+    def read(self, key: str, file_path: str, sheet_name: SheetRef, header_row: int = 1,
+             nrows: Optional[int] = None) -> Optional[pd.DataFrame]:
+        """读取缓存；缺失/过期返回 None（不触发重建）"""
+        meta = self._fresh_meta(key, file_path, sheet_name, header_row)
+        if not meta:
+            return None
+        try:
+            return read_frame(meta["data_path"], meta.get("format", "pickle"), limit=nrows)
+        except Exception as e:
+            logger.warning("[ColumnarCache] 读取缓存失败，回退源文件: key=%s sheet=%s error=%s", key, sheet_name, e)
+            return None
+
+    def read_excel(self, key: Optional[str], file_path: str, sheet_name: SheetRef = 0, header_row: int = 1,
+                   skip_rows: int = 0, nrows: Optional[int] = None) -> pd.DataFrame:
+        """
+        与 pd.read_excel(header=header_row-1, skiprows=..., nrows=...) 等价的读取入口：
+        命中缓存读 Parquet；未命中则直接解析 Excel 并在后台重建缓存。
+        skip_rows 会改变表头定位，这种读取不走缓存。
+        """
+        use_cache = bool(key) and not skip_rows
+        if use_cache:
+            cached = self.read(key, file_path, sheet_name, header_row, nrows=nrows)
+            if cached is not None:
+                return cached
+
+        df = pd.read_excel(
+            file_path,
+            sheet_name=sheet_name,
+            header=int(header_row) - 1,
+            skiprows=range(1, skip_rows + 1) if skip_rows else None,
+            nrows=int(nrows) if nrows else None,
+        )
+        # 读取成功才重建（Sheet 不存在等错误不反复提交后台任务）
+        if use_cache:
+            self.schedule_materialize(key, file_path, [sheet_name], header_row)
+        return df
+
+    def read_window(self, key: Optional[str], file_path: str, sheet_name: SheetRef, offset: int = 0,
+                    limit: int = 100, header_row: int = 1) -> Tuple[pd.DataFrame, Optional[int]]:
+        """
+        读取 [offset, offset+limit) 行窗口，返回 (窗口, 缓存记录的总行数或 None)。
+        命中缓存只解码所需行；未命中则让 read_excel 在窗口末尾停止解析，并在后台重建缓存。
+        """
+        offset = max(0, int(offset))
+        limit = max(0, int(limit))
+        if key:
+            meta = self._fresh_meta(key, file_path, sheet_name, header_row)
+            if meta:
+                try:
+                    df = read_frame(meta["data_path"], meta.get("format", "pickle"), offset=offset, limit=limit)
+                    return df, int(meta.get("rows", 0))
+                except Exception as e:
+                    logger.warning("[ColumnarCache] 读取缓存失败，回退源文件: key=%s sheet=%s error=%s", key, sheet_name, e)
+
+        df = pd.read_excel(
+            file_path,
+            sheet_name=sheet_name,
+            header=int(header_row) - 1,
+            skiprows=range(int(header_row), int(header_row) + offset) if offset else None,
+            nrows=limit,
+        )
+        if key:
+            self.schedule_materialize(key, file_path, [sheet_name], header_row)
+        return df, None
+
+    def invalidate(self, key: str) -> None:
+        """删除某个缓存键下的全部条目"""
+        path = os.path.join(self.cache_dir, str(key))
+        shutil.rmtree(path, ignore_errors=True)
+
+
+# 单例
+columnar_cache = ColumnarCache()
@@ -4,15 +4,20 @@ Excel处理服务
 import os
 import uuid
 import json
-from typing import List, Dict, Any, Optional
+import logging
+import zipfile
+from typing import List, Dict, Any, Optional, Tuple
 from datetime import date, datetime, time
 import decimal
 import math
 import pandas as pd
 from openpyxl import load_workbook
-import aiosqlite
 from config import UPLOAD_DIR
-from database import DATABASE_PATH
+from database import db_pool, fetch_page
+from services.columnar_cache import columnar_cache
+from services.xlsx_metadata import count_xlsx_rows, scan_xlsx
+
+logger = logging.getLogger(__name__)
 
 
 class ExcelService:
@@ -78,7 +83,10 @@ class ExcelService:
     @staticmethod
     def parse_excel(file_path: str) -> Dict[str, Any]:
         """
-        解析Excel文件，获取所有Sheet的信息
+        解析Excel文件，获取所有Sheet的信息（同步，调用方放到线程中执行）
+
+        xlsx 直接扫描包内 XML：行数取自 dimension（row_count_exact=False，精确行数由
+        count_exact_rows 在后台补齐），表头/预览只解析前几行。扫描失败或 .xls 退回原有解析方式。
         
         Returns:
             {
@@ -87,12 +95,63 @@ class ExcelService:
                         "name": "Sheet1",
                         "columns": ["A", "B", "C"],
                         "row_count": 100,
+                        "row_count_exact": False,
                         "preview": [...前5行数据...]
                     }
-                ]
+                ],
+                "timings": {"total_ms": ..., "sheets_ms": {...}}
             }
         """
-        workbook = load_workbook(file_path, read_only=True, data_only=True)
+        if zipfile.is_zipfile(file_path):
+            try:
+                result = scan_xlsx(file_path)
+                for sheet in result["sheets"]:
+                    sheet["preview"] = [[ExcelService._json_safe(v) for v in row] for row in sheet["preview"]]
+                logger.info("[ExcelService] 元数据扫描完成: file=%s sheets=%s 耗时=%sms",
+                            file_path, len(result["sheets"]), result["timings"]["total_ms"])
+                return result
+            except Exception as e:
+                logger.warning("[ExcelService] XML 元数据扫描失败，回退 openpyxl: file=%s error=%s", file_path, e)
+            return ExcelService._parse_excel_openpyxl(file_path)
+        return ExcelService._parse_excel_pandas(file_path)
+
+    @staticmethod
+    def count_exact_rows(file_path: str, sheet_names: Optional[List[str]] = None) -> Dict[str, int]:
+        """精确统计各Sheet数据行数（完整扫描，较慢，应在后台执行）"""
+        return count_xlsx_rows(file_path, sheet_names)
+
+    @staticmethod
+    def _parse_excel_pandas(file_path: str) -> Dict[str, Any]:
+        """.xls 等非 xlsx 格式：pandas 读取（行数即为精确值）"""
+        started = datetime.now()
+        sheets_info = []
+        with pd.ExcelFile(file_path) as xf:
+            for sheet_name in xf.sheet_names:
+                raw = xf.parse(sheet_name, header=None)
+                columns = [str(v) if not pd.isna(v) else f"列{i+1}" for i, v in enumerate(raw.iloc[0])] if len(raw) else []
+                preview = [
+                    [ExcelService._json_safe(None if pd.isna(v) else v) for v in row]
+                    for row in raw.iloc[1:6].itertuples(index=False)
+                ]
+                sheets_info.append({
+                    "name": sheet_name,
+                    "columns": columns,
+                    "row_count": max(len(raw) - 1, 0),
+                    "row_count_exact": True,
+                    "preview": preview
+                })
+        total_ms = (datetime.now() - started).total_seconds() * 1000
+        return {"sheets": sheets_info, "timings": {"total_ms": round(total_ms, 2)}}
+
+    @staticmethod
+    def _parse_excel_openpyxl(file_path: str) -> Dict[str, Any]:
+        """原有解析方式（openpyxl 只读模式），XML 扫描失败时使用"""
+        # 以文件对象打开：上传时解析的是 .part 临时文件，openpyxl 按路径打开会校验扩展名
+        with open(file_path, "rb") as fh:
+            return ExcelService._parse_workbook_openpyxl(load_workbook(fh, read_only=True, data_only=True))
+
+    @staticmethod
+    def _parse_workbook_openpyxl(workbook) -> Dict[str, Any]:
         sheets_info = []
         
         for sheet_name in workbook.sheetnames:
@@ -117,6 +176,7 @@ class ExcelService:
                 "name": sheet_name,
                 "columns": columns,
                 "row_count": row_count,
+                "row_count_exact": False,
                 "preview": preview
             })
         
@@ -124,35 +184,56 @@ class ExcelService:
         return {"sheets": sheets_info}
     
     @staticmethod
-    def read_sheet_as_dataframe(file_path: str, sheet_name: str) -> pd.DataFrame:
-        """读取指定Sheet为DataFrame"""
-        return pd.read_excel(file_path, sheet_name=sheet_name)
+    def read_sheet_as_dataframe(file_path: str, sheet_name: str, cache_key: Optional[str] = None) -> pd.DataFrame:
+        """读取指定Sheet为DataFrame（提供 cache_key 时优先走列式缓存）"""
+        return columnar_cache.read_excel(cache_key, file_path, sheet_name)
     
     @staticmethod
-    def read_column(file_path: str, sheet_name: str, column_name: str) -> pd.Series:
+    def read_sheet_window(file_path: str, sheet_name: str, offset: int = 0, limit: int = 100,
+                          cache_key: Optional[str] = None) -> tuple:
+        """只读取 [offset, offset+limit) 行，返回 (DataFrame, 缓存记录的总行数或 None)"""
+        return columnar_cache.read_window(cache_key, file_path, sheet_name, offset=offset, limit=limit)
+    
+    @staticmethod
+    def read_column(file_path: str, sheet_name: str, column_name: str, cache_key: Optional[str] = None) -> pd.Series:
         """读取指定列"""
-        df = pd.read_excel(file_path, sheet_name=sheet_name)
+        df = columnar_cache.read_excel(cache_key, file_path, sheet_name)
         if column_name in df.columns:
             return df[column_name]
         raise ValueError(f"列 '{column_name}' 不存在于Sheet '{sheet_name}'")
     
     @staticmethod
     async def save_file_record(file_id: str, filename: str, original_name: str, 
-                               file_path: str, sheets: List[Dict]) -> None:
+                               file_path: str, sheets: List[Dict], content_hash: Optional[str] = None) -> None:
         """保存文件记录到数据库"""
-        async with aiosqlite.connect(DATABASE_PATH) as db:
+        async with db_pool.write() as db:
             await db.execute(
-                """INSERT INTO uploaded_files (id, filename, original_name, file_path, sheets)
-                   VALUES (?, ?, ?, ?, ?)""",
-                (file_id, filename, original_name, file_path, json.dumps(sheets, ensure_ascii=False))
+                """INSERT INTO uploaded_files (id, filename, original_name, file_path, sheets, content_hash)
+                   VALUES (?, ?, ?, ?, ?, ?)""",
+                (file_id, filename, original_name, file_path, json.dumps(sheets, ensure_ascii=False), content_hash)
             )
-            await db.commit()
     
+    @staticmethod
+    async def update_sheet_row_counts(file_path: str, counts: Dict[str, int]) -> None:
+        """把精确行数写回引用该文件的所有记录的 sheets 元数据"""
+        async with db_pool.write() as db:
+            cursor = await db.execute("SELECT id, sheets FROM uploaded_files WHERE file_path = ?", (file_path,))
+            rows = await cursor.fetchall()
+            for file_id, sheets_json in rows:
+                sheets = json.loads(sheets_json) if sheets_json else []
+                for sheet in sheets:
+                    if sheet.get("name") in counts:
+                        sheet["row_count"] = counts[sheet["name"]]
+                        sheet["row_count_exact"] = True
+                await db.execute(
+                    "UPDATE uploaded_files SET sheets = ? WHERE id = ?",
+                    (json.dumps(sheets, ensure_ascii=False), file_id)
+                )
+
     @staticmethod
     async def get_file_record(file_id: str) -> Optional[Dict]:
         """获取文件记录"""
-        async with aiosqlite.connect(DATABASE_PATH) as db:
-            db.row_factory = aiosqlite.Row
+        async with db_pool.read() as db:
             cursor = await db.execute(
                 "SELECT * FROM uploaded_files WHERE id = ?", (file_id,)
             )
@@ -161,25 +242,42 @@ class ExcelService:
                 return dict(row)
             return None
     
+    @staticmethod
+    async def find_by_content_hash(content_hash: str) -> Optional[Dict]:
+        """按内容哈希查找已有上传（用于去重）"""
+        async with db_pool.read() as db:
+            cursor = await db.execute(
+                "SELECT * FROM uploaded_files WHERE content_hash = ? ORDER BY created_at LIMIT 1", (content_hash,)
+            )
+            row = await cursor.fetchone()
+            if row:
+                return dict(row)
+            return None
+
+    @staticmethod
+    async def count_file_path_refs(file_path: str) -> int:
+        """统计引用同一物理文件的记录数（去重后的多条记录共用一个文件）"""
+        async with db_pool.read() as db:
+            cursor = await db.execute(
+                "SELECT COUNT(*) FROM uploaded_files WHERE file_path = ?", (file_path,)
+            )
+            row = await cursor.fetchone()
+            return int(row[0]) if row else 0
+
     @staticmethod
     async def delete_file_record(file_id: str) -> None:
         """从数据库删除文件记录"""
-        async with aiosqlite.connect(DATABASE_PATH) as db:
+        async with db_pool.write() as db:
             await db.execute(
                 "DELETE FROM uploaded_files WHERE id = ?", (file_id,)
             )
-            await db.commit()
     
     @staticmethod
-    async def get_all_files() -> List[Dict]:
-        """获取所有上传的文件"""
-        async with aiosqlite.connect(DATABASE_PATH) as db:
-            db.row_factory = aiosqlite.Row
-            cursor = await db.execute(
-                "SELECT * FROM uploaded_files ORDER BY created_at DESC"
-            )
-            rows = await cursor.fetchall()
-            return [dict(row) for row in rows]
+    async def list_files(limit: int, cursor: Optional[str] = None,
+                         include_sheets: bool = False) -> Tuple[List[Dict], Optional[str]]:
+        """按上传时间倒序分页列出文件；sheets（含预览）较大，默认不查询"""
+        columns = "id, original_name, content_hash, created_at" + (", sheets" if include_sheets else "")
+        return await fetch_page(columns, "uploaded_files", "created_at", limit, cursor)
     
     @staticmethod
     def export_dataframe(df: pd.DataFrame, output_path: str) -> str:
@@ -0,0 +1,81 @@
+"""
+文件注册表 - file_id → 磁盘路径解析
+
+以 uploaded_files.file_path 为准（主键查询），进程内再加一层 LRU，
+数据源节点解析文件不再扫描 UPLOAD_DIR 目录。
+
+内容相同的上传共用同一份文件，列式缓存等派生数据按内容哈希（cache_key）存放；
+没有内容哈希的旧记录仍以 file_id 作为缓存键。
+"""
+import os
+import threading
+from collections import OrderedDict
+from typing import NamedTuple, Optional, Tuple
+
+from config import FILE_REGISTRY_CACHE_SIZE
+from database import db_pool
+
+
+class ResolvedFile(NamedTuple):
+    """解析结果：path 为实际文件路径，cache_key 用作列式缓存等派生数据的键"""
+    file_id: str
+    path: str
+    cache_key: str
+
+
+class FileRegistry:
+    """file_id → 路径解析（LRU + 数据库）"""
+
+    def __init__(self, max_entries: int = FILE_REGISTRY_CACHE_SIZE):
+        self.max_entries = max(1, int(max_entries))
+        self._cache: "OrderedDict[str, Tuple[str, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _cache_get(self, file_id: str) -> Optional[Tuple[str, str]]:
+        with self._lock:
+            entry = self._cache.get(file_id)
+            if entry is not None:
+                self._cache.move_to_end(file_id)
+            return entry
+
+    def register(self, file_id: str, file_path: str, content_hash: Optional[str] = None) -> None:
+        """登记/刷新映射（上传成功后调用，免去首次查询）"""
+        with self._lock:
+            self._cache[file_id] = (file_path, content_hash or file_id)
+            self._cache.move_to_end(file_id)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+
+    def forget(self, file_id: str) -> None:
+        """移除映射（删除文件后调用）"""
+        with self._lock:
+            self._cache.pop(file_id, None)
+
+    async def _lookup(self, file_id: str) -> Optional[Tuple[str, Optional[str]]]:
+        async with db_pool.read() as db:
+            cursor = await db.execute("SELECT file_path, content_hash FROM uploaded_files WHERE id = ?", (file_id,))
+            row = await cursor.fetchone()
+            return (row[0], row[1]) if row else None
+
+    async def resolve(self, file_id: str) -> ResolvedFile:
+        """解析 file_id；记录不存在或文件已被删除时抛 FileNotFoundError"""
+        if not file_id:
+            raise FileNotFoundError("找不到文件: 未指定 file_id")
+
+        entry = self._cache_get(file_id)
+        if entry is None:
+            row = await self._lookup(file_id)
+            if row is None:
+                raise FileNotFoundError(f"找不到文件: {file_id}")
+            self.register(file_id, row[0], row[1])
+            entry = self._cache_get(file_id) or (row[0], row[1] or file_id)
+
+        path, cache_key = entry
+        if not os.path.exists(path):
+            self.forget(file_id)
+            raise FileNotFoundError(f"找不到文件: {file_id}")
+        return ResolvedFile(file_id=file_id, path=path, cache_key=cache_key)
+
+
+# 单例
+file_registry = FileRegistry()
@@ -0,0 +1,227 @@
+"""
+识图图片预处理 - 缩放与重新编码，减小发给多模态模型的请求体
+
+- 长边超过 VISION_IMAGE_MAX_SIDE 时等比缩小；
+- 按 VISION_IMAGE_FORMAT 重新编码（jpeg / webp / png；off 表示不处理，原样发送）；
+- VISION_IMAGE_GRAYSCALE=auto 时，几乎没有彩色像素的图片（扫描件、黑白截图）转为灰度，
+  带红章、彩色标注的图片保留彩色；always / never 强制开关；
+- 灰度的文档类图片（像素集中在接近黑、白两端）另外尝试 16 级灰阶调色板 PNG，
+  文字边缘无损且通常比 JPEG 小一个数量级；原图本身只有黑白两色（1 位图、黑白扫描件）时
+  再尝试 1 位 PNG（缩放产生的灰色边缘按阈值归为黑 / 白），取各编码中最小的；
+- 没有缩放且重新编码后不比原图小时，沿用原图；需要缩放的图片始终发送缩放结果，
+  不会把超过 VISION_IMAGE_MAX_SIDE 的原图发给模型。
+
+Pillow 不可用或图片无法解码时原样返回，不影响识别。
+"""
+import io
+import logging
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+from config import (
+    VISION_IMAGE_FORMAT,
+    VISION_IMAGE_GRAYSCALE,
+    VISION_IMAGE_MAX_SIDE,
+    VISION_IMAGE_QUALITY,
+)
+
+logger = logging.getLogger(__name__)
+
+# 格式 → (Pillow 编码器, MIME)
+_FORMATS = {
+    "jpeg": ("JPEG", "image/jpeg"),
+    "webp": ("WEBP", "image/webp"),
+    "png": ("PNG", "image/png"),
+}
+# 判断是否为彩色图：缩略图边长、饱和度阈值、彩色像素占比阈值
+_COLOR_PROBE_SIDE = 128
+_COLOR_SATURATION = 48
+_COLOR_RATIO = 0.002
+# 文档类灰度图：接近黑 / 白两端的像素占比阈值，调色板 PNG 的灰阶数
+_LINE_ART_RATIO = 0.9
+_LINE_ART_LEVELS = 16
+
+
+@dataclass
+class PreparedImage:
+    """
+    预处理结果；input_bytes 为上传文件的字节数。
+    PDF 页没有可比较的已编码输入：input_bytes 为 None，pixel_bytes 记录渲染得到的未压缩像素字节数，
+    统计中不给出 saved_bytes（与像素字节数相比的"节省"没有意义）。
+    """
+    data: bytes
+    mime: str
+    input_bytes: Optional[int]
+    width: int = 0
+    height: int = 0
+    grayscale: bool = False
+    pixel_bytes: int = 0
+
+    def stats(self) -> dict:
+        stats = {
+            "bytes": len(self.data),
+            "width": self.width,
+            "height": self.height,
+            "mime": self.mime,
+            "grayscale": self.grayscale,
+        }
+        if self.input_bytes is None:
+            stats["pixel_bytes"] = self.pixel_bytes
+        else:
+            stats["input_bytes"] = self.input_bytes
+            stats["saved_bytes"] = max(0, self.input_bytes - len(self.data))
+        return stats
+
+
+def merge_stats(items: list) -> dict:
+    """多张图片的预处理统计汇总；input_bytes / saved_bytes 只统计上传的图片文件，PDF 页另计 pixel_bytes"""
+    uploaded = [s for s in items if "input_bytes" in s]
+    merged = {
+        "images": len(items),
+        "bytes": sum(s.get("bytes", 0) for s in items),
+    }
+    if uploaded:
+        input_bytes = sum(s["input_bytes"] for s in uploaded)
+        merged["input_bytes"] = input_bytes
+        merged["saved_bytes"] = max(0, input_bytes - sum(s["bytes"] for s in uploaded))
+    if len(uploaded) < len(items):
+        merged["pixel_bytes"] = sum(s.get("pixel_bytes", 0) for s in items if "input_bytes" not in s)
+    return merged
+
+
+def _enabled() -> bool:
+    return VISION_IMAGE_FORMAT in _FORMATS
+
+
+def _is_colorless(img) -> bool:
+    probe = img.convert("RGB")
+    probe.thumbnail((_COLOR_PROBE_SIDE, _COLOR_PROBE_SIDE))
+    histogram = probe.convert("HSV").getchannel("S").histogram()
+    colored = sum(histogram[_COLOR_SATURATION:])
+    return colored <= _COLOR_RATIO * probe.width * probe.height
+
+
+def _is_bilevel(img) -> bool:
+    """原图只含接近纯黑、纯白的两种颜色（在缩放、转模式之前判断）"""
+    if img.mode == "1":
+        return True
+    if img.mode not in ("L", "P"):
+        return False
+    colors = img.convert("L").getcolors(2)
+    return colors is not None and all(v < 32 or v >= 224 for _, v in colors)
+
+
+def _is_line_art(gray) -> bool:
+    histogram = gray.histogram()
+    extremes = sum(histogram[:32]) + sum(histogram[224:])
+    return extremes >= _LINE_ART_RATIO * gray.width * gray.height
+
+
+def _encode(img, encoder: str) -> bytes:
+    buffer = io.BytesIO()
+    if encoder == "PNG":
+        img.save(buffer, format=encoder, optimize=False)
+    else:
+        img.save(buffer, format=encoder, quality=VISION_IMAGE_QUALITY)
+    return buffer.getvalue()
+
+
+def _palette_png(gray) -> bytes:
+    """灰度图按查表量化为 _LINE_ART_LEVELS 级，编码为 4 位调色板 PNG（比自适应量化快一个数量级）"""
+    from PIL import Image
+
+    levels = _LINE_ART_LEVELS
+    indexed = gray.point([v * levels // 256 for v in range(256)])
+    paletted = Image.frombuffer("P", gray.size, indexed.tobytes(), "raw", "P", 0, 1)
+    paletted.putpalette([i * 255 // (levels - 1) for i in range(levels) for _ in range(3)])
+    return _encode(paletted, "PNG")
+
+
+def _bilevel_png(gray) -> bytes:
+    """灰度图按 128 阈值转为 1 位 PNG"""
+    return _encode(gray.point(lambda v: 255 if v >= 128 else 0, "1"), "PNG")
+
+
+def _flatten(img):
+    """去掉透明通道（铺白底），统一为 RGB / L（1 位图转 L，省去三通道缩放）"""
+    from PIL import Image
+
+    if img.mode in ("RGB", "L"):
+        return img
+    if img.mode == "1":
+        return img.convert("L")
+    if img.mode in ("RGBA", "LA", "PA") or (img.mode == "P" and "transparency" in img.info):
+        rgba = img.convert("RGBA")
+        background = Image.new("RGB", rgba.size, "white")
+        background.paste(rgba, mask=rgba.getchannel("A"))
+        return background
+    return img.convert("RGB")
+
+
+def encode_image(img, input_bytes: Optional[int], original: Optional[bytes] = None,
+                 original_mime: Optional[str] = None) -> PreparedImage:
+    """缩放、按需转灰度并重新编码 Pillow 图像"""
+    from PIL import Image
+
+    encoder, mime = _FORMATS[VISION_IMAGE_FORMAT]
+    bilevel = _is_bilevel(img)
+    img = _flatten(img)
+    resized = max(img.size) > VISION_IMAGE_MAX_SIDE
+    if resized:
+        img.thumbnail((VISION_IMAGE_MAX_SIDE, VISION_IMAGE_MAX_SIDE), Image.LANCZOS)
+
+    grayscale = img.mode == "L"
+    if not grayscale and (VISION_IMAGE_GRAYSCALE == "always"
+                          or (VISION_IMAGE_GRAYSCALE == "auto" and _is_colorless(img))):
+        img = img.convert("L")
+        grayscale = True
+
+    data = _encode(img, encoder)
+    if grayscale and _is_line_art(img):
+        candidates = [_palette_png(img)]
+        if bilevel:
+            candidates.append(_bilevel_png(img))
+        smallest = min(candidates, key=len)
+        if len(smallest) < len(data):
+            data, mime = smallest, "image/png"
+
+    if original is not None and not resized and len(data) >= len(original):
+        return PreparedImage(original, original_mime or mime, input_bytes, img.width, img.height, False)
+    return PreparedImage(data, mime, input_bytes, img.width, img.height, grayscale)
+
+
+def prepare_image(image_bytes: bytes, content_type: Optional[str]) -> PreparedImage:
+    """预处理上传的图片（CPU 密集，调用方放到线程中执行）"""
+    mime = (content_type or "").strip() or "image/jpeg"
+    original = PreparedImage(image_bytes, mime, len(image_bytes))
+    if not _enabled():
+        return original
+    try:
+        from PIL import Image, ImageOps
+    except ImportError:
+        return original
+
+    try:
+        img = Image.open(io.BytesIO(image_bytes))
+        # JPEG 直接按目标尺寸降采样解码，省去大图的完整解码
+        img.draft("RGB", (VISION_IMAGE_MAX_SIDE, VISION_IMAGE_MAX_SIDE))
+        img = ImageOps.exif_transpose(img)
+        return encode_image(img, len(image_bytes), original=image_bytes, original_mime=mime)
+    except Exception as e:
+        logger.warning("[ImagePrep] 图片预处理失败，使用原图: %s", e)
+        return original
+
+
+def prepare_pixels(width: int, height: int, samples: bytes, png: Callable[[], bytes]) -> PreparedImage:
+    """预处理渲染得到的 RGB 像素（PDF 页）；未启用预处理时用 png() 编码为 PNG"""
+    if _enabled():
+        try:
+            from PIL import Image
+
+            img = Image.frombytes("RGB", (width, height), samples)
+            image = encode_image(img, None)
+            image.pixel_bytes = len(samples)
+            return image
+        except ImportError:
+            pass
+    return PreparedImage(png(), "image/png", None, width, height, pixel_bytes=len(samples))
@@ -0,0 +1,131 @@
+"""
+后台任务事件 - 工作流运行与识图任务共用
+
+- EventLog：定长事件缓冲，事件带递增 seq，订阅方按游标读取，可多个订阅方同时读取；
+- iter_events：SSE 读取循环，after 续传、落后到缓冲之外时改发 snapshot、空闲时发 ping；
+- JobSweeper：一个周期任务移除结束超过 ttl_s 的任务（任务对象需有 finished_at 属性），
+  取代每个任务一个 sleep 清理任务。
+"""
+import asyncio
+import itertools
+import logging
+import time
+from collections import deque
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_STAGES = {"done", "job_error", "cancelled"}
+
+
+class EventLog:
+    """定长事件缓冲"""
+
+    def __init__(self, maxlen: int):
+        self.seq = 0
+        self.events: "deque[dict]" = deque(maxlen=max(1, int(maxlen)))
+        self._changed = asyncio.Event()
+
+    def emit(self, event: str, data: Optional[dict] = None) -> None:
+        self.seq += 1
+        payload = dict(data or {})
+        payload["seq"] = self.seq
+        self.events.append({"event": event, "data": payload, "ts": time.time()})
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    def events_after(self, after: int) -> Tuple[List[dict], bool]:
+        """seq 大于 after 的事件；第二项为 True 表示其中一部分已被挤出缓冲，需要改发 snapshot"""
+        if after >= self.seq or not self.events:
+            return [], False
+        first = self.events[0]["data"]["seq"]
+        if after + 1 < first:
+            return [], True
+        return list(itertools.islice(self.events, after + 1 - first, None)), False
+
+    async def wait(self, after: int, timeout: float) -> bool:
+        """等待 seq 大于 after 的新事件，超时返回 False"""
+        if self.seq > after:
+            return True
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+
+async def iter_events(
+    log: EventLog,
+    after: int,
+    snapshot: Callable[[], dict],
+    is_finished: Callable[[], bool],
+    is_disconnected: Callable[[], Awaitable[bool]],
+    ping_s: float = 5.0,
+) -> AsyncIterator[Tuple[str, dict]]:
+    """
+    产出 (事件名, 数据)：after 大于 0 时先发一次 snapshot，之后推送 seq 更大的事件；
+    推送到终态事件、任务已结束且没有更多事件、或客户端断开时结束。
+    """
+    cursor = after
+    if after and log.seq >= after:
+        yield "snapshot", snapshot()
+        cursor = log.seq
+    while True:
+        items, lagged = log.events_after(cursor)
+        if lagged:
+            yield "snapshot", snapshot()
+            cursor = log.seq
+        for item in items:
+            event = item.get("event", "message")
+            yield event, item.get("data", {})
+            cursor = item["data"]["seq"]
+            if event in TERMINAL_STAGES:
+                return
+        if is_finished() and cursor >= log.seq:
+            return
+        if await is_disconnected():
+            return
+        if not await log.wait(cursor, timeout=ping_s):
+            yield "ping", {"ts": time.time()}
+
+
+class JobSweeper:
+    """周期清理已结束的任务；首次使用时惰性启动，应用退出时 close()"""
+
+    def __init__(self, jobs: Dict[str, object], ttl_s: float, interval_s: float, name: str):
+        self.jobs = jobs
+        self.ttl_s = float(ttl_s)
+        self.interval_s = max(1.0, float(interval_s))
+        self.name = name
+        self._task: Optional[asyncio.Task] = None
+
+    def ensure_started(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._loop())
+
+    def sweep(self, now: Optional[float] = None) -> int:
+        """移除结束超过 ttl_s 的任务，返回移除数"""
+        now = time.time() if now is None else now
+        expired = [
+            job_id for job_id, job in self.jobs.items()
+            if getattr(job, "finished_at", None) is not None and now - job.finished_at >= self.ttl_s
+        ]
+        for job_id in expired:
+            self.jobs.pop(job_id, None)
+        if expired:
+            logger.info("[%s] 清理过期任务 %s 个", self.name, len(expired))
+        return len(expired)
+
+    async def _loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval_s)
+            try:
+                self.sweep()
+            except Exception:
+                logger.exception("[%s] 清理任务失败", self.name)
+
+    async def close(self) -> None:
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
@@ -0,0 +1,277 @@
+"""
+LLM 批量调用 - 并发、限流、合批与重试
+
+供 ai_agent 等需要对大量行调用大模型的节点使用：
+- 并发上限：asyncio.Semaphore，同时在途的请求数不超过 concurrency；
+- 限流：进程级令牌桶（AI_AGENT_RPM），所有运行共享服务商的调用额度；
+- 合批：batch_size > 1 时把多行 Prompt 合成一次请求，要求模型按编号返回 JSON 数组，
+  缺失或无法解析的行退回单行请求；
+- 重试：网络错误、429、5xx 按指数退避（带抖动）重试，优先遵循 Retry-After；
+- 进度：回调 on_progress(已完成行数, 总行数)，最多每 _PROGRESS_INTERVAL_S 一次，完成时必定回调；
+- 缓存：传入 cache 时先按行查询响应缓存，只对未命中的行发请求，成功的结果在结束时写回
+  （合批时也按单行 Prompt 缓存，与 batch_size 无关）。
+
+单行最终失败时结果为 "Error: ..."（与原逐行处理的行为一致），不会中断整个节点。
+"""
+import asyncio
+import json
+import logging
+import random
+import re
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import httpx
+
+from config import (
+    AI_AGENT_BURST,
+    AI_AGENT_MAX_RETRIES,
+    AI_AGENT_RETRY_BASE_S,
+    AI_AGENT_RPM,
+    ARK_MODEL_NAME,
+)
+from services.llm_client import llm_clients
+from services.prompt_cache import PromptCache
+
+logger = logging.getLogger(__name__)
+
+ProgressCallback = Callable[[int, int], Awaitable[None]]
+
+_PROGRESS_INTERVAL_S = 0.5
+
+_BATCH_INSTRUCTION = (
+    "下面是若干条相互独立的任务，请逐条完成。\n"
+    "只返回一个 JSON 数组，每个元素为 {\"id\": 任务编号, \"result\": \"该任务的回答\"}，"
+    "编号与任务一一对应，不要输出其他内容。\n\n任务列表：\n"
+)
+
+
+class LLMCallError(Exception):
+    """模型调用失败；retryable 表示可以重试"""
+
+    def __init__(self, message: str, retryable: bool = False, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retryable = retryable
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """
+    令牌桶限流：按 rate（个/秒）补充，最多积攒 capacity 个。
+    令牌不足时预支并按欠额等待，保证整体速率不超过 rate。
+    """
+
+    def __init__(self, rate_per_s: float, capacity: float):
+        self.rate = max(float(rate_per_s), 1e-6)
+        self.capacity = max(float(capacity), 1.0)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self, tokens: float) -> float:
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= tokens
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    async def acquire(self, tokens: float = 1.0) -> None:
+        delay = self._reserve(tokens)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+# 进程级：服务商的速率限制按账号计算
+rate_limiter = TokenBucket(AI_AGENT_RPM / 60.0, AI_AGENT_BURST)
+
+
+async def chat_completion(prompt: str, timeout: float = 60.0, **params: Any) -> str:
+    """单次对话补全，返回文本；失败抛 LLMCallError"""
+    payload = {"model": ARK_MODEL_NAME, "messages": [{"role": "user", "content": prompt}], **params}
+    try:
+        resp = await llm_clients.http().post("chat/completions", json=payload, timeout=timeout)
+    except httpx.TransportError as e:
+        raise LLMCallError(f"请求失败: {e}", retryable=True) from e
+
+    if resp.status_code != 200:
+        retry_after = None
+        try:
+            retry_after = float(resp.headers.get("retry-after", ""))
+        except ValueError:
+            pass
+        retryable = resp.status_code == 429 or resp.status_code >= 500
+        raise LLMCallError(f"HTTP {resp.status_code} - {resp.text[:200]}", retryable, retry_after)
+    try:
+        return resp.json()["choices"][0]["message"]["content"] or ""
+    except (ValueError, KeyError, IndexError) as e:
+        raise LLMCallError(f"响应格式异常: {e}") from e
+
+
+def _parse_batch_result(content: str) -> Dict[int, str]:
+    """解析合批响应 [{"id":..,"result":..}]；代码块包裹或前后有多余文字时尽量提取"""
+    candidates = [content.strip()]
+    fenced = re.search(r"```(?:json)?\s*([\s\S]*?)\s*```", content)
+    if fenced:
+        candidates.append(fenced.group(1))
+    start, end = content.find("["), content.rfind("]")
+    if 0 <= start < end:
+        candidates.append(content[start:end + 1])
+
+    for text in candidates:
+        try:
+            items = json.loads(text)
+        except ValueError:
+            continue
+        if not isinstance(items, list):
+            continue
+        results: Dict[int, str] = {}
+        for item in items:
+            if not isinstance(item, dict) or "id" not in item:
+                continue
+            try:
+                key = int(item["id"])
+            except (TypeError, ValueError):
+                continue
+            value = item.get("result")
+            results[key] = value if isinstance(value, str) else json.dumps(value, ensure_ascii=False)
+        return results
+    return {}
+
+
+class BatchRunner:
+    """对一组 Prompt 执行并发、限流、可合批的调用，结果与输入顺序一致"""
+
+    def __init__(self, concurrency: int, batch_size: int = 1, max_retries: int = AI_AGENT_MAX_RETRIES,
+                 retry_base_s: float = AI_AGENT_RETRY_BASE_S, timeout: float = 60.0,
+                 limiter: TokenBucket = rate_limiter, on_progress: Optional[ProgressCallback] = None,
+                 cache: Optional[PromptCache] = None):
+        self.concurrency = max(1, int(concurrency))
+        self.batch_size = max(1, int(batch_size))
+        self.max_retries = max(0, int(max_retries))
+        self.retry_base_s = max(0.0, float(retry_base_s))
+        self.timeout = timeout
+        self.limiter = limiter
+        self.on_progress = on_progress
+        self.cache = cache
+        # 本次新得到的成功响应 (prompt, response)，结束时写入缓存
+        self._fresh: List[tuple] = []
+        self._done = 0
+        self._total = 0
+        self._last_report = 0.0
+        self._stats = {
+            "requests": 0, "retries": 0, "failed_rows": 0, "batch_fallback_rows": 0,
+            "cache_hits": 0, "cache_misses": 0,
+        }
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        return dict(self._stats)
+
+    async def _call(self, prompt: str) -> str:
+        """限流 + 重试的单次调用"""
+        attempt = 0
+        while True:
+            await self.limiter.acquire()
+            self._stats["requests"] += 1
+            try:
+                return await chat_completion(prompt, timeout=self.timeout)
+            except LLMCallError as e:
+                if not e.retryable or attempt >= self.max_retries:
+                    raise
+                delay = e.retry_after if e.retry_after is not None else self.retry_base_s * (2 ** attempt)
+                delay += random.uniform(0, self.retry_base_s)
+                attempt += 1
+                self._stats["retries"] += 1
+                logger.warning("[LLMBatch] 调用失败，%.1fs 后第 %s 次重试: %s", delay, attempt, e)
+                await asyncio.sleep(delay)
+
+    async def _advance(self, rows: int) -> None:
+        self._done += rows
+        now = time.monotonic()
+        if self.on_progress is None or (self._done < self._total and now - self._last_report < _PROGRESS_INTERVAL_S):
+            return
+        self._last_report = now
+        try:
+            await self.on_progress(self._done, self._total)
+        except Exception as e:
+            logger.warning("[LLMBatch] 进度回调失败: %s", e)
+
+    async def _run_single(self, index: int, prompt: str, results: List[str], sem: asyncio.Semaphore) -> None:
+        async with sem:
+            try:
+                results[index] = await self._call(prompt)
+                self._fresh.append((prompt, results[index]))
+            except Exception as e:
+                self._stats["failed_rows"] += 1
+                logger.error("[LLMBatch] 第 %s 行调用失败: %s", index + 1, e)
+                results[index] = f"Error: {e}"
+        await self._advance(1)
+
+    async def _run_batch(self, indices: List[int], prompts: List[str], results: List[str],
+                         sem: asyncio.Semaphore) -> None:
+        tasks = [{"id": i, "prompt": prompts[i]} for i in indices]
+        parsed: Dict[int, str] = {}
+        async with sem:
+            try:
+                content = await self._call(_BATCH_INSTRUCTION + json.dumps(tasks, ensure_ascii=False))
+                parsed = _parse_batch_result(content)
+            except Exception as e:
+                logger.warning("[LLMBatch] 合批请求失败，改为逐行: rows=%s error=%s", len(indices), e)
+
+        missing = [i for i in indices if i not in parsed]
+        for i in indices:
+            if i in parsed:
+                results[i] = parsed[i]
+                self._fresh.append((prompts[i], parsed[i]))
+        await self._advance(len(indices) - len(missing))
+        if missing:
+            self._stats["batch_fallback_rows"] += len(missing)
+            await asyncio.gather(*(self._run_single(i, prompts[i], results, sem) for i in missing))
+
+    async def _lookup_cache(self, prompts: List[str], results: List[str]) -> List[int]:
+        """填入缓存命中的结果，返回仍需请求的行下标"""
+        hits: Dict[int, str] = {}
+        if self.cache is not None:
+            try:
+                hits = await self.cache.get_many(ARK_MODEL_NAME, prompts)
+            except Exception as e:
+                logger.warning("[LLMBatch] 读取缓存失败，全部重新请求: %s", e)
+            self._stats["cache_hits"] = len(hits)
+            self._stats["cache_misses"] = len(prompts) - len(hits)
+        for i, value in hits.items():
+            results[i] = value
+        if hits:
+            await self._advance(len(hits))
+        return [i for i in range(len(prompts)) if i not in hits]
+
+    async def _flush_cache(self) -> None:
+        fresh, self._fresh = self._fresh, []
+        if self.cache is None or not fresh:
+            return
+        try:
+            await self.cache.put_many(ARK_MODEL_NAME, fresh)
+        except Exception as e:
+            logger.warning("[LLMBatch] 写入缓存失败: %s", e)
+
+    async def run(self, prompts: List[str]) -> List[str]:
+        self._total = len(prompts)
+        self._done = 0
+        self._fresh = []
+        results: List[str] = [""] * len(prompts)
+        pending = await self._lookup_cache(prompts, results)
+        sem = asyncio.Semaphore(self.concurrency)
+        if self.batch_size <= 1:
+            jobs = [self._run_single(i, prompts[i], results, sem) for i in pending]
+        else:
+            jobs = [
+                self._run_batch(pending[start:start + self.batch_size], prompts, results, sem)
+                for start in range(0, len(pending), self.batch_size)
+            ]
+        try:
+            await asyncio.gather(*jobs)
+        finally:
+            # 中途取消时已完成的行同样写入，下次运行可直接命中
+            await asyncio.shield(self._flush_cache())
+        return results
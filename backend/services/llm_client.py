@@ -0,0 +1,117 @@
+"""
+LLM 客户端 - 进程内共享的 HTTP 连接池
+
+所有大模型调用（AI 生成/解释/修复建议、AI 对话、识图、工作流 ai_agent 节点）共用同一组客户端：
+- keep-alive 连接池，避免每次请求重新建立 TCP/TLS 连接；
+- 安装了 h2 时启用 HTTP/2（同一连接上多路复用并发请求），否则使用 HTTP/1.1；
+- 超时与连接数上限见 config.LLM_*，单次请求仍可传 timeout 覆盖。
+
+httpx.AsyncClient 绑定创建它的事件循环，因此异步客户端按事件循环缓存；
+同步客户端（OpenAI 同步 SDK 使用）进程内只有一个。应用退出时调用 close_llm_clients()。
+"""
+import asyncio
+import importlib.util
+import logging
+import threading
+from typing import Optional
+
+import httpx
+
+from config import (
+    ARK_API_KEY,
+    ARK_BASE_URL,
+    LLM_CONNECT_TIMEOUT_S,
+    LLM_HTTP2,
+    LLM_KEEPALIVE_EXPIRY_S,
+    LLM_MAX_CONNECTIONS,
+    LLM_MAX_KEEPALIVE,
+    LLM_TIMEOUT_S,
+)
+
+logger = logging.getLogger(__name__)
+
+HTTP2_ENABLED = LLM_HTTP2 and importlib.util.find_spec("h2") is not None
+
+
+def _client_options() -> dict:
+    return {
+        "base_url": ARK_BASE_URL,
+        "headers": {"Authorization": f"Bearer {ARK_API_KEY}"},
+        "timeout": httpx.Timeout(LLM_TIMEOUT_S, connect=LLM_CONNECT_TIMEOUT_S),
+        "limits": httpx.Limits(
+            max_connections=LLM_MAX_CONNECTIONS,
+            max_keepalive_connections=LLM_MAX_KEEPALIVE,
+            keepalive_expiry=LLM_KEEPALIVE_EXPIRY_S,
+        ),
+        "http2": HTTP2_ENABLED,
+    }
+
+
+class LLMClients:
+    """共享的 httpx / OpenAI 客户端（惰性创建）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._async_http: Optional[httpx.AsyncClient] = None
+        self._async_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._async_openai = None
+        self._sync_http: Optional[httpx.Client] = None
+        self._sync_openai = None
+
+    def http(self) -> httpx.AsyncClient:
+        """当前事件循环的共享 AsyncClient；请求路径相对 ARK_BASE_URL，如 post("chat/completions")"""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self._async_http is None or self._async_loop is not loop or self._async_http.is_closed:
+                # 旧循环上的客户端无法在新循环中使用，也无法在这里关闭，交给 GC
+                self._async_http = httpx.AsyncClient(**_client_options())
+                self._async_loop = loop
+                self._async_openai = None
+                logger.info("[LLMClient] 创建连接池: http2=%s max_connections=%s", HTTP2_ENABLED, LLM_MAX_CONNECTIONS)
+            return self._async_http
+
+    def async_openai(self):
+        """共用连接池的 AsyncOpenAI"""
+        http_client = self.http()
+        with self._lock:
+            if self._async_openai is None:
+                from openai import AsyncOpenAI
+
+                self._async_openai = AsyncOpenAI(
+                    api_key=ARK_API_KEY, base_url=ARK_BASE_URL, http_client=http_client,
+                )
+            return self._async_openai
+
+    def sync_openai(self):
+        """共用连接池的同步 OpenAI（供同步调用方使用）"""
+        with self._lock:
+            if self._sync_openai is None:
+                from openai import OpenAI
+
+                self._sync_http = httpx.Client(**_client_options())
+                self._sync_openai = OpenAI(
+                    api_key=ARK_API_KEY, base_url=ARK_BASE_URL, http_client=self._sync_http,
+                )
+            return self._sync_openai
+
+    async def aclose(self) -> None:
+        with self._lock:
+            async_http, self._async_http, self._async_loop, self._async_openai = self._async_http, None, None, None
+            sync_http, self._sync_http, self._sync_openai = self._sync_http, None, None
+        if async_http is not None and not async_http.is_closed:
+            try:
+                await async_http.aclose()
+            except RuntimeError as e:
+                # 客户端属于已结束的事件循环
+                logger.debug("[LLMClient] 关闭连接池失败: %s", e)
+        if sync_http is not None:
+            sync_http.close()
+
+
+# 单例
+llm_clients = LLMClients()
+
+
+async def close_llm_clients() -> None:
+    """关闭共享连接池（应用退出时调用）"""
+    await llm_clients.aclose()
@@ -0,0 +1,147 @@
+"""
+PDF 渲染 - 在进程池中把 PDF 各页渲染为图片（识图用，渲染后在同一进程内完成缩放与编码）
+
+渲染是纯 CPU 工作且 PyMuPDF 持有 GIL，放在线程池里无法并行，因此使用进程池：
+页面按连续的小区间分给各个进程，每个进程独立打开文档渲染自己的区间，
+完成一块即可交给调用方（iter_pdf_pages），不必等整份文档渲染完。
+进程池惰性创建（spawn 方式，不继承事件循环与线程），应用退出时调用 shutdown_render_pool()。
+"""
+import asyncio
+import logging
+import math
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import AsyncIterator, List, Optional, Tuple
+
+from config import VISION_IMAGE_MAX_SIDE, VISION_MAX_PAGES, VISION_PDF_DPI, VISION_RENDER_WORKERS
+from services.image_prep import PreparedImage, prepare_pixels
+
+logger = logging.getLogger(__name__)
+
+# 每个渲染任务的页数：块越小，第一页越早可用
+_CHUNK_PAGES = 4
+
+_executor: Optional[ProcessPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+class PdfRenderError(Exception):
+    """PDF 无法打开或渲染"""
+
+
+def _open(pdf_bytes: bytes):
+    import fitz  # type: ignore
+
+    try:
+        return fitz.open(stream=pdf_bytes, filetype="pdf")
+    except Exception as e:
+        raise PdfRenderError(f"PDF open failed: {e}") from e
+
+
+def pdf_page_count(pdf_bytes: bytes) -> int:
+    doc = _open(pdf_bytes)
+    try:
+        return doc.page_count
+    finally:
+        doc.close()
+
+
+def _render_page(page, dpi: int) -> PreparedImage:
+    """渲染一页并预处理；DPI 按 VISION_IMAGE_MAX_SIDE 封顶，直接渲染到目标尺寸"""
+    longest = max(page.rect.width, page.rect.height)
+    if longest > 0:
+        dpi = max(1, min(dpi, int(VISION_IMAGE_MAX_SIDE * 72 / longest)))
+    pix = page.get_pixmap(dpi=dpi, alpha=False)
+    return prepare_pixels(pix.width, pix.height, pix.samples, lambda: pix.tobytes("png"))
+
+
+def _render_range(pdf_bytes: bytes, start: int, stop: int, dpi: int) -> List[PreparedImage]:
+    """渲染 [start, stop) 页（在子进程中执行）"""
+    doc = _open(pdf_bytes)
+    try:
+        return [_render_page(doc.load_page(i), dpi) for i in range(start, stop)]
+    except Exception as e:
+        raise PdfRenderError(f"PDF render failed: {e}") from e
+    finally:
+        doc.close()
+
+
+def render_page(pdf_bytes: bytes, index: int = 0, dpi: int = VISION_PDF_DPI) -> PreparedImage:
+    """在当前线程渲染单页"""
+    return _render_range(pdf_bytes, index, index + 1, dpi)[0]
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(
+                max_workers=max(1, VISION_RENDER_WORKERS),
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+            logger.info("[PdfRender] 创建渲染进程池: workers=%s", VISION_RENDER_WORKERS)
+        return _executor
+
+
+async def count_pdf_pages(pdf_bytes: bytes, max_pages: int = VISION_MAX_PAGES) -> int:
+    """读取页数（不渲染），空文档或超过 max_pages 时报错"""
+    loop = asyncio.get_running_loop()
+    count = await loop.run_in_executor(None, pdf_page_count, pdf_bytes)
+    if count < 1:
+        raise PdfRenderError("PDF has no pages")
+    if count > max_pages:
+        raise PdfRenderError(f"PDF has {count} pages (max {max_pages})")
+    return count
+
+
+async def iter_pdf_pages(pdf_bytes: bytes, dpi: int = VISION_PDF_DPI,
+                         max_pages: int = VISION_MAX_PAGES) -> AsyncIterator[Tuple[int, PreparedImage]]:
+    """
+    逐块渲染并按完成顺序产出 (页下标, 预处理后的图片)，调用方可以边渲染边处理已完成的页。
+    每块最多 _CHUNK_PAGES 页；只有一个渲染进程或只有一页时在线程中顺序渲染，不启动进程池。
+    """
+    loop = asyncio.get_running_loop()
+    count = await count_pdf_pages(pdf_bytes, max_pages)
+    workers = max(1, VISION_RENDER_WORKERS)
+    per_chunk = max(1, min(_CHUNK_PAGES, math.ceil(count / workers)))
+    ranges = [(start, min(start + per_chunk, count)) for start in range(0, count, per_chunk)]
+
+    if workers == 1 or count == 1:
+        for start, stop in ranges:
+            images = await loop.run_in_executor(None, _render_range, pdf_bytes, start, stop, dpi)
+            for offset, image in enumerate(images):
+                yield start + offset, image
+        return
+
+    executor = _get_executor()
+
+    async def _chunk(start: int, stop: int) -> Tuple[int, List[PreparedImage]]:
+        return start, await loop.run_in_executor(executor, _render_range, pdf_bytes, start, stop, dpi)
+
+    tasks = [asyncio.ensure_future(_chunk(start, stop)) for start, stop in ranges]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            start, images = await next_done
+            for offset, image in enumerate(images):
+                yield start + offset, image
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def render_pdf_pages(pdf_bytes: bytes, dpi: int = VISION_PDF_DPI,
+                           max_pages: int = VISION_MAX_PAGES) -> List[PreparedImage]:
+    """渲染全部页面（最多 max_pages 页），按页码顺序返回"""
+    pages = {}
+    async for index, image in iter_pdf_pages(pdf_bytes, dpi, max_pages):
+        pages[index] = image
+    return [pages[i] for i in sorted(pages)]
+
+
+def shutdown_render_pool() -> None:
+    global _executor
+    with _executor_lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,81 @@
+"""
+预览缓存 - preview_node 的节点级样本结果缓存（内容寻址）
+
+节点的缓存键 = hash(节点类型, 节点配置, 上游节点缓存键, 数据源文件指纹, source_rows)，
+因此修改某个节点只会让它自己和下游节点的键发生变化，上游样本直接复用。
+淘汰策略：LRU，同时受条目数与内存预算（DataFrame deep memory）约束。
+"""
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from config import PREVIEW_CACHE_MAX_ENTRIES, PREVIEW_CACHE_MEMORY_BYTES
+
+
+class PreviewCache:
+    """节点样本结果 LRU 缓存"""
+
+    def __init__(self, max_entries: int = PREVIEW_CACHE_MAX_ENTRIES, memory_budget: int = PREVIEW_CACHE_MEMORY_BYTES):
+        self.max_entries = max(1, int(max_entries))
+        self.memory_budget = max(0, int(memory_budget))
+        self._entries: "OrderedDict[str, Tuple[pd.DataFrame, int]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def node_key(node_type: Optional[str], config: Dict[str, Any], upstream_keys: List[str],
+                 source_checksum: Optional[str], source_rows: int) -> str:
+        payload = json.dumps(
+            {
+                "type": node_type,
+                "config": config or {},
+                "upstream": list(upstream_keys),
+                "source": source_checksum,
+                "source_rows": int(source_rows),
+            },
+            ensure_ascii=False,
+            sort_keys=True,
+            default=str,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[pd.DataFrame]:
+        """命中时返回副本：下游节点（如代码节点）可能原地修改输入"""
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            self._entries.move_to_end(key)
+            df = item[0]
+        return df.copy()
+
+    def put(self, key: str, df: pd.DataFrame) -> None:
+        nbytes = int(df.memory_usage(deep=True).sum())
+        if nbytes > self.memory_budget:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[key] = (df.copy(), nbytes)
+            self._bytes += nbytes
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.memory_budget):
+                _, (_, evicted_bytes) = self._entries.popitem(last=False)
+                self._bytes -= evicted_bytes
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._bytes}
+
+
+# 单例
+preview_cache = PreviewCache()
@@ -0,0 +1,144 @@
+"""
+Prompt 缓存 - 大模型请求/响应的磁盘缓存（SQLite，DATA_DIR/llm_cache.db）
+
+- 键 = sha256(模型名 + 渲染后的 Prompt)，同一数据重复运行时直接命中；
+- 只缓存成功的响应；超过 LLM_CACHE_TTL_S 的条目视为未命中，并在写入时顺带清理；
+- 总大小超过 LLM_CACHE_MAX_BYTES 时按最近访问时间淘汰到上限的 90%；
+- 使用独立的 DatabasePool（与业务库分开，避免缓存写入占用业务库的写连接）。
+"""
+import hashlib
+import logging
+import os
+import time
+from typing import Dict, Iterable, List, Tuple
+
+from config import DATA_DIR, LLM_CACHE_MAX_BYTES, LLM_CACHE_TTL_S
+from database import DatabasePool
+
+logger = logging.getLogger(__name__)
+
+# 单条 SQL 的参数数量上限内分批查询
+_LOOKUP_CHUNK = 500
+# 每写入这么多条检查一次总大小
+_EVICT_CHECK_EVERY = 200
+
+
+def prompt_key(model: str, prompt: str) -> str:
+    return hashlib.sha256(f"{model}\0{prompt}".encode("utf-8")).hexdigest()
+
+
+class PromptCache:
+    """模型响应缓存"""
+
+    def __init__(self, path: str, ttl_s: float = LLM_CACHE_TTL_S, max_bytes: int = LLM_CACHE_MAX_BYTES):
+        self.pool = DatabasePool(path, read_pool_size=2)
+        self.ttl_s = float(ttl_s)
+        self.max_bytes = int(max_bytes)
+        self._ready = False
+        self._writes_since_check = 0
+
+    async def _ensure_schema(self) -> None:
+        if self._ready:
+            return
+        async with self.pool.write() as db:
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS llm_cache (
+                    key TEXT PRIMARY KEY,
+                    model TEXT NOT NULL,
+                    response TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )
+            """)
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_accessed ON llm_cache (accessed_at)")
+        self._ready = True
+
+    async def get_many(self, model: str, prompts: List[str]) -> Dict[int, str]:
+        """返回 {下标: 缓存的响应}，只包含命中且未过期的条目"""
+        if not prompts:
+            return {}
+        await self._ensure_schema()
+        keys = [prompt_key(model, p) for p in prompts]
+        found: Dict[str, str] = {}
+        min_created = time.time() - self.ttl_s
+        unique = list(dict.fromkeys(keys))
+        async with self.pool.read() as db:
+            for start in range(0, len(unique), _LOOKUP_CHUNK):
+                chunk = unique[start:start + _LOOKUP_CHUNK]
+                placeholders = ", ".join("?" for _ in chunk)
+                async with db.execute(
+                    f"SELECT key, response FROM llm_cache WHERE key IN ({placeholders}) AND created_at >= ?",
+                    [*chunk, min_created],
+                ) as cursor:
+                    found.update({row[0]: row[1] for row in await cursor.fetchall()})
+
+        if found:
+            await self._touch(list(found))
+        return {i: found[k] for i, k in enumerate(keys) if k in found}
+
+    async def _touch(self, keys: List[str]) -> None:
+        now = time.time()
+        async with self.pool.write() as db:
+            for start in range(0, len(keys), _LOOKUP_CHUNK):
+                chunk = keys[start:start + _LOOKUP_CHUNK]
+                placeholders = ", ".join("?" for _ in chunk)
+                await db.execute(f"UPDATE llm_cache SET accessed_at = ? WHERE key IN ({placeholders})", [now, *chunk])
+
+    async def put_many(self, model: str, items: Iterable[Tuple[str, str]]) -> None:
+        """写入 (prompt, response)"""
+        now = time.time()
+        rows = [
+            (prompt_key(model, prompt), model, response, len(response.encode("utf-8")) + len(prompt), now, now)
+            for prompt, response in items
+        ]
+        if not rows:
+            return
+        await self._ensure_schema()
+        async with self.pool.write() as db:
+            await db.executemany("""
+                INSERT OR REPLACE INTO llm_cache (key, model, response, size, created_at, accessed_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, rows)
+        self._writes_since_check += len(rows)
+        if self._writes_since_check >= _EVICT_CHECK_EVERY:
+            self._writes_since_check = 0
+            await self.evict()
+
+    async def evict(self) -> int:
+        """删除过期条目，并在超出大小上限时按最久未访问淘汰；返回删除条数"""
+        await self._ensure_schema()
+        removed = 0
+        async with self.pool.write() as db:
+            cursor = await db.execute("DELETE FROM llm_cache WHERE created_at < ?", (time.time() - self.ttl_s,))
+            removed += cursor.rowcount
+            await cursor.close()
+            async with db.execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache") as cursor:
+                total = (await cursor.fetchone())[0]
+            if total > self.max_bytes:
+                target = int(self.max_bytes * 0.9)
+                # 按访问时间从旧到新累加，算出需要删除的条数
+                count = 0
+                async with db.execute("SELECT size FROM llm_cache ORDER BY accessed_at") as cursor:
+                    async for (size,) in cursor:
+                        total -= size
+                        count += 1
+                        if total <= target:
+                            break
+                cursor = await db.execute(
+                    "DELETE FROM llm_cache WHERE rowid IN (SELECT rowid FROM llm_cache ORDER BY accessed_at LIMIT ?)",
+                    (count,),
+                )
+                removed += cursor.rowcount
+                await cursor.close()
+        if removed:
+            logger.info("[PromptCache] 淘汰 %s 条缓存", removed)
+        return removed
+
+    async def close(self) -> None:
+        await self.pool.close()
+        self._ready = False
+
+
+# 单例
+prompt_cache = PromptCache(os.path.join(DATA_DIR, "llm_cache.db"))
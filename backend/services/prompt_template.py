@@ -0,0 +1,84 @@
+"""
+Prompt 模板 - ai_agent 节点的 {{列名}} 模板编译与批量渲染
+
+模板只解析一次：拆成「文本片段 + 引用的列」序列，渲染时只转换被引用的列，
+按列整体拼接字符串，不再逐行遍历所有列做 str.replace。
+模板未引用任何列时，按原有行为在末尾附加整行数据（每列一行 "- 列名: 值"）。
+
+与逐行 iterrows() 的旧实现相比，数值按各列自身的类型转换：旧实现在一行全部为数值列时
+会把整行升为 float，整数列渲染为 "1.0"，现在渲染为 "1"（混合类型的行两者一致）。
+同样的行会得到不同的 Prompt，ai_agent 响应缓存中此前的条目不会再命中。
+"""
+import re
+from typing import Any, List, Sequence, Tuple, Union
+
+import pandas as pd
+
+# (文本片段) 或 (列位置,)
+_Part = Union[str, Tuple[int]]
+
+
+def _as_text(series: pd.Series) -> pd.Series:
+    """
+    按列的实际类型逐值 str(value)（astype(str) 会保留缺失值、日期列省略 00:00:00，不能直接用）。
+    整数列得到 "1"，不会像 iterrows() 那样在全数值行里被升为 "1.0"。
+    """
+    return series.map(str)
+
+
+class PromptTemplate:
+    """编译后的行级 Prompt 模板"""
+
+    def __init__(self, parts: List[_Part]):
+        # 合并相邻文本片段
+        merged: List[_Part] = []
+        for part in parts:
+            if isinstance(part, str) and merged and isinstance(merged[-1], str):
+                merged[-1] += part
+            elif part != "":
+                merged.append(part)
+        self.parts = merged
+
+    @property
+    def column_positions(self) -> List[int]:
+        return sorted({part[0] for part in self.parts if not isinstance(part, str)})
+
+    @classmethod
+    def compile(cls, template: str, columns: Sequence[Any]) -> "PromptTemplate":
+        """解析模板中引用的 {{列名}}；列名不存在的占位符原样保留"""
+        positions = {}
+        for pos, col in enumerate(columns):
+            positions.setdefault(str(col), pos)
+
+        parts: List[_Part] = []
+        last = 0
+        for match in re.finditer(r"\{\{(.*?)\}\}", template, flags=re.S):
+            pos = positions.get(match.group(1))
+            if pos is None:
+                continue
+            parts.append(template[last:match.start()])
+            parts.append((pos,))
+            last = match.end()
+
+        if not parts:
+            # 模板未引用任何列：附加整行数据
+            parts = [f"{template}\n\n当前数据行:\n"]
+            for pos, col in enumerate(columns):
+                parts.extend([("\n" if pos else "") + f"- {col}: ", (pos,)])
+            return cls(parts)
+
+        parts.append(template[last:])
+        return cls(parts)
+
+    def render(self, df: pd.DataFrame) -> List[str]:
+        """对 df 的每一行渲染 Prompt，顺序与行顺序一致"""
+        if len(df) == 0:
+            return []
+        texts = {pos: _as_text(df.iloc[:, pos]).to_numpy(dtype=object) for pos in self.column_positions}
+        result = None
+        for part in self.parts:
+            piece = part if isinstance(part, str) else texts[part[0]]
+            result = piece if result is None else result + piece
+        if isinstance(result, str):
+            return [result] * len(df)
+        return result.tolist()
@@ -0,0 +1,243 @@
+"""
+运行剖析 - 记录一次工作流运行中每个节点的耗时、CPU、行数与内存
+
+- 节点墙钟时间从开始调度到结束（含等待线程池的时间）；
+- 节点内的同步调用经 wrap() 放到线程池执行，按类别（io / compute）计时，
+  同时记录所在线程的 CPU 时间（time.thread_time）；
+- 嵌套的 span 只计自身时间：例如利润表节点（compute）内部读取工作簿（io），
+  读取耗时计入 io，不会重复计入 compute；
+- 内存按 DataFrame.memory_usage(deep=True) 估计：输入取上游节点的输出占用，输出在节点结束时记录。
+
+当前节点通过 contextvars 传递：调度器为每个节点单独建任务，wrap() 把上下文带进工作线程。
+结果可转换为 Chrome trace（chrome://tracing / Perfetto 可直接打开）。
+"""
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+import pandas as pd
+
+_current_node: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("profiler_node", default=None)
+
+IO = "io"
+COMPUTE = "compute"
+
+
+def current_node_id() -> Optional[str]:
+    """当前任务/线程正在执行的节点 ID（不在节点内时为 None）"""
+    return _current_node.get()
+
+
+@dataclass
+class NodeProfile:
+    node_id: str
+    node_type: Optional[str]
+    label: Optional[str]
+    start: float
+    end: Optional[float] = None
+    status: str = "running"
+    error: Optional[str] = None
+    cached: bool = False
+    rows_in: int = 0
+    rows_out: int = 0
+    memory_before_bytes: int = 0
+    memory_after_bytes: int = 0
+    cpu_s: float = 0.0
+    category_s: Dict[str, float] = field(default_factory=dict)
+    # (类别, 开始, 结束, 线程 ID)，时间为 perf_counter 秒
+    spans: List[tuple] = field(default_factory=list)
+
+
+class _Frame:
+    __slots__ = ("child_wall", "child_cpu")
+
+    def __init__(self):
+        self.child_wall = 0.0
+        self.child_cpu = 0.0
+
+
+class RunProfiler:
+    """单次运行的节点剖析数据（线程安全）"""
+
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self._nodes: Dict[str, NodeProfile] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    # ========== 节点生命周期 ==========
+    def start_node(self, node_id: str, node_type: Optional[str], label: Optional[str],
+                   upstream_ids: List[str], input_dfs: List[pd.DataFrame]) -> NodeProfile:
+        """开始记录节点，并把当前任务的上下文标记为该节点"""
+        _current_node.set(node_id)
+        with self._lock:
+            memory_before = sum(self._nodes[u].memory_after_bytes for u in upstream_ids if u in self._nodes)
+            profile = NodeProfile(
+                node_id=node_id,
+                node_type=node_type,
+                label=label,
+                start=time.perf_counter(),
+                rows_in=sum(len(df) for df in input_dfs),
+                memory_before_bytes=memory_before,
+            )
+            self._nodes[node_id] = profile
+        return profile
+
+    def finish_node(self, node_id: str, status: str, df: Optional[pd.DataFrame] = None,
+                    memory_bytes: Optional[int] = None, error: Optional[str] = None,
+                    cached: bool = False) -> None:
+        """结束记录；memory_bytes 未给出时按输出计算 deep 占用（样本数据可直接算）"""
+        if df is not None and memory_bytes is None:
+            memory_bytes = int(df.memory_usage(deep=True).sum())
+        with self._lock:
+            profile = self._nodes.get(node_id)
+            if profile is None or profile.end is not None:
+                return
+            profile.end = time.perf_counter()
+            profile.status = status
+            profile.error = error
+            profile.cached = cached
+            if df is not None:
+                profile.rows_out = int(len(df))
+                profile.memory_after_bytes = int(memory_bytes or 0)
+
+    # ========== 计时 ==========
+    @contextmanager
+    def span(self, category: str, cpu: bool = True) -> Iterator[None]:
+        """
+        对当前节点计时。cpu=True 用于工作线程内的同步代码（支持嵌套，只计自身时间）；
+        事件循环上的 await（如 AI 请求）传 cpu=False，只记墙钟时间。
+        """
+        node_id = _current_node.get()
+        if node_id is None:
+            yield
+            return
+
+        stack: Optional[List[_Frame]] = None
+        frame = _Frame()
+        if cpu:
+            stack = getattr(self._local, "stack", None)
+            if stack is None:
+                stack = self._local.stack = []
+            stack.append(frame)
+        wall0 = time.perf_counter()
+        cpu0 = time.thread_time() if cpu else 0.0
+        try:
+            yield
+        finally:
+            wall1 = time.perf_counter()
+            wall = wall1 - wall0
+            used_cpu = (time.thread_time() - cpu0) if cpu else 0.0
+            if stack is not None:
+                stack.pop()
+                if stack:
+                    stack[-1].child_wall += wall
+                    stack[-1].child_cpu += used_cpu
+            with self._lock:
+                profile = self._nodes.get(node_id)
+                if profile is not None:
+                    profile.category_s[category] = profile.category_s.get(category, 0.0) + wall - frame.child_wall
+                    profile.cpu_s += used_cpu - frame.child_cpu
+                    profile.spans.append((category, wall0, wall1, threading.get_ident()))
+
+    def wrap(self, category: str, func: Callable[..., Any]) -> Callable[..., Any]:
+        """包装要交给线程池的同步函数：在工作线程中沿用当前节点，并按类别计时"""
+        ctx = contextvars.copy_context()
+
+        def runner(*args, **kwargs):
+            def call():
+                with self.span(category):
+                    return func(*args, **kwargs)
+            return ctx.run(call)
+
+        return runner
+
+    # ========== 输出 ==========
+    def _ms(self, seconds: float) -> float:
+        return round(seconds * 1000, 3)
+
+    def summary(self) -> Dict[str, Any]:
+        """各节点的剖析结果（按开始时间排序）及运行汇总"""
+        now = time.perf_counter()
+        with self._lock:
+            nodes = sorted(self._nodes.values(), key=lambda p: p.start)
+            items = []
+            for p in nodes:
+                end = p.end if p.end is not None else now
+                items.append({
+                    "node_id": p.node_id,
+                    "node_type": p.node_type,
+                    "label": p.label,
+                    "status": p.status,
+                    "error": p.error,
+                    "cached": p.cached,
+                    "start_ms": self._ms(p.start - self.origin),
+                    "wall_ms": self._ms(end - p.start),
+                    "cpu_ms": self._ms(p.cpu_s),
+                    "io_ms": self._ms(p.category_s.get(IO, 0.0)),
+                    "compute_ms": self._ms(p.category_s.get(COMPUTE, 0.0)),
+                    "rows_in": p.rows_in,
+                    "rows_out": p.rows_out,
+                    "memory_before_bytes": p.memory_before_bytes,
+                    "memory_after_bytes": p.memory_after_bytes,
+                    "spans": [
+                        {"category": cat, "start_ms": self._ms(s - self.origin), "dur_ms": self._ms(e - s), "tid": tid}
+                        for cat, s, e, tid in p.spans
+                    ],
+                })
+
+        dominant = max(items, key=lambda n: n["wall_ms"], default=None)
+        return {
+            "wall_ms": self._ms(now - self.origin),
+            "cpu_ms": round(sum(n["cpu_ms"] for n in items), 3),
+            "io_ms": round(sum(n["io_ms"] for n in items), 3),
+            "compute_ms": round(sum(n["compute_ms"] for n in items), 3),
+            "dominant_node": dominant["node_id"] if dominant else None,
+            "nodes": items,
+        }
+
+    def nodes(self) -> List[NodeProfile]:
+        with self._lock:
+            return list(self._nodes.values())
+
+
+def to_chrome_trace(profile: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    把 summary() 的结果转换为 Chrome trace event 格式：
+    进程 1 每个节点一行（墙钟区间），进程 2 按工作线程展示 io/compute 区间
+    """
+    events: List[Dict[str, Any]] = [
+        {"name": "process_name", "ph": "M", "pid": 1, "args": {"name": "nodes"}},
+        {"name": "process_name", "ph": "M", "pid": 2, "args": {"name": "threads"}},
+    ]
+    for lane, node in enumerate(profile.get("nodes", []), start=1):
+        events.append({"name": "thread_name", "ph": "M", "pid": 1, "tid": lane,
+                       "args": {"name": node.get("label") or node["node_id"]}})
+        events.append({
+            "name": node.get("label") or node["node_id"],
+            "cat": node.get("node_type") or "node",
+            "ph": "X",
+            "pid": 1,
+            "tid": lane,
+            "ts": node["start_ms"] * 1000,
+            "dur": node["wall_ms"] * 1000,
+            "args": {k: node[k] for k in (
+                "node_id", "status", "cached", "cpu_ms", "io_ms", "compute_ms",
+                "rows_in", "rows_out", "memory_before_bytes", "memory_after_bytes",
+            )},
+        })
+        for span in node.get("spans", []):
+            events.append({
+                "name": f"{node['node_id']}:{span['category']}",
+                "cat": span["category"],
+                "ph": "X",
+                "pid": 2,
+                "tid": span["tid"],
+                "ts": span["start_ms"] * 1000,
+                "dur": span["dur_ms"] * 1000,
+                "args": {"node_id": node["node_id"]},
+            })
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
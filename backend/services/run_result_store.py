@@ -0,0 +1,215 @@
+"""
+运行结果存储 - 按 run_id 在服务端保存每个节点的完整输出
+
+执行接口只返回 schema/行数/少量样本，完整数据通过分页接口按需切片读取：
+- 结果先放内存，总占用超过 RUN_RESULT_MEMORY_BYTES 时按最久未访问顺序落盘（Parquet，失败退化 pickle）；
+- 最多保留 RUN_RESULT_MAX_RUNS 次运行，更早的运行连同磁盘文件一起清理；
+- 落盘文件写在 RUN_RESULT_DIR 下按进程区分的子目录中，多个 uvicorn worker 互不清理对方的结果；
+  启动时清理进程已不存在的 pid-* 目录（崩溃或被杀掉的 worker 留下的）；
+- 锁只保护索引，写 / 读 Parquet 都在锁外进行。
+"""
+import logging
+import os
+import shutil
+import threading
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from config import RUN_RESULT_DIR, RUN_RESULT_MAX_RUNS, RUN_RESULT_MEMORY_BYTES
+from services.columnar_cache import read_frame, write_frame
+
+logger = logging.getLogger(__name__)
+
+
+def _pid_alive(pid: int) -> bool:
+    if os.name == "nt":
+        # Windows 上 os.kill(pid, 0) 会结束目标进程，改用 OpenProcess 探测
+        import ctypes
+
+        handle = ctypes.windll.kernel32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+        if not handle:
+            return False
+        ctypes.windll.kernel32.CloseHandle(handle)
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        # 无权限等情况按存活处理
+        return True
+    return True
+
+
+def _sweep_dead_dirs(root: str) -> None:
+    """删除 root 下进程已退出的 pid-* 目录"""
+    try:
+        names = os.listdir(root)
+    except OSError:
+        return
+    for name in names:
+        if not name.startswith("pid-") or not name[4:].isdigit():
+            continue
+        pid = int(name[4:])
+        if pid != os.getpid() and not _pid_alive(pid):
+            shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+            logger.info("[RunResultStore] 清理已退出进程的落盘目录: %s", name)
+
+
+@dataclass
+class _StoredFrame:
+    columns: List[str]
+    total_rows: int
+    nbytes: int
+    df: Optional[pd.DataFrame] = None
+    data_path: Optional[str] = None
+    fmt: Optional[str] = None
+
+
+class RunResultStore:
+    """每次运行的节点结果（可落盘）"""
+
+    def __init__(self, root: str = RUN_RESULT_DIR, memory_budget: int = RUN_RESULT_MEMORY_BYTES,
+                 max_runs: int = RUN_RESULT_MAX_RUNS):
+        # 每个进程使用自己的子目录（多 worker 共享 RUN_RESULT_DIR）
+        self.root = os.path.join(root, f"pid-{os.getpid()}")
+        self.memory_budget = max(0, int(memory_budget))
+        self.max_runs = max(1, int(max_runs))
+        self._runs: "OrderedDict[str, Dict[str, _StoredFrame]]" = OrderedDict()
+        # 内存中的条目，按最近访问排序，用于落盘淘汰
+        self._resident: "OrderedDict[Tuple[str, str], _StoredFrame]" = OrderedDict()
+        self._resident_bytes = 0
+        self._lock = threading.RLock()
+        # 同一 pid 的旧进程留下的结果已无法通过 run_id 访问，启动时清空
+        shutil.rmtree(self.root, ignore_errors=True)
+        _sweep_dead_dirs(root)
+        os.makedirs(self.root, exist_ok=True)
+
+    @staticmethod
+    def new_run_id() -> str:
+        return uuid.uuid4().hex[:12]
+
+    def _run_dir(self, run_id: str) -> str:
+        return os.path.join(self.root, run_id)
+
+    def put(self, run_id: str, node_id: str, df: pd.DataFrame) -> int:
+        """保存节点输出并返回其 deep 内存占用（字节；计算较慢，建议在线程池中调用）"""
+        nbytes = int(df.memory_usage(deep=True).sum())
+        entry = _StoredFrame(columns=[str(c) for c in df.columns], total_rows=int(len(df)), nbytes=nbytes, df=df)
+        with self._lock:
+            run = self._runs.get(run_id)
+            if run is None:
+                run = {}
+                self._runs[run_id] = run
+                self._evict_runs()
+            self._runs.move_to_end(run_id)
+            old = run.get(node_id)
+            if old is not None:
+                self._drop_resident(run_id, node_id, old)
+            run[node_id] = entry
+            self._resident[(run_id, node_id)] = entry
+            self._resident_bytes += nbytes
+            victims = self._take_over_budget()
+        self._spill(victims)
+        return nbytes
+
+    def get_rows(self, run_id: str, node_id: str, offset: int = 0, limit: int = 100) -> Optional[Tuple[pd.DataFrame, int, List[str]]]:
+        """返回 (切片, 总行数, 列名)；结果不存在返回 None"""
+        with self._lock:
+            entry = (self._runs.get(run_id) or {}).get(node_id)
+            if entry is None:
+                return None
+            self._runs.move_to_end(run_id)
+            df = entry.df
+            # 正在落盘的条目已移出 _resident，但 df 在写完前仍可读
+            if df is not None and (run_id, node_id) in self._resident:
+                self._resident.move_to_end((run_id, node_id))
+            data_path, fmt = entry.data_path, entry.fmt
+
+        offset = max(0, int(offset))
+        limit = max(0, int(limit))
+        if df is not None:
+            return df.iloc[offset:offset + limit], entry.total_rows, entry.columns
+        try:
+            if offset >= entry.total_rows or not limit:
+                return read_frame(data_path, fmt, limit=1).iloc[0:0], entry.total_rows, entry.columns
+            return read_frame(data_path, fmt, offset=offset, limit=limit), entry.total_rows, entry.columns
+        except FileNotFoundError:
+            # 运行已被淘汰（文件随之删除），按不存在处理
+            logger.warning("[RunResultStore] 落盘文件不存在: run=%s node=%s path=%s", run_id, node_id, data_path)
+            return None
+
+    def has_run(self, run_id: str) -> bool:
+        with self._lock:
+            return run_id in self._runs
+
+    def drop_run(self, run_id: str) -> None:
+        with self._lock:
+            run = self._runs.pop(run_id, None) or {}
+            for node_id, entry in run.items():
+                self._drop_resident(run_id, node_id, entry)
+        shutil.rmtree(self._run_dir(run_id), ignore_errors=True)
+
+    # ========== 内部：淘汰 ==========
+    def _drop_resident(self, run_id: str, node_id: str, entry: _StoredFrame) -> None:
+        if self._resident.pop((run_id, node_id), None) is not None:
+            self._resident_bytes -= entry.nbytes
+
+    def _take_over_budget(self) -> List[Tuple[str, str, _StoredFrame]]:
+        """（持锁调用）取出需要落盘的条目；写盘由 _spill 在锁外完成"""
+        victims = []
+        while self._resident_bytes > self.memory_budget and self._resident:
+            (run_id, node_id), entry = self._resident.popitem(last=False)
+            self._resident_bytes -= entry.nbytes
+            victims.append((run_id, node_id, entry))
+        return victims
+
+    def _spill(self, victims: List[Tuple[str, str, _StoredFrame]]) -> None:
+        """在锁外写 Parquet，写完再在锁内替换为磁盘引用；写盘期间读请求仍使用内存中的 DataFrame"""
+        for index, (run_id, node_id, entry) in enumerate(victims):
+            try:
+                base = os.path.join(self._run_dir(run_id), uuid.uuid5(uuid.NAMESPACE_URL, node_id).hex)
+                data_path, fmt = write_frame(entry.df, base)
+            except Exception as e:
+                # 落盘失败时保留在内存，避免结果丢失
+                logger.warning("[RunResultStore] 结果落盘失败: run=%s node=%s error=%s", run_id, node_id, e)
+                with self._lock:
+                    for failed_run, failed_node, failed in victims[index:]:
+                        if (self._runs.get(failed_run) or {}).get(failed_node) is failed:
+                            self._resident[(failed_run, failed_node)] = failed
+                            self._resident_bytes += failed.nbytes
+                return
+
+            with self._lock:
+                current = (self._runs.get(run_id) or {}).get(node_id) is entry
+                if current:
+                    entry.data_path, entry.fmt = data_path, fmt
+                    entry.df = None
+            if current:
+                logger.info("[RunResultStore] 结果落盘: run=%s node=%s rows=%s", run_id, node_id, entry.total_rows)
+            else:
+                # 写盘期间运行已被淘汰或节点结果已被覆盖
+                try:
+                    os.remove(data_path)
+                    os.rmdir(os.path.dirname(data_path))  # 运行已删除时目录为空
+                except OSError:
+                    pass
+
+    def close(self) -> None:
+        """应用退出时删除本进程的落盘文件"""
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def _evict_runs(self) -> None:
+        while len(self._runs) > self.max_runs:
+            run_id, run = self._runs.popitem(last=False)
+            for node_id, entry in run.items():
+                self._drop_resident(run_id, node_id, entry)
+            shutil.rmtree(self._run_dir(run_id), ignore_errors=True)
+
+
+# 单例
+run_result_store = RunResultStore()
@@ -0,0 +1,132 @@
+"""
+上传落盘 - 分块写入临时文件，边写边计算 SHA-256
+
+- 请求体大小由 UploadSizeLimit 中间件在 multipart 解析之前检查：Content-Length 超限直接 413，
+  分块传输时边接收边计数，超限中止，超大上传不会先被完整接收、落盘；
+- UploadFile 的内容已由 Starlette 缓冲到临时文件，stage_upload 把它复制到 UPLOAD_DIR 下的 .part 文件，
+  复制时再按文件本身的字节数精确检查一次（超限删除临时文件并抛 UploadTooLarge）；
+- 临时文件与目标目录在同一文件系统，写完后 os.replace 原子改名；
+- 复制在线程中进行（UploadFile.file 是同步文件对象），不阻塞事件循环。
+"""
+import asyncio
+import hashlib
+import os
+import uuid
+from typing import BinaryIO, Dict, NamedTuple, Optional
+
+from fastapi import HTTPException, UploadFile
+from fastapi.responses import JSONResponse
+
+from config import MAX_UPLOAD_BYTES, UPLOAD_CHUNK_BYTES, UPLOAD_DIR
+
+
+class UploadTooLarge(ValueError):
+    """上传内容超过大小限制"""
+
+    def __init__(self, max_bytes: int):
+        super().__init__(f"文件过大（请小于 {max_bytes // (1024 * 1024)}MB）")
+        self.max_bytes = max_bytes
+
+
+# multipart 边界、字段头等额外开销（请求体上限 = 文件上限 + 该值）
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+
+class UploadSizeLimit:
+    """
+    ASGI 中间件：按路径限制 POST 请求体大小（limits 为 路径 → 文件字节上限）。
+    在路由解析 multipart 之前生效；应加在 CORS 中间件之前（位于其内层），413 响应才带 CORS 头。
+    """
+
+    def __init__(self, app, limits: Dict[str, int]):
+        self.app = app
+        self.limits = limits
+
+    async def __call__(self, scope, receive, send):
+        limit = self.limits.get(scope["path"]) if scope["type"] == "http" and scope["method"] == "POST" else None
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+
+        detail = str(UploadTooLarge(limit))
+        max_body = limit + MULTIPART_OVERHEAD_BYTES
+        length = dict(scope["headers"]).get(b"content-length", b"")
+        if length.isdigit() and int(length) > max_body:
+            await JSONResponse({"detail": detail}, status_code=413)(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > max_body:
+                    # 解析请求体时抛出的 HTTPException 会原样交给异常处理，返回 413
+                    raise HTTPException(status_code=413, detail=detail)
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+class StagedUpload(NamedTuple):
+    """已写入临时文件的上传内容"""
+    tmp_path: str
+    size: int
+    sha256: str
+
+
+def _copy_stream(src: BinaryIO, dst_path: str, max_bytes: int, chunk_size: int) -> StagedUpload:
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(dst_path, "wb") as dst:
+            while True:
+                chunk = src.read(chunk_size)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLarge(max_bytes)
+                digest.update(chunk)
+                dst.write(chunk)
+    except BaseException:
+        discard(dst_path)
+        raise
+    return StagedUpload(tmp_path=dst_path, size=size, sha256=digest.hexdigest())
+
+
+async def stage_upload(file: UploadFile, max_bytes: int = MAX_UPLOAD_BYTES,
+                       chunk_size: int = UPLOAD_CHUNK_BYTES, dest_dir: str = UPLOAD_DIR) -> StagedUpload:
+    """把上传内容（已由 Starlette 缓冲）分块复制到 dest_dir 下的临时文件，按实际字节数检查上限"""
+    tmp_path = os.path.join(dest_dir, f".upload-{uuid.uuid4().hex}.part")
+    await file.seek(0)
+    return await asyncio.to_thread(_copy_stream, file.file, tmp_path, max_bytes, chunk_size)
+
+
+def commit_upload(staged: StagedUpload, final_path: str) -> str:
+    """临时文件原子改名为最终路径"""
+    os.replace(staged.tmp_path, final_path)
+    return final_path
+
+
+def discard(path: Optional[str]) -> None:
+    if path and os.path.exists(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+async def read_limited(file: UploadFile, max_bytes: int, chunk_size: int = UPLOAD_CHUNK_BYTES) -> bytes:
+    """分块读入内存（需要整体字节的场景，如识图），超限立即中止，不会先读完整个文件"""
+    buf = bytearray()
+    while True:
+        chunk = await file.read(chunk_size)
+        if not chunk:
+            break
+        if len(buf) + len(chunk) > max_bytes:
+            raise UploadTooLarge(max_bytes)
+        buf.extend(chunk)
+    return bytes(buf)
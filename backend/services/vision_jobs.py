@@ -0,0 +1,230 @@
+"""
+识图任务管理 - 有界的任务表、排队与事件缓冲
+
+- 同时执行的任务数由 VISION_MAX_CONCURRENT_JOBS 限制，其余按提交顺序排队，
+  排队位置变化时推送 queued 事件（position 从 1 开始）；排队数达到 VISION_MAX_QUEUED_JOBS、
+  或排队任务持有的上传内容合计超过 VISION_MAX_QUEUED_BYTES 时拒绝新任务；
+  接口在读取、预处理上传内容之前先用 check_capacity 预检，满载时不做无用功；
+- 全服务同时进行的模型调用数由 model_slots（VISION_MAX_MODEL_CALLS）限制，单图、批量各页共用；
+- 每个任务的事件存在定长缓冲（services/job_events.EventLog，VISION_JOB_EVENT_BUFFER 条）中，
+  订阅方落后到缓冲之外时改为推送一次 snapshot（当前完整结果），不会无限占用内存；
+- 任务表最多保留 VISION_MAX_JOBS 个任务，已结束的任务由一个周期清理任务（JobSweeper）在
+  VISION_JOB_TTL_S 后移除，任务表满时优先淘汰最早结束的任务。
+"""
+import asyncio
+import logging
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from config import (
+    VISION_JOB_EVENT_BUFFER,
+    VISION_JOB_SWEEP_INTERVAL_S,
+    VISION_JOB_TTL_S,
+    VISION_MAX_CONCURRENT_JOBS,
+    VISION_MAX_JOBS,
+    VISION_MAX_MODEL_CALLS,
+    VISION_MAX_QUEUED_BYTES,
+    VISION_MAX_QUEUED_JOBS,
+)
+from services.job_events import TERMINAL_STAGES, EventLog, JobSweeper
+
+logger = logging.getLogger(__name__)
+
+
+class JobQueueFull(Exception):
+    """任务排队已满或任务表已满"""
+
+
+@dataclass
+class VisionJob:
+    id: str
+    created_at: float
+    task: Optional[asyncio.Task] = None
+    cancelled: bool = False
+    text_acc: str = ""
+    stage: str = "idle"
+    finished_at: Optional[float] = None
+    # 排队位置（1 开始），未排队时为 0
+    queue_position: int = 0
+    # 批量任务：各页标签与已识别文本（按页码）
+    page_labels: List[str] = field(default_factory=list)
+    pages: List[str] = field(default_factory=list)
+    log: EventLog = field(default_factory=lambda: EventLog(VISION_JOB_EVENT_BUFFER))
+
+    def emit(self, event: str, data: Optional[dict] = None) -> None:
+        self.log.emit(event, data)
+
+    def full_text(self) -> str:
+        """批量任务按页拼接（已完成与进行中的页）；单图任务直接返回累计文本"""
+        if not self.page_labels:
+            return self.text_acc
+        return "\n\n".join(
+            f"【{label}】\n{text}" for label, text in zip(self.page_labels, self.pages) if text
+        )
+
+    def snapshot(self) -> dict:
+        return {
+            "stage": self.stage,
+            "text": self.full_text(),
+            "pages": self.pages,
+            "labels": self.page_labels,
+            "position": self.queue_position,
+            "seq": self.log.seq,
+            "done": self.stage == "done",
+            "cancelled": self.stage == "cancelled",
+        }
+
+
+Runner = Callable[[VisionJob], Awaitable[None]]
+
+
+class VisionJobManager:
+    """识图任务的提交、排队、取消与过期清理"""
+
+    def __init__(
+        self,
+        max_running: int = VISION_MAX_CONCURRENT_JOBS,
+        max_queued: int = VISION_MAX_QUEUED_JOBS,
+        max_queued_bytes: int = VISION_MAX_QUEUED_BYTES,
+        max_jobs: int = VISION_MAX_JOBS,
+        max_model_calls: int = VISION_MAX_MODEL_CALLS,
+        ttl_s: float = VISION_JOB_TTL_S,
+        sweep_interval_s: float = VISION_JOB_SWEEP_INTERVAL_S,
+    ):
+        self.max_running = max(1, int(max_running))
+        self.max_queued = max(0, int(max_queued))
+        self.max_queued_bytes = max(0, int(max_queued_bytes))
+        self.max_jobs = max(1, int(max_jobs))
+        self.model_slots = asyncio.Semaphore(max(1, int(max_model_calls)))
+        self._jobs: Dict[str, VisionJob] = {}
+        self._running: Dict[str, VisionJob] = {}
+        # job_id → (任务, runner, 持有的上传字节数)
+        self._waiting: "OrderedDict[str, Tuple[VisionJob, Runner, int]]" = OrderedDict()
+        self._queued_bytes = 0
+        self._sweeper = JobSweeper(self._jobs, ttl_s, sweep_interval_s, "VisionJobs")
+
+    def get(self, job_id: str) -> Optional[VisionJob]:
+        return self._jobs.get(job_id)
+
+    def check_capacity(self, nbytes: int = 0) -> None:
+        """
+        能否再接收一个持有 nbytes 字节上传内容的任务；不能时抛出 JobQueueFull。
+        接口在读取、预处理上传内容之前调用（此时 nbytes 可为 0），submit 时按实际大小再检查一次。
+        """
+        if len(self._running) >= self.max_running:
+            if len(self._waiting) >= self.max_queued:
+                raise JobQueueFull("识图任务排队已满，请稍后再试")
+            if self._queued_bytes + nbytes > self.max_queued_bytes:
+                raise JobQueueFull("排队中的识图内容过多，请稍后再试")
+        if len(self._jobs) >= self.max_jobs:
+            self._evict_finished(len(self._jobs) - self.max_jobs + 1)
+            if len(self._jobs) >= self.max_jobs:
+                raise JobQueueFull("识图任务过多，请稍后再试")
+
+    def submit(self, runner: Runner, nbytes: int = 0) -> VisionJob:
+        """
+        创建任务并执行 runner(job)；达到并发上限时排队，nbytes 为 runner 持有的上传内容大小。
+        排队已满、排队内容超过上限或任务表中没有可淘汰的已结束任务时抛出 JobQueueFull。
+        """
+        self._sweeper.ensure_started()
+        self.check_capacity(nbytes)
+
+        job = VisionJob(id=uuid.uuid4().hex[:10], created_at=time.time())
+        self._jobs[job.id] = job
+        if len(self._running) < self.max_running:
+            self._start(job, runner)
+        else:
+            self._waiting[job.id] = (job, runner, nbytes)
+            self._queued_bytes += nbytes
+            job.stage = "queued"
+            self._report_position(job, len(self._waiting))
+        return job
+
+    def cancel(self, job_id: str) -> bool:
+        """取消任务，返回 False 表示任务不存在或已结束"""
+        job = self._jobs.get(job_id)
+        if not job or job.stage in TERMINAL_STAGES:
+            return False
+        job.cancelled = True
+        waiting = self._waiting.pop(job_id, None)
+        if waiting is not None:
+            self._queued_bytes -= waiting[2]
+            job.queue_position = 0
+            self._finish(job, "cancelled", "已取消")
+            self._report_positions()
+        elif job.task and not job.task.done():
+            job.task.cancel()
+        return True
+
+    def _start(self, job: VisionJob, runner: Runner) -> None:
+        job.queue_position = 0
+        self._running[job.id] = job
+        job.task = asyncio.create_task(self._run(job, runner))
+
+    async def _run(self, job: VisionJob, runner: Runner) -> None:
+        try:
+            await runner(job)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.exception("[VisionJobs] 任务异常: %s", job.id)
+            self._finish(job, "job_error", f"识图提取失败: {e}")
+        finally:
+            self._running.pop(job.id, None)
+            if job.stage not in TERMINAL_STAGES:
+                self._finish(job, "cancelled" if job.cancelled else "job_error", "已取消" if job.cancelled else "任务中断")
+            job.finished_at = job.finished_at or time.time()
+            self._start_next()
+
+    def _finish(self, job: VisionJob, stage: str, message: str) -> None:
+        job.stage = stage
+        job.finished_at = time.time()
+        job.emit(stage, {"message": message})
+
+    def _start_next(self) -> None:
+        started = False
+        while self._waiting and len(self._running) < self.max_running:
+            _, (job, runner, nbytes) = self._waiting.popitem(last=False)
+            self._queued_bytes -= nbytes
+            self._start(job, runner)
+            started = True
+        if started:
+            self._report_positions()
+
+    def _report_position(self, job: VisionJob, position: int) -> None:
+        job.queue_position = position
+        job.emit("queued", {"position": position, "waiting": len(self._waiting)})
+
+    def _report_positions(self) -> None:
+        for position, (job, _, _) in enumerate(self._waiting.values(), 1):
+            if job.queue_position != position:
+                self._report_position(job, position)
+
+    def _evict_finished(self, count: int) -> None:
+        finished = sorted(
+            (job for job in self._jobs.values() if job.finished_at is not None),
+            key=lambda job: job.finished_at,
+        )
+        for job in finished[:count]:
+            self._jobs.pop(job.id, None)
+
+    def sweep(self, now: Optional[float] = None) -> int:
+        """移除结束超过 ttl_s 的任务，返回移除数"""
+        return self._sweeper.sweep(now)
+
+    async def close(self) -> None:
+        """应用退出时取消清理任务、排队与执行中的任务"""
+        tasks = [job.task for job in self._running.values() if job.task and not job.task.done()]
+        self._waiting.clear()
+        self._queued_bytes = 0
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await self._sweeper.close()
+
+
+# 单例
+vision_jobs = VisionJobManager()
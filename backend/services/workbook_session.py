@@ -0,0 +1,260 @@
+"""
+工作簿会话 - 一次运行内对同一个 Excel 文件只打开一次
+
+- 工作簿（openpyxl read_only）在首次需要解析时打开，整个会话共用；
+- read_many 中每张 Sheet 只解析一次原始单元格行，同一 Sheet 的不同表头行（header_row）
+  由这份原始行经 TextParser 生成，结果与 pd.read_excel(header=..., skiprows=..., nrows=...) 一致；
+  该 Sheet 最后一个表头行生成后即释放原始行，单独的 read 不保留，运行期间不与 DataFrame 同时常驻；
+- 列式缓存命中的 Sheet 直接读 Parquet，可在线程池中并行读取；未命中的 Sheet 在会话锁内串行解析
+  （openpyxl 工作簿对象不是线程安全的），解析结果回写列式缓存；
+- .xls 等 openpyxl 不支持的格式退化为共用一个 pd.ExcelFile。
+
+会话由 WorkflowContext 按文件持有，运行结束时关闭；读取过程通过 io_span 计入运行剖析的 I/O 时间。
+"""
+import contextlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, ContextManager, Dict, Iterable, List, Optional, Tuple, Union
+
+import pandas as pd
+from pandas.errors import EmptyDataError
+from pandas.io.parsers import TextParser
+
+from config import WORKBOOK_SESSION_WORKERS
+from services.columnar_cache import columnar_cache
+
+logger = logging.getLogger(__name__)
+
+SheetRef = Union[str, int]
+
+# 缓存命中的并行读取；独立于节点线程池，避免节点线程内再向同一线程池提交任务
+_io_executor = ThreadPoolExecutor(max_workers=max(1, WORKBOOK_SESSION_WORKERS), thread_name_prefix="workbook-io")
+
+
+def _convert_cell(cell) -> Any:
+    """与 pandas openpyxl 读取器的单元格转换保持一致"""
+    from openpyxl.cell.cell import TYPE_ERROR, TYPE_NUMERIC
+
+    value = cell.value
+    if value is None:
+        return ""
+    if cell.data_type == TYPE_ERROR:
+        return float("nan")
+    if cell.data_type == TYPE_NUMERIC:
+        as_int = int(value)
+        return as_int if as_int == value else float(value)
+    return value
+
+
+def _trim_rows(rows: List[List[Any]]) -> List[List[Any]]:
+    """按 pandas openpyxl 读取器的规则整理原始行：去掉行尾空单元格与末尾空行，再补齐为同一宽度"""
+    data = []
+    last_row_with_data = -1
+    for row_number, row in enumerate(rows):
+        end = len(row)
+        while end and row[end - 1] == "":
+            end -= 1
+        if end:
+            last_row_with_data = row_number
+        data.append(row[:end] if end < len(row) else row)
+    data = data[: last_row_with_data + 1]
+    if data:
+        width = max(len(r) for r in data)
+        data = [r + [""] * (width - len(r)) if len(r) < width else r for r in data]
+    return data
+
+
+class WorkbookSession:
+    """单个工作簿的读取会话"""
+
+    def __init__(self, key: Optional[str], file_path: str,
+                 io_span: Optional[Callable[[], ContextManager[None]]] = None):
+        self.key = key
+        self.path = file_path
+        self._io_span = io_span or contextlib.nullcontext
+        self._lock = threading.RLock()
+        self._book = None
+        self._excel_file: Optional[pd.ExcelFile] = None
+        # Sheet 名 → (原始行, 解析时需要的行数；None 表示整张表)；只在 read_many 期间保留
+        self._raw: Dict[str, Tuple[List[List[Any]], Optional[int]]] = {}
+
+    # ========== 打开与 Sheet 定位 ==========
+    def _open(self) -> None:
+        if self._book is not None or self._excel_file is not None:
+            return
+        try:
+            from openpyxl import load_workbook
+
+            self._book = load_workbook(self.path, read_only=True, data_only=True, keep_links=False)
+        except Exception as e:
+            logger.info("[WorkbookSession] openpyxl 无法打开，改用 ExcelFile: path=%s error=%s", self.path, e)
+            self._excel_file = pd.ExcelFile(self.path)
+
+    @property
+    def sheet_names(self) -> List[str]:
+        with self._lock:
+            self._open()
+            if self._book is not None:
+                return list(self._book.sheetnames)
+            return list(self._excel_file.sheet_names)
+
+    def resolve_sheet(self, sheet_name: SheetRef) -> str:
+        """按名称（精确匹配，其次去首尾空格匹配）或索引定位 Sheet；不存在抛 ValueError"""
+        names = self.sheet_names
+        if isinstance(sheet_name, int):
+            if 0 <= sheet_name < len(names):
+                return names[sheet_name]
+            raise ValueError(f"Worksheet index {sheet_name} is invalid, {len(names)} worksheets found")
+        if sheet_name in names:
+            return sheet_name
+        want = str(sheet_name).strip()
+        for name in names:
+            if str(name).strip() == want:
+                return name
+        raise ValueError(f"Worksheet named '{sheet_name}' not found")
+
+    # ========== 解析 ==========
+    def _raw_rows(self, sheet: str, rows_needed: Optional[int]) -> List[List[Any]]:
+        """读取 Sheet 的原始单元格行（已有足够行数时直接复用）"""
+        cached = self._raw.get(sheet)
+        if cached is not None:
+            rows, parsed_limit = cached
+            if parsed_limit is None or (rows_needed is not None and rows_needed <= parsed_limit):
+                return rows
+
+        ws = self._book[sheet]
+        ws.reset_dimensions()
+        data: List[List[Any]] = []
+        for row in ws.rows:
+            data.append([_convert_cell(cell) for cell in row])
+            if rows_needed is not None and len(data) >= rows_needed:
+                break
+        data = _trim_rows(data)
+
+        self._raw[sheet] = (data, rows_needed)
+        return data
+
+    def _parse(self, sheet: SheetRef, header_row: int, skip_rows: int, nrows: Optional[int],
+               keep_raw: bool = False) -> pd.DataFrame:
+        """keep_raw 为 False 时用完即释放该 Sheet 的原始行"""
+        with self._lock:
+            name = self.resolve_sheet(sheet)
+            if self._excel_file is not None:
+                return self._excel_file.parse(
+                    name,
+                    header=header_row - 1,
+                    skiprows=range(1, skip_rows + 1) if skip_rows else None,
+                    nrows=nrows,
+                )
+            rows_needed = (header_row + skip_rows + nrows) if nrows is not None else None
+            rows = self._raw_rows(name, rows_needed)
+            if not keep_raw:
+                self._raw.pop(name, None)
+            if rows_needed is not None:
+                # 缓存中可能是更多的行（如整表）：按本次需要的行数截取后重新整理，
+                # 末尾空行与行宽只取决于这几行，与 pd.read_excel(nrows=...) 一致
+                rows = _trim_rows(rows[:rows_needed])
+
+        if not rows:
+            return pd.DataFrame()
+        try:
+            parser = TextParser(
+                list(rows),
+                header=header_row - 1,
+                skiprows=range(1, skip_rows + 1) if skip_rows else None,
+                nrows=nrows,
+                skip_blank_lines=False,
+            )
+            return parser.read(nrows)
+        except EmptyDataError:
+            return pd.DataFrame()
+
+    # ========== 读取入口 ==========
+    def read(self, sheet_name: SheetRef = 0, header_row: int = 1, skip_rows: int = 0,
+             nrows: Optional[int] = None) -> pd.DataFrame:
+        """与 columnar_cache.read_excel 相同语义：优先列式缓存，未命中解析会话内的工作簿"""
+        header_row = int(header_row)
+        skip_rows = int(skip_rows or 0)
+        nrows = int(nrows) if nrows else None
+        with self._io_span():
+            if self.key and not skip_rows:
+                cached = columnar_cache.read(self.key, self.path, sheet_name, header_row, nrows=nrows)
+                if cached is not None:
+                    return cached
+            return self._read_uncached(sheet_name, header_row, skip_rows, nrows)
+
+    def _read_uncached(self, sheet_name: SheetRef, header_row: int, skip_rows: int,
+                       nrows: Optional[int], keep_raw: bool = False) -> pd.DataFrame:
+        """解析后回写列式缓存：整表直接写入，限行读取则后台物化整表"""
+        df = self._parse(sheet_name, header_row, skip_rows, nrows, keep_raw)
+        if self.key and not skip_rows:
+            if nrows is None:
+                columnar_cache.schedule_store(self.key, self.path, sheet_name, header_row, df)
+            else:
+                columnar_cache.schedule_materialize(self.key, self.path, [sheet_name], header_row)
+        return df
+
+    def read_many(self, requests: Iterable[Tuple[SheetRef, int]], nrows: Optional[int] = None,
+                  missing_ok: bool = True) -> Dict[Tuple[SheetRef, int], pd.DataFrame]:
+        """
+        批量读取 (Sheet, 表头行)：缓存命中的并行读取，其余在会话内解析（每张 Sheet 只解析一次）。
+        missing_ok 时缺失或解析失败的 Sheet 返回空表。
+        """
+        with self._io_span():
+            return self._read_many(list(dict.fromkeys(requests)), int(nrows) if nrows else None, missing_ok)
+
+    def _read_many(self, targets: List[Tuple[SheetRef, int]], nrows: Optional[int],
+                   missing_ok: bool) -> Dict[Tuple[SheetRef, int], pd.DataFrame]:
+        results: Dict[Tuple[SheetRef, int], pd.DataFrame] = {}
+
+        if self.key:
+            futures = {
+                target: _io_executor.submit(columnar_cache.read, self.key, self.path, target[0], target[1], nrows)
+                for target in targets
+            }
+            for target, future in futures.items():
+                cached = future.result()
+                if cached is not None:
+                    results[target] = cached
+
+        # 表头行大的先解析：它需要的原始行最多，同一 Sheet 其它表头行可直接复用
+        pending = sorted((t for t in targets if t not in results), key=lambda t: -int(t[1]))
+        # 每张 Sheet 还有几个表头行待解析：降到 0 时不再保留原始行
+        remaining: Dict[str, int] = {}
+        for target in pending:
+            name = self._sheet_key(target[0])
+            remaining[name] = remaining.get(name, 0) + 1
+        for target in pending:
+            name = self._sheet_key(target[0])
+            remaining[name] -= 1
+            try:
+                results[target] = self._read_uncached(target[0], int(target[1]), 0, nrows,
+                                                      keep_raw=remaining[name] > 0)
+            except Exception as e:
+                if not missing_ok:
+                    raise
+                logger.warning("[WorkbookSession] 读取失败: sheet=%s header_row=%s file=%s error=%s",
+                               target[0], target[1], self.path, e)
+                results[target] = pd.DataFrame()
+        return results
+
+    def _sheet_key(self, sheet: SheetRef) -> str:
+        """用于按 Sheet 计数的键（Sheet 不存在时沿用原引用，读取时再报错）"""
+        try:
+            return self.resolve_sheet(sheet)
+        except ValueError:
+            return str(sheet)
+
+    def close(self) -> None:
+        with self._lock:
+            self._raw.clear()
+            if self._book is not None:
+                try:
+                    self._book.close()
+                except Exception:
+                    pass
+                self._book = None
+            if self._excel_file is not None:
+                self._excel_file.close()
+                self._excel_file = None
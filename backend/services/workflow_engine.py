@@ -4,21 +4,47 @@ import asyncio
 import logging
 import os
 import re
-from typing import Dict, List, Any, Optional
+import threading
+import time
+from typing import Awaitable, Callable, Dict, List, Any, Optional, Tuple
 from uuid import uuid4
 from datetime import datetime, timedelta
-from config import UPLOAD_DIR
+from config import (
+    AI_AGENT_BATCH_SIZE,
+    AI_AGENT_CONCURRENCY,
+    HISTORY_STATS_MAX_RUNS,
+    LLM_CACHE_ENABLED,
+    RUN_RESULT_SAMPLE_ROWS,
+    UPLOAD_DIR,
+)
+from database import db_pool, fetch_page
 from services.ai_service import ai_service
+from services.file_registry import ResolvedFile, file_registry
+from services.llm_batch import BatchRunner
+from services.run_profiler import COMPUTE, IO, RunProfiler, current_node_id
+from services.run_result_store import run_result_store
+from services.preview_cache import preview_cache
+from services.prompt_cache import prompt_cache
+from services.prompt_template import PromptTemplate
+from services.workflow_scheduler import workflow_scheduler
+from services.workbook_session import WorkbookSession
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 class WorkflowContext:
-    """工作流执行上下文，存储节点结果"""
-    def __init__(self):
+    """工作流执行上下文，存储节点结果与剖析数据"""
+    def __init__(self, on_event: Optional[Callable[[str, Dict[str, Any]], Awaitable[None]]] = None):
+        self._on_event = on_event
         self._results: Dict[str, pd.DataFrame] = {}
         self._logs: List[str] = []
+        # 节点自行上报的统计（如 AI 节点的缓存命中数），随节点结果返回
+        self._metrics: Dict[str, Dict[str, Any]] = {}
+        self.profiler = RunProfiler()
+        # 本次运行打开的工作簿会话（同一文件的多个节点共用）
+        self._workbooks: Dict[Tuple[str, str], WorkbookSession] = {}
+        self._workbooks_lock = threading.Lock()
     
     def set_result(self, node_id: str, df: pd.DataFrame):
         self._results[node_id] = df
@@ -34,36 +60,143 @@ class WorkflowContext:
         self._logs.append(f"[{timestamp}] {message}")
         print(f"[{timestamp}] {message}")
 
+    def add_metrics(self, **metrics: Any) -> None:
+        """为当前节点记录统计数据"""
+        node_id = current_node_id()
+        if node_id is not None:
+            self._metrics.setdefault(node_id, {}).update(metrics)
+
+    def get_metrics(self, node_id: str) -> Dict[str, Any]:
+        return self._metrics.get(node_id, {})
+
+    def workbook(self, source: ResolvedFile) -> WorkbookSession:
+        with self._workbooks_lock:
+            session = self._workbooks.get((source.cache_key, source.path))
+            if session is None:
+                session = WorkbookSession(source.cache_key, source.path, io_span=lambda: self.profiler.span(IO))
+                self._workbooks[(source.cache_key, source.path)] = session
+            return session
+
+    async def report_progress(self, done: int, total: int) -> None:
+        """长耗时节点（如 AI 节点）上报进度，以 node_progress 事件推送给订阅方"""
+        if self._on_event is not None:
+            await self._on_event("node_progress", {"node_id": current_node_id(), "done": done, "total": total})
+
+    async def run_sync(self, category: str, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """在节点线程池中执行同步函数，耗时按类别（io / compute）计入当前节点"""
+        return await workflow_scheduler.run_sync(self.profiler.wrap(category, func), *args, **kwargs)
+
+    def close(self):
+        with self._workbooks_lock:
+            sessions = list(self._workbooks.values())
+            self._workbooks.clear()
+        for session in sessions:
+            session.close()
+
+def _safe_records(df: pd.DataFrame, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    """DataFrame → 可 JSON 序列化的 records（空值统一为空字符串）"""
+    view = df.head(limit).copy() if limit else df.copy()
+    # Categorical 列不能直接 fillna("")（"" 不是其合法类别），需要先添加空类别
+    for col in view.columns:
+        try:
+            if pd.api.types.is_categorical_dtype(view[col].dtype):
+                if '' not in view[col].cat.categories:
+                    view[col] = view[col].cat.add_categories([''])
+                view[col] = view[col].fillna('')
+        except Exception:
+            # 如果某些扩展类型不支持上述处理，退化为后续统一 fillna
+            pass
+    return view.fillna("").to_dict(orient="records")
+
+
+def _percentile(sorted_values: List[float], q: float) -> float:
+    """线性插值分位数（sorted_values 已升序且非空）"""
+    pos = (len(sorted_values) - 1) * q
+    lo = int(pos)
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (pos - lo)
+
+
+def _upstream_ids(node_id: str, dependencies: List[Tuple[str, str]]) -> List[str]:
+    return list(dict.fromkeys(src for src, tgt in dependencies if tgt == node_id))
+
+
+def _node_parts(node: Dict) -> Tuple[Optional[str], Optional[str], Dict]:
+    """兼容两种节点格式（顶层字段 / data 字段），返回 (type, label, config)"""
+    node_data = node.get('data') if isinstance(node, dict) and 'data' in node else node
+    node_type = (node_data or {}).get('type')
+    node_label = (node_data or {}).get('label', node_type)
+    node_config = (node_data or {}).get('config', {}) or {}
+    return node_type, node_label, node_config
+
+
 class WorkflowEngine:
-    async def execute_workflow(self, workflow_config: Dict, file_mapping: Dict[str, str]) -> Dict:
-        """执行工作流"""
-        context = WorkflowContext()
+    # profit_summary 可在 config 中直接引用上游节点（不一定有连线），调度时视为隐式依赖
+    _IMPLICIT_DEPENDENCY_KEYS = ('income_node_id', 'cost_node_id', 'expense_node_id')
+
+    def _dependency_pairs(self, nodes: List[Dict], edges: List[Dict]) -> List[Tuple[str, str]]:
+        """连线 + 隐式依赖 → (上游, 下游) 列表"""
+        pairs = [(e.get('source'), e.get('target')) for e in edges if e.get('source') and e.get('target')]
+        for node in nodes:
+            if not isinstance(node, dict) or 'id' not in node:
+                continue
+            node_type, _, node_config = _node_parts(node)
+            if node_type != 'profit_summary':
+                continue
+            for key in self._IMPLICIT_DEPENDENCY_KEYS:
+                upstream = str(node_config.get(key) or '').strip()
+                if upstream:
+                    pairs.append((upstream, node['id']))
+        return pairs
+
+    @staticmethod
+    def _collect_inputs(node_id: str, edges: List[Dict], context: 'WorkflowContext') -> List[pd.DataFrame]:
+        """按连线顺序收集上游输出"""
+        input_dfs = []
+        for edge in edges:
+            if edge.get('target') == node_id:
+                df = context.get_result(edge.get('source'))
+                if df is not None:
+                    input_dfs.append(df)
+        return input_dfs
+
+    async def execute_workflow(
+        self,
+        workflow_config: Dict,
+        file_mapping: Dict[str, str],
+        run_id: Optional[str] = None,
+        on_event: Optional[Callable[[str, Dict[str, Any]], Awaitable[None]]] = None,
+        workflow_id: Optional[str] = None,
+    ) -> Dict:
+        """
+        执行工作流：依赖就绪的节点交给调度器并发执行。
+        各节点完整输出保存在 run_result_store（按 run_id 分页读取），响应只带 schema/行数/样本。
+
+        Args:
+            run_id: 指定运行 ID（异步运行接口会先生成 ID 再提交），默认自动生成
+            on_event: 节点进度回调 (event, data)，event 为 node_started / node_progress / node_done / node_error
+            workflow_id: 已保存工作流的 ID，写入执行历史（临时运行可为空）
+
+        响应中的 profile 为各节点的剖析结果（墙钟/CPU/io/compute 时间、行数、内存），
+        每次运行（含失败、取消）都会据此写入执行历史。
+
+        取消：外层任务被 cancel 时，调度器会取消在跑的节点，CancelledError 原样抛出。
+        """
+        run_id = run_id or run_result_store.new_run_id()
+
+        async def emit(event: str, data: Dict[str, Any]) -> None:
+            if on_event is None:
+                return
+            try:
+                await on_event(event, data)
+            except Exception as e:
+                logger.warning(f"进度回调失败: {event} {e}")
+
+        context = WorkflowContext(on_event=emit)
         nodes = workflow_config.get("nodes", [])
         edges = workflow_config.get("edges", [])
-        
-        # 构建图的邻接表
-        adj = {node['id']: [] for node in nodes}
-        in_degree = {node['id']: 0 for node in nodes}
         node_map = {node['id']: node for node in nodes}
-        
-        for edge in edges:
-            source = edge['source']
-            target = edge['target']
-            if source in adj and target in in_degree:
-                adj[source].append(target)
-                in_degree[target] += 1
-        
-        # 拓扑排序
-        queue = [node['id'] for node in nodes if in_degree[node['id']] == 0]
-        execution_order = []
-        
-        while queue:
-            node_id = queue.pop(0)
-            execution_order.append(node_id)
-            for neighbor in adj[node_id]:
-                in_degree[neighbor] -= 1
-                if in_degree[neighbor] == 0:
-                    queue.append(neighbor)
+        dependencies = self._dependency_pairs(nodes, edges)
         
         # 执行
         output_file = None
@@ -74,103 +207,172 @@ class WorkflowEngine:
         # 初始化所有节点为pending状态
         for node in nodes:
             node_status[node['id']] = 'pending'
-        
-        try:
-            for node_id in execution_order:
-                if node_id not in node_map:
-                    continue
-                    
-                node = node_map[node_id]
-                
-                # 兼容两种节点格式
-                if 'data' in node:
-                    node_data = node['data']
-                else:
-                    node_data = node
-                
-                node_type = node_data.get('type')
-                node_label = node_data.get('label', node_type)
-                node_config = node_data.get('config', {})
+
+        async def run_node(node_id: str) -> None:
+            nonlocal output_file, final_preview
+            node_type, node_label, node_config = _node_parts(node_map[node_id])
+            
+            context.log(f"开始执行节点: {node_label} ({node_id})")
+            await emit("node_started", {"node_id": node_id, "label": node_label, "type": node_type})
+            
+            try:
+                # 获取输入数据
+                input_dfs = self._collect_inputs(node_id, edges, context)
+                context.profiler.start_node(node_id, node_type, node_label, _upstream_ids(node_id, dependencies), input_dfs)
                 
-                context.log(f"开始执行节点: {node_label} ({node_id})")
+                # 执行节点
+                result_df = await self._execute_node_by_type(node_type, node_config, input_dfs, context, file_mapping)
                 
-                try:
-                    # 获取输入数据
-                    input_dfs = []
-                    for edge in edges:
-                        if edge['target'] == node_id:
-                            source_id = edge['source']
-                            df = context.get_result(source_id)
-                            if df is not None:
-                                input_dfs.append(df)
+                if result_df is not None:
+                    context.set_result(node_id, result_df)
+                    context.log(f"节点 {node_label} 执行成功，输出 {len(result_df)} 行数据")
                     
-                    # 执行节点
-                    result_df = await self._execute_node_by_type(node_type, node_config, input_dfs, context, file_mapping)
+                    # 记录节点结果（用于前端预览）
+                    node_status[node_id] = 'success'
+                    node_results[node_id] = await context.run_sync(IO, self._store_node_result, run_id, node_id, result_df)
+                    if context.get_metrics(node_id):
+                        node_results[node_id]["metrics"] = context.get_metrics(node_id)
                     
-                    if result_df is not None:
-                        context.set_result(node_id, result_df)
-                        context.log(f"节点 {node_label} 执行成功，输出 {len(result_df)} 行数据")
-                        
-                        # 记录节点结果（用于前端预览）
-                        node_status[node_id] = 'success'
-
-                        def _safe_records(df: pd.DataFrame, limit: Optional[int] = None):
-                            view = df.head(limit).copy() if limit else df.copy()
-                            # Categorical 列不能直接 fillna("")（"" 不是其合法类别），需要先添加空类别
-                            for col in view.columns:
-                                try:
-                                    if pd.api.types.is_categorical_dtype(view[col].dtype):
-                                        if '' not in view[col].cat.categories:
-                                            view[col] = view[col].cat.add_categories([''])
-                                        view[col] = view[col].fillna('')
-                                except Exception:
-                                    # 如果某些扩展类型不支持上述处理，退化为后续统一 fillna
-                                    pass
-                            return view.fillna("").to_dict(orient="records")
-
-                        node_results[node_id] = {
+                    if node_type in ['output', 'output_csv']:
+                        output_file = await context.run_sync(IO, self._save_output, result_df, node_config, node_type)
+                        final_preview = {
                             "columns": result_df.columns.tolist(),
-                            "data": _safe_records(result_df),  # 返回全部数据
+                            "data": _safe_records(result_df, limit=100),
                             "total_rows": len(result_df)
                         }
-                        
-                        if node_type in ['output', 'output_csv']:
-                            output_file = self._save_output(result_df, node_config, node_type)
-                            final_preview = {
-                                "columns": result_df.columns.tolist(),
-                                "data": _safe_records(result_df, limit=100),
-                                "total_rows": len(result_df)
-                            }
-                    else:
-                        node_status[node_id] = 'success'  # 无输出但成功
-                        
-                except Exception as node_error:
-                    node_status[node_id] = 'error'
-                    import traceback
-                    node_results[node_id] = {"error": str(node_error), "traceback": traceback.format_exc()}
-                    context.log(f"节点 {node_label} 执行失败: {str(node_error)}")
-                    raise node_error  # 继续抛出，中断工作流
+                else:
+                    node_status[node_id] = 'success'  # 无输出但成功
+                context.profiler.finish_node(
+                    node_id, "success", result_df,
+                    memory_bytes=(node_results.get(node_id) or {}).get("memory_bytes", 0),
+                )
+
+                summary = node_results.get(node_id) or {}
+                await emit("node_done", {
+                    "node_id": node_id,
+                    "status": "success",
+                    "columns": summary.get("columns", []),
+                    "total_rows": summary.get("total_rows", 0),
+                    "metrics": context.get_metrics(node_id),
+                })
+                    
+            except Exception as node_error:
+                node_status[node_id] = 'error'
+                import traceback
+                node_results[node_id] = {"error": str(node_error), "traceback": traceback.format_exc()}
+                context.log(f"节点 {node_label} 执行失败: {str(node_error)}")
+                context.profiler.finish_node(node_id, "error", error=str(node_error))
+                await emit("node_error", {"node_id": node_id, "error": str(node_error)})
+                raise node_error  # 继续抛出，中断工作流
+            except asyncio.CancelledError:
+                context.profiler.finish_node(node_id, "cancelled")
+                raise
+        
+        status, error, output = "cancelled", None, None
+        try:
+            await workflow_scheduler.run(
+                list(node_map.keys()),
+                dependencies,
+                run_node,
+                max_concurrency=workflow_config.get("max_concurrency"),
+            )
+            status, output = "success", output_file
             
             return {
                 "success": True,
+                "run_id": run_id,
                 "output_file": output_file,
                 "preview": final_preview,
                 "logs": context._logs,
                 "node_status": node_status,
-                "node_results": node_results
+                "node_results": node_results,
+                "profile": context.profiler.summary()
             }
             
         except Exception as e:
             logger.error(f"工作流执行失败: {str(e)}")
             import traceback
             traceback.print_exc()
+            status, error = "error", str(e)
             return {
                 "success": False,
+                "run_id": run_id,
                 "error": str(e),
                 "logs": context._logs,
                 "node_status": node_status,
-                "node_results": node_results
+                "node_results": node_results,
+                "profile": context.profiler.summary()
+            }
+        finally:
+            context.close()
+            input_file_ids = [
+                file_mapping.get(cfg['file_id'], cfg['file_id'])
+                for cfg in (_node_parts(node)[2] for node in nodes) if cfg.get('file_id')
+            ]
+            await self._record_run(
+                run_id, workflow_id, input_file_ids, status, error, output, context.profiler.summary(),
+            )
+
+    async def _record_run(self, run_id: str, workflow_id: Optional[str], input_file_ids: List[str],
+                          status: str, error: Optional[str], output_file: Optional[str],
+                          profile: Dict[str, Any]) -> None:
+        """按剖析结果写入执行历史；失败只记日志，不影响运行结果"""
+        node_metrics = {
+            node["node_id"]: {
+                "node_type": node["node_type"],
+                "status": node["status"],
+                "duration_ms": node["wall_ms"],
+                "input_rows": node["rows_in"],
+                "output_rows": node["rows_out"],
+                "output_bytes": node["memory_after_bytes"],
+                "error": node["error"],
             }
+            for node in profile["nodes"]
+        }
+        # 节点输出在运行结束前一直保留在上下文中，峰值内存按全部输出之和估计
+        peak_memory = sum(m["output_bytes"] for m in node_metrics.values())
+        summary = {
+            "error": error,
+            "node_count": len(node_metrics),
+            "failed_nodes": [nid for nid, m in node_metrics.items() if m["status"] == "error"],
+        }
+        try:
+            await self.save_execution_history(
+                run_id, workflow_id, list(dict.fromkeys(input_file_ids)), output_file, status,
+                json.dumps(summary, ensure_ascii=False), profile["wall_ms"], peak_memory, node_metrics,
+            )
+        except Exception as e:
+            logger.warning(f"执行历史写入失败: run={run_id} error={e}")
+
+    @staticmethod
+    def _store_node_result(run_id: str, node_id: str, df: pd.DataFrame) -> Dict[str, Any]:
+        """完整结果留在服务端，返回给前端的只有 schema、行数和有限样本"""
+        memory_bytes = run_result_store.put(run_id, node_id, df)
+        return {
+            "run_id": run_id,
+            "columns": df.columns.tolist(),
+            "dtypes": {str(col): str(dtype) for col, dtype in df.dtypes.items()},
+            "data": _safe_records(df, limit=RUN_RESULT_SAMPLE_ROWS),
+            "sample_rows": int(min(len(df), RUN_RESULT_SAMPLE_ROWS)),
+            "total_rows": len(df),
+            "memory_bytes": memory_bytes
+        }
+
+    def get_run_rows(self, run_id: str, node_id: str, offset: int, limit: int) -> Optional[Dict[str, Any]]:
+        """分页读取某次运行的节点输出；运行或节点不存在返回 None"""
+        page = run_result_store.get_rows(run_id, node_id, offset, limit)
+        if page is None:
+            return None
+        df, total_rows, columns = page
+        return {
+            "run_id": run_id,
+            "node_id": node_id,
+            "columns": columns,
+            "data": _safe_records(df),
+            "offset": offset,
+            "limit": limit,
+            "total_rows": total_rows
+        }
 
     async def preview_node(
         self,
@@ -195,106 +397,89 @@ class WorkflowEngine:
             return {"success": False, "error": f"预览失败: 找不到节点 {node_id}"}
 
         # 1) 仅保留目标节点的上游依赖（包含自身）
+        dependencies = self._dependency_pairs(list(node_map.values()), edges)
         required = {node_id}
         changed = True
         while changed:
             changed = False
-            for e in edges:
-                src = e.get('source')
-                tgt = e.get('target')
-                if tgt in required and src and src not in required:
+            for src, tgt in dependencies:
+                if tgt in required and src not in required:
                     required.add(src)
                     changed = True
 
-        # 2) 拓扑排序（限制在 required 子图）
-        adj = {nid: [] for nid in required}
-        in_degree = {nid: 0 for nid in required}
-        for e in edges:
-            src = e.get('source')
-            tgt = e.get('target')
-            if src in required and tgt in required:
-                adj[src].append(tgt)
-                in_degree[tgt] += 1
-
-        queue = [nid for nid in required if in_degree.get(nid, 0) == 0]
-        execution_order = []
-        while queue:
-            nid = queue.pop(0)
-            execution_order.append(nid)
-            for neighbor in adj.get(nid, []):
-                in_degree[neighbor] -= 1
-                if in_degree[neighbor] == 0:
-                    queue.append(neighbor)
-
-        if node_id not in execution_order:
-            return {"success": False, "error": "预览失败: 工作流存在环或依赖不完整，无法得到执行顺序"}
-
-        def _safe_records(df: pd.DataFrame, limit: int):
-            view = df.head(limit).copy()
-            for col in view.columns:
-                try:
-                    if pd.api.types.is_categorical_dtype(view[col].dtype):
-                        if '' not in view[col].cat.categories:
-                            view[col] = view[col].cat.add_categories([''])
-                        view[col] = view[col].fillna('')
-                except Exception:
-                    pass
-            return view.fillna("").to_dict(orient="records")
-
-        # 3) 执行到目标节点（样本）
+        # 2) 在 required 子图上调度执行（样本）；每个节点先按内容哈希查预览缓存
         node_status = {nid: 'pending' for nid in required}
         node_results = {}
-        try:
-            for nid in execution_order:
-                node = node_map.get(nid)
-                if not node:
-                    continue
-
-                node_data = node.get('data') if isinstance(node, dict) and 'data' in node else node
-                node_type = (node_data or {}).get('type')
-                node_label = (node_data or {}).get('label', node_type)
-                node_config = (node_data or {}).get('config', {}) or {}
-
+        node_keys: Dict[str, str] = {}
+
+        async def run_node(nid: str) -> None:
+            node = node_map.get(nid)
+            if not node:
+                node_keys[nid] = f"missing:{nid}"
+                return
+
+            node_type, node_label, node_config = _node_parts(node)
+            upstream_keys = [node_keys.get(src, f"missing:{src}") for src, tgt in dependencies if tgt == nid]
+            checksum = await self._preview_source_checksum(node_type, node_config, file_mapping)
+            # 指纹已标识源文件（内容哈希或旧记录的 file_id），file_id 本身不参与键：内容相同的上传共用缓存
+            key_config = {k: v for k, v in node_config.items() if k != 'file_id'} if checksum else node_config
+            cache_key = preview_cache.node_key(node_type, key_config, upstream_keys, checksum, source_rows)
+            node_keys[nid] = cache_key
+
+            input_dfs = self._collect_inputs(nid, edges, context)
+            context.profiler.start_node(nid, node_type, node_label, _upstream_ids(nid, dependencies), input_dfs)
+            result_df = preview_cache.get(cache_key)
+            cached = result_df is not None
+            if cached:
+                context.log(f"[Preview] 命中缓存: {node_label} ({nid})")
+            else:
                 context.log(f"[Preview] 开始执行节点: {node_label} ({nid})")
-
-                input_dfs = []
-                for e in edges:
-                    if e.get('target') == nid:
-                        src_id = e.get('source')
-                        df = context.get_result(src_id)
-                        if df is not None:
-                            input_dfs.append(df)
-
-                result_df = await self._execute_node_by_type_preview(
-                    node_type=node_type,
-                    config=node_config,
-                    input_dfs=input_dfs,
-                    context=context,
-                    file_mapping=file_mapping,
-                    source_rows=source_rows
-                )
-
+                try:
+                    result_df = await self._execute_node_by_type_preview(
+                        node_type=node_type,
+                        config=node_config,
+                        input_dfs=input_dfs,
+                        context=context,
+                        file_mapping=file_mapping,
+                        source_rows=source_rows
+                    )
+                except Exception as e:
+                    context.profiler.finish_node(nid, "error", error=str(e))
+                    raise
                 if result_df is not None:
-                    context.set_result(nid, result_df)
-                    node_status[nid] = 'success'
-                    node_results[nid] = {
-                        "columns": result_df.columns.tolist(),
-                        "total_rows": len(result_df)
-                    }
-                else:
-                    node_status[nid] = 'success'
+                    await workflow_scheduler.run_sync(preview_cache.put, cache_key, result_df)
+            context.profiler.finish_node(nid, "success", result_df, cached=cached)
+
+            if result_df is not None:
+                context.set_result(nid, result_df)
+                node_status[nid] = 'success'
+                node_results[nid] = {
+                    "columns": result_df.columns.tolist(),
+                    "total_rows": len(result_df),
+                    "cached": cached
+                }
+                if context.get_metrics(nid):
+                    node_results[nid]["metrics"] = context.get_metrics(nid)
+            else:
+                node_status[nid] = 'success'
 
-                if nid == node_id:
-                    break
+        try:
+            ordered = [nid for nid in node_map if nid in required] + [nid for nid in required if nid not in node_map]
+            completed = await workflow_scheduler.run(
+                ordered,
+                dependencies,
+                run_node,
+                max_concurrency=workflow_config.get("max_concurrency"),
+            )
+            if node_id not in completed:
+                return {"success": False, "error": "预览失败: 工作流存在环或依赖不完整，无法得到执行顺序"}
 
             df = context.get_result(node_id)
             if df is None:
                 return {"success": False, "error": "预览失败: 该节点无输出或上游未提供数据", "logs": context._logs}
 
             # 4) 统计 + 抽样（对账优先看差异）
-            node_data = node_map[node_id].get('data') if 'data' in node_map[node_id] else node_map[node_id]
-            node_type = (node_data or {}).get('type')
-            node_config = (node_data or {}).get('config', {}) or {}
+            node_type, _, node_config = _node_parts(node_map[node_id])
 
             stats: Dict[str, Any] = {
                 "rows_total": int(len(df)),
@@ -344,7 +529,8 @@ class WorkflowEngine:
                 "preview": preview_payload,
                 "logs": context._logs,
                 "node_status": node_status,
-                "node_results": node_results
+                "node_results": node_results,
+                "profile": context.profiler.summary()
             }
         except Exception as e:
             logger.error(f"节点预览失败: {str(e)}")
@@ -355,24 +541,52 @@ class WorkflowEngine:
                 "traceback": traceback.format_exc(),
                 "logs": context._logs,
                 "node_status": node_status,
-                "node_results": node_results
+                "node_results": node_results,
+                "profile": context.profiler.summary()
             }
+        finally:
+            context.close()
 
     async def _execute_node_by_type(self, node_type: str, config: Dict, input_dfs: List[pd.DataFrame], context: WorkflowContext, file_mapping: Dict) -> Optional[pd.DataFrame]:
-        """根据节点类型执行具体逻辑"""
+        """根据节点类型执行具体逻辑：数据源先解析文件路径，计算统一放到节点线程池，避免阻塞事件循环"""
         
         # ========== 数据源 ==========
         if node_type == 'source':
-            return self._execute_source(config, file_mapping)
+            source = await self._resolve_source(config, file_mapping)
+            return await context.run_sync(IO, self._execute_source, config, context.workbook(source))
             
         elif node_type == 'source_csv':
-            return self._execute_source_csv(config, file_mapping)
+            source = await self._resolve_source(config, file_mapping)
+            return await context.run_sync(IO, self._execute_source_csv, config, source)
 
         elif node_type == 'source_optional':
-            return self._execute_source_optional(config, file_mapping)
-        
+            if not config.get('file_id'):
+                return pd.DataFrame()
+            cfg = self._optional_source_config(config)
+            source = await self._resolve_source(cfg, file_mapping)
+            return await context.run_sync(IO, self._execute_source, cfg, context.workbook(source))
+
+        elif node_type == 'profit_table':
+            # 利润表节点：从单个工作簿读取多Sheet并汇总输出（不依赖 input_dfs）
+            if not (config or {}).get('file_id'):
+                raise ValueError("利润表节点缺少配置：file_id（请选择Excel文件）")
+            source = await self._resolve_source(config, file_mapping)
+            # 工作簿读取由会话计入 io，其余为汇总计算
+            return await context.run_sync(COMPUTE, self._execute_profit_table, config, context.workbook(source))
+
+        # ========== AI/自动化 ==========
+        elif node_type == 'ai_agent':
+            if not input_dfs: return None
+            with context.profiler.span(IO, cpu=False):
+                return await self._execute_ai_agent(input_dfs[0], config, context)
+
+        return await context.run_sync(COMPUTE, self._execute_compute_node, node_type, config, input_dfs, context)
+
+    def _execute_compute_node(self, node_type: str, config: Dict, input_dfs: List[pd.DataFrame], context: WorkflowContext) -> Optional[pd.DataFrame]:
+        """纯计算节点（同步，在节点线程池中执行）"""
+
         # ========== 数据清洗 ==========
-        elif node_type == 'transform':
+        if node_type == 'transform':
             if not input_dfs: return None
             return self._execute_transform(input_dfs[0], config)
             
@@ -451,17 +665,9 @@ class WorkflowEngine:
             # 汇总节点支持通过 config 指定上游节点ID；也支持仅按连线输入顺序（input_dfs）推断
             return self._execute_profit_summary(input_dfs, config, context)
 
-        elif node_type == 'profit_table':
-            # 利润表节点：从单个工作簿读取多Sheet并汇总输出（不依赖 input_dfs）
-            return self._execute_profit_table(config, file_mapping)
-        
         # ========== AI/自动化 ==========
         elif node_type == 'code':
             return self._execute_code(input_dfs, config, context)
-            
-        elif node_type == 'ai_agent':
-            if not input_dfs: return None
-            return await self._execute_ai_agent(input_dfs[0], config)
         
         # ========== 输出 ==========
         elif node_type in ['output', 'output_csv']:
@@ -470,6 +676,24 @@ class WorkflowEngine:
         
         return None
 
+    _FILE_NODE_TYPES = ('source', 'source_csv', 'source_optional', 'profit_table')
+
+    async def _preview_source_checksum(self, node_type: Optional[str], config: Dict, file_mapping: Dict) -> Optional[str]:
+        """
+        读文件的节点：返回源文件指纹（参与预览缓存键）；解析失败交给执行阶段报错。
+        有内容哈希的上传直接用哈希（内容相同的上传共用缓存条目）；没有哈希的旧记录退回 file_id + 大小 + 修改时间。
+        """
+        if node_type not in self._FILE_NODE_TYPES or not (config or {}).get('file_id'):
+            return None
+        try:
+            source = await self._resolve_source(config, file_mapping)
+            if source.cache_key != source.file_id:
+                return f"sha256:{source.cache_key}"
+            st = os.stat(source.path)
+        except (FileNotFoundError, OSError):
+            return None
+        return f"{source.cache_key}:{st.st_size}:{st.st_mtime_ns}"
+
     async def _execute_node_by_type_preview(
         self,
         node_type: str,
@@ -481,13 +705,22 @@ class WorkflowEngine:
     ) -> Optional[pd.DataFrame]:
         """预览模式：数据源读取限制行数，避免全量读取。"""
         if node_type == 'source':
-            return self._execute_source_limited(config, file_mapping, source_rows)
+            source = await self._resolve_source(config, file_mapping)
+            return await context.run_sync(IO, self._execute_source_limited, config, context.workbook(source), source_rows)
         if node_type == 'source_csv':
-            return self._execute_source_csv_limited(config, file_mapping, source_rows)
+            source = await self._resolve_source(config, file_mapping)
+            return await context.run_sync(IO, self._execute_source_csv_limited, config, source, source_rows)
         if node_type == 'source_optional':
-            return self._execute_source_optional_limited(config, file_mapping, source_rows)
+            if not config.get('file_id'):
+                return pd.DataFrame()
+            cfg = self._optional_source_config(config)
+            source = await self._resolve_source(cfg, file_mapping)
+            return await context.run_sync(IO, self._execute_source_limited, cfg, context.workbook(source), source_rows)
         if node_type == 'profit_table':
-            return self._execute_profit_table(config, file_mapping, nrows=source_rows)
+            if not (config or {}).get('file_id'):
+                raise ValueError("利润表节点缺少配置：file_id（请选择Excel文件）")
+            source = await self._resolve_source(config, file_mapping)
+            return await context.run_sync(COMPUTE, self._execute_profit_table, config, context.workbook(source), nrows=source_rows)
 
         # 预览不支持 AI 节点（可能很慢/有副作用）
         if node_type == 'ai_agent':
@@ -496,99 +729,59 @@ class WorkflowEngine:
         # 其余节点复用原执行逻辑
         return await self._execute_node_by_type(node_type, config, input_dfs, context, file_mapping)
 
-    def _execute_source_limited(self, config: Dict, file_mapping: Dict, nrows: int) -> pd.DataFrame:
+    async def _resolve_source(self, config: Dict, file_mapping: Dict) -> ResolvedFile:
+        """按 file_mapping 映射后，通过文件注册表解析数据源文件路径"""
         file_id = config.get('file_id')
         mapped_id = file_mapping.get(file_id, file_id)
+        try:
+            return await file_registry.resolve(mapped_id)
+        except FileNotFoundError:
+            raise FileNotFoundError(f"找不到文件: {file_id}") from None
 
-        for f in os.listdir(UPLOAD_DIR):
-            if f.startswith(mapped_id):
-                file_path = os.path.join(UPLOAD_DIR, f)
-                sheet_name = config.get('sheet_name', 0)
-                header_row = config.get('header_row', 1) - 1
-                skip_rows = config.get('skip_rows', 0)
-
-                try:
-                    sheet_name = int(sheet_name)
-                except Exception:
-                    pass
-
-                return pd.read_excel(
-                    file_path,
-                    sheet_name=sheet_name,
-                    header=header_row,
-                    skiprows=range(1, skip_rows + 1) if skip_rows else None,
-                    nrows=int(nrows) if nrows else None
-                )
-
-        raise FileNotFoundError(f"找不到文件: {file_id}")
+    def _execute_source_limited(self, config: Dict, workbook: WorkbookSession, nrows: int) -> pd.DataFrame:
+        sheet_name = config.get('sheet_name', 0)
+        header_row = config.get('header_row', 1) - 1
+        skip_rows = config.get('skip_rows', 0)
 
-    def _execute_source_csv_limited(self, config: Dict, file_mapping: Dict, nrows: int) -> pd.DataFrame:
-        file_id = config.get('file_id')
-        mapped_id = file_mapping.get(file_id, file_id)
+        try:
+            sheet_name = int(sheet_name)
+        except Exception:
+            pass
 
-        for f in os.listdir(UPLOAD_DIR):
-            if f.startswith(mapped_id):
-                file_path = os.path.join(UPLOAD_DIR, f)
-                delimiter = config.get('delimiter', ',')
-                encoding = config.get('encoding', 'utf-8')
-                return pd.read_csv(file_path, delimiter=delimiter, encoding=encoding, nrows=int(nrows) if nrows else None)
+        return workbook.read(sheet_name, header_row=header_row + 1, skip_rows=skip_rows, nrows=nrows)
 
-        raise FileNotFoundError(f"找不到文件: {file_id}")
+    def _execute_source_csv_limited(self, config: Dict, source: ResolvedFile, nrows: int) -> pd.DataFrame:
+        delimiter = config.get('delimiter', ',')
+        encoding = config.get('encoding', 'utf-8')
+        return pd.read_csv(source.path, delimiter=delimiter, encoding=encoding, nrows=int(nrows) if nrows else None)
 
-    def _execute_source_optional_limited(self, config: Dict, file_mapping: Dict, nrows: int) -> pd.DataFrame:
-        file_id = config.get('file_id')
-        if not file_id:
-            return pd.DataFrame()
+    @staticmethod
+    def _optional_source_config(config: Dict) -> Dict:
         cfg = dict(config or {})
         if not cfg.get('sheet_name') and cfg.get('sheet_name') != 0:
             cfg['sheet_name'] = 0
-        return self._execute_source_limited(cfg, file_mapping, nrows)
+        return cfg
 
     # ========== 数据源实现 ==========
-    def _execute_source(self, config: Dict, file_mapping: Dict) -> pd.DataFrame:
-        file_id = config.get('file_id')
-        mapped_id = file_mapping.get(file_id, file_id)
+    def _execute_source(self, config: Dict, workbook: WorkbookSession) -> pd.DataFrame:
+        sheet_name = config.get('sheet_name', 0)
+        header_row = config.get('header_row', 1) - 1
+        skip_rows = config.get('skip_rows', 0)
         
-        for f in os.listdir(UPLOAD_DIR):
-            if f.startswith(mapped_id):
-                file_path = os.path.join(UPLOAD_DIR, f)
-                sheet_name = config.get('sheet_name', 0)
-                header_row = config.get('header_row', 1) - 1
-                skip_rows = config.get('skip_rows', 0)
-                
-                try:
-                    sheet_name = int(sheet_name)
-                except:
-                    pass
-                
-                df = pd.read_excel(file_path, sheet_name=sheet_name, header=header_row, skiprows=range(1, skip_rows + 1) if skip_rows else None)
-                return df
-                
-        raise FileNotFoundError(f"找不到文件: {file_id}")
-
-    def _execute_source_optional(self, config: Dict, file_mapping: Dict) -> pd.DataFrame:
-        file_id = config.get('file_id')
-        if not file_id:
-            return pd.DataFrame()
-        cfg = dict(config or {})
-        if not cfg.get('sheet_name') and cfg.get('sheet_name') != 0:
-            cfg['sheet_name'] = 0
-        return self._execute_source(cfg, file_mapping)
+        try:
+            sheet_name = int(sheet_name)
+        except:
+            pass
+        
+        df = workbook.read(sheet_name, header_row=header_row + 1, skip_rows=skip_rows)
+        return df
 
-    def _execute_source_csv(self, config: Dict, file_mapping: Dict) -> pd.DataFrame:
-        file_id = config.get('file_id')
-        mapped_id = file_mapping.get(file_id, file_id)
+    def _execute_source_csv(self, config: Dict, source: ResolvedFile) -> pd.DataFrame:
+        delimiter = config.get('delimiter', ',')
+        encoding = config.get('encoding', 'utf-8')
         
-        for f in os.listdir(UPLOAD_DIR):
-            if f.startswith(mapped_id):
-                file_path = os.path.join(UPLOAD_DIR, f)
-                delimiter = config.get('delimiter', ',')
-                encoding = config.get('encoding', 'utf-8')
-                
-                df = pd.read_csv(file_path, delimiter=delimiter, encoding=encoding)
-                return df
-                
-        raise FileNotFoundError(f"找不到文件: {file_id}")
+        df = pd.read_csv(source.path, delimiter=delimiter, encoding=encoding)
+        return df
 
     # ========== 数据清洗实现 ==========
     def _execute_transform(self, df: pd.DataFrame, config: Dict) -> pd.DataFrame:
@@ -1138,7 +1331,7 @@ class WorkflowEngine:
         return result
 
     # ========== 利润表（业务模块）实现 ==========
-    def _execute_profit_table(self, config: Dict, file_mapping: Dict, nrows: Optional[int] = None) -> pd.DataFrame:
+    def _execute_profit_table(self, config: Dict, workbook: WorkbookSession, nrows: Optional[int] = None) -> pd.DataFrame:
         """
         利润表（模板列）汇总：从单个工作簿读取多张来源Sheet，能计算的列尽量填充，其它列留空。
 
@@ -1146,82 +1339,35 @@ class WorkflowEngine:
         系统从其中的来源Sheet（订单明细/直播间/退货/资金日报/分摊费用/工资表/财务系统/富友流水/房租/市场定额…）
         汇总得到一张“部分利润表”。
 
+        来源Sheet通过工作簿会话一次性读取：工作簿只打开一次，同一 Sheet 的不同表头行共用一次解析，
+        同一次运行中的其它利润表节点复用同一个会话。
+
         nrows 仅用于预览模式：限制读取行数，避免全量读取导致卡顿。
         """
         cfg = config or {}
         file_id = cfg.get('file_id')
-        if not file_id:
-            raise ValueError("利润表节点缺少配置：file_id（请选择Excel文件）")
+        logger.info("[ProfitTable] file_id=%s mapped_id=%s file_path=%s", file_id, workbook.key, workbook.path)
 
-        mapped_id = file_mapping.get(file_id, file_id)
-        file_path = None
-        for f in os.listdir(UPLOAD_DIR):
-            if f.startswith(mapped_id):
-                file_path = os.path.join(UPLOAD_DIR, f)
-                break
-        if not file_path:
-            raise FileNotFoundError(f"找不到文件: {file_id}")
-        logger.info("[ProfitTable] file_id=%s mapped_id=%s file_path=%s", file_id, mapped_id, file_path)
-
-        def _read_sheet(sheet_name: str, limit: Optional[int] = None) -> pd.DataFrame:
-            try:
-                return pd.read_excel(
-                    file_path,
-                    sheet_name=sheet_name,
-                    nrows=int(limit) if limit else None,
-                    engine="openpyxl",
-                )
-            except Exception as e:
-                logger.warning(
-                    "[ProfitTable] read_sheet failed: sheet=%s file=%s error=%s",
-                    sheet_name,
-                    file_path,
-                    e,
-                    exc_info=True,
-                )
-                try:
-                    xf = pd.ExcelFile(file_path, engine="openpyxl")
-                    target = None
-                    if isinstance(sheet_name, str):
-                        want = sheet_name.strip()
-                        for idx, name in enumerate(xf.sheet_names):
-                            if str(name).strip() == want:
-                                target = idx
-                                break
-                    if target is None:
-                        target = sheet_name
-                    df = xf.parse(target, nrows=int(limit) if limit else None)
-                    logger.info(
-                        "[ProfitTable] read_sheet fallback success: sheet=%s resolved=%s",
-                        sheet_name,
-                        target,
-                    )
-                    return df
-                except Exception as e2:
-                    logger.warning(
-                        "[ProfitTable] read_sheet fallback failed: sheet=%s file=%s error=%s",
-                        sheet_name,
-                        file_path,
-                        e2,
-                        exc_info=True,
-                    )
-                    return pd.DataFrame()
-
-        # 来源Sheet（缺失则为空表）
-        orders = _read_sheet('订单明细', nrows)
-        live = _read_sheet('直播间', nrows)
-        returns = _read_sheet('退货', nrows)
-        funds = _read_sheet('资金日报', nrows)
-        alloc = _read_sheet('分摊费用', nrows)
-        gifts = _read_sheet('礼品', nrows)
-        gifts_hu = _read_sheet('胡礼品', nrows)
-        travel = _read_sheet('旅游8月份分12个月下费用', nrows)
-        payroll = _read_sheet('工资表', nrows)
-        finance = _read_sheet('财务系统', nrows)
-        fuiou = _read_sheet('富友流水', nrows)
-        rent_liu = _read_sheet('刘洋房租', nrows)
-        rent_hu = _read_sheet('胡兴旺房租', nrows)
-        quota = _read_sheet('市场定额', nrows)
+        # 来源Sheet（缺失则为空表）；分摊费用另需按第2行作表头读取一次
+        source_sheets = [
+            '订单明细', '直播间', '退货', '资金日报', '分摊费用', '礼品', '胡礼品', '旅游8月份分12个月下费用',
+            '工资表', '财务系统', '富友流水', '刘洋房租', '胡兴旺房租', '市场定额',
+        ]
+        sheets = workbook.read_many([(name, 1) for name in source_sheets] + [('分摊费用', 2)], nrows=nrows)
+        orders = sheets[('订单明细', 1)]
+        live = sheets[('直播间', 1)]
+        returns = sheets[('退货', 1)]
+        funds = sheets[('资金日报', 1)]
+        alloc = sheets[('分摊费用', 1)]
+        gifts = sheets[('礼品', 1)]
+        gifts_hu = sheets[('胡礼品', 1)]
+        travel = sheets[('旅游8月份分12个月下费用', 1)]
+        payroll = sheets[('工资表', 1)]
+        finance = sheets[('财务系统', 1)]
+        fuiou = sheets[('富友流水', 1)]
+        rent_liu = sheets[('刘洋房租', 1)]
+        rent_hu = sheets[('胡兴旺房租', 1)]
+        quota = sheets[('市场定额', 1)]
 
         # 输出列（对齐模板：docx/2025年转加盟利润表模板.xlsx → “利润表表头统一格式（2025.8启用）” 第4行）
         columns = [
@@ -1574,11 +1720,7 @@ class WorkflowEngine:
 
         # ========== 分摊费用：直播流量/仓储/企微/税费/手续费 ==========
         alloc_raw = alloc.copy() if isinstance(alloc, pd.DataFrame) else pd.DataFrame()
-        alloc_h1 = pd.DataFrame()
-        try:
-            alloc_h1 = pd.read_excel(file_path, sheet_name='分摊费用', header=1, nrows=int(nrows) if nrows else None)
-        except Exception:
-            alloc_h1 = pd.DataFrame()
+        alloc_h1 = sheets[('分摊费用', 2)]
 
         s_live_flow = pd.Series(dtype=float)
         if not alloc_h1.empty and '门店名称' in alloc_h1.columns and '摊销金额' in alloc_h1.columns:
@@ -2181,93 +2323,43 @@ class WorkflowEngine:
             raise ValueError("代码节点必须将结果DataFrame赋值给 'result' 变量")
         return result
 
-    async def _execute_ai_agent(self, df: pd.DataFrame, config: Dict) -> pd.DataFrame:
-        logger.info(f"[AI Agent] ========== 开始执行 AI Agent 节点 ==========")
-        logger.info(f"[AI Agent] 收到配置: {config}")
-        logger.info(f"[AI Agent] 输入数据行数: {len(df)}, 列: {list(df.columns)}")
-        
+    async def _execute_ai_agent(self, df: pd.DataFrame, config: Dict, context: WorkflowContext) -> pd.DataFrame:
+        """
+        逐行调用大模型，结果写入 target_column。
+        可选配置：concurrency（并发数）、batch_size（每次请求合并的行数）、max_rows（只处理前 N 行）、
+        use_cache（是否使用响应缓存，默认开启；结果有随机性要求时关闭）。
+        """
         prompt_template = config.get('prompt', '')
         target_column = config.get('target_column', 'AI_Result')
-        
-        logger.info(f"[AI Agent] Prompt模板: {prompt_template}")
-        logger.info(f"[AI Agent] 目标列名: {target_column}")
-        
         if not prompt_template:
             logger.error("[AI Agent] 错误: Prompt模板为空!")
             raise ValueError("AI节点必须包含Prompt配置")
 
-        limit = min(len(df), 20)
-        df_head = df.head(limit).copy()
-        logger.info(f"[AI Agent] 将处理 {limit} 行数据")
-        
-        results = []
-        for idx, (index, row) in enumerate(df_head.iterrows()):
-            logger.info(f"[AI Agent] 处理第 {idx+1}/{limit} 行...")
-            
-            # 构建包含行数据的Prompt
-            row_prompt = prompt_template
-            
-            # 替换模板中的 {{列名}} 占位符
-            for col in df.columns:
-                placeholder = f"{{{{{col}}}}}"
-                if placeholder in row_prompt:
-                    row_prompt = row_prompt.replace(placeholder, str(row[col]))
-            
-            # 如果Prompt中没有任何占位符被替换，自动附加当前行的完整数据
-            has_placeholder = any(f"{{{{{col}}}}}" in prompt_template for col in df.columns)
-            if not has_placeholder:
-                row_data_str = "\n".join([f"- {col}: {row[col]}" for col in df.columns])
-                row_prompt = f"{prompt_template}\n\n当前数据行:\n{row_data_str}"
-            
-            logger.info(f"[AI Agent] 实际Prompt (前300字符): {row_prompt[:300]}...")
-            
-            try:
-                logger.info(f"[AI Agent] 开始调用AI...")
-                ai_resp = await self._simple_ai_call(row_prompt)
-                logger.info(f"[AI Agent] 第 {idx+1} 行AI返回: {ai_resp[:100] if ai_resp else 'None'}...")
-                results.append(ai_resp)
-            except Exception as e:
-                logger.error(f"[AI Agent] 第 {idx+1} 行调用失败: {str(e)}")
-                import traceback
-                traceback.print_exc()
-                results.append(f"Error: {str(e)}")
-        
-        logger.info(f"[AI Agent] 所有行处理完成，共 {len(results)} 个结果")
-        df_head[target_column] = results
-        logger.info(f"[AI Agent] ========== AI Agent 节点执行结束 ==========")
-        return df_head
+        max_rows = config.get('max_rows')
+        df_out = (df.head(int(max_rows)) if max_rows else df).copy()
+        prompts = PromptTemplate.compile(prompt_template, df_out.columns).render(df_out)
 
-    async def _simple_ai_call(self, prompt: str) -> str:
-        import httpx
-        from config import ARK_API_KEY, ARK_BASE_URL, ARK_MODEL_NAME
-        
-        logger.info(f"[AI Agent] 调用AI，使用模型: {ARK_MODEL_NAME}")
-        logger.debug(f"[AI Agent] Prompt: {prompt[:100]}...")
-        
-        try:
-            async with httpx.AsyncClient(timeout=60.0) as client:
-                resp = await client.post(
-                    f"{ARK_BASE_URL}/chat/completions",
-                    headers={"Authorization": f"Bearer {ARK_API_KEY}"},
-                    json={
-                        "model": ARK_MODEL_NAME,
-                        "messages": [{"role": "user", "content": prompt}]
-                    }
-                )
-                
-                logger.info(f"[AI Agent] API响应状态: {resp.status_code}")
-                
-                if resp.status_code == 200:
-                    result = resp.json()['choices'][0]['message']['content']
-                    logger.info(f"[AI Agent] 成功获取响应: {result[:50]}...")
-                    return result
-                else:
-                    error_msg = f"AI调用失败: HTTP {resp.status_code} - {resp.text[:200]}"
-                    logger.error(f"[AI Agent] {error_msg}")
-                    return error_msg
-        except Exception as e:
-            logger.error(f"[AI Agent] 调用异常: {str(e)}")
-            return f"调用失败: {str(e)}"
+        concurrency = min(int(config.get('concurrency') or AI_AGENT_CONCURRENCY), AI_AGENT_CONCURRENCY)
+        batch_size = int(config.get('batch_size') or AI_AGENT_BATCH_SIZE)
+        logger.info(f"[AI Agent] 开始处理 {len(prompts)} 行: concurrency={concurrency} batch_size={batch_size}")
+
+        use_cache = LLM_CACHE_ENABLED and config.get('use_cache', True) is not False
+        runner = BatchRunner(
+            concurrency=concurrency, batch_size=batch_size, on_progress=context.report_progress,
+            cache=prompt_cache if use_cache else None,
+        )
+        started = time.perf_counter()
+        results = await runner.run(prompts)
+        logger.info(f"[AI Agent] 处理完成: rows={len(results)} 耗时={time.perf_counter() - started:.1f}s stats={runner.stats}")
+        stats = runner.stats
+        context.log(
+            f"AI 节点处理 {len(results)} 行，缓存命中 {stats['cache_hits']} 行，"
+            f"请求 {stats['requests']} 次，失败 {stats['failed_rows']} 行"
+        )
+        context.add_metrics(ai=stats)
+
+        df_out[target_column] = results
+        return df_out
 
     # ========== 输出实现 ==========
     def _save_output(self, df: pd.DataFrame, config: Dict, node_type: str = 'output') -> str:
@@ -2288,20 +2380,18 @@ class WorkflowEngine:
         return str(filename)
 
     # ========== 数据库操作方法 ==========
-    async def get_all_workflows(self) -> List[Dict]:
-        import aiosqlite
-        from database import DATABASE_PATH
-        async with aiosqlite.connect(DATABASE_PATH) as db:
-            db.row_factory = aiosqlite.Row
-            cursor = await db.execute("SELECT id, name, description, created_at, updated_at FROM workflows ORDER BY updated_at DESC")
-            rows = await cursor.fetchall()
-            return [dict(row) for row in rows]
+    async def list_workflows(self, limit: int, cursor: Optional[str] = None,
+                             include_config: bool = False) -> Tuple[List[Dict], Optional[str]]:
+        """按更新时间倒序分页；config 较大，默认不查询"""
+        columns = "id, name, description, created_at, updated_at" + (", config" if include_config else "")
+        rows, next_cursor = await fetch_page(columns, "workflows", "updated_at", limit, cursor)
+        if include_config:
+            for row in rows:
+                row['config'] = json.loads(row['config'])
+        return rows, next_cursor
     
     async def get_workflow(self, workflow_id: str) -> Optional[Dict]:
-        import aiosqlite
-        from database import DATABASE_PATH
-        async with aiosqlite.connect(DATABASE_PATH) as db:
-            db.row_factory = aiosqlite.Row
+        async with db_pool.read() as db:
             cursor = await db.execute("SELECT * FROM workflows WHERE id = ?", (workflow_id,))
             row = await cursor.fetchone()
             if row:
@@ -2311,47 +2401,117 @@ class WorkflowEngine:
             return None
     
     async def save_workflow(self, workflow_id: str, name: str, description: str, config: Dict):
-        import aiosqlite
-        from database import DATABASE_PATH
-        async with aiosqlite.connect(DATABASE_PATH) as db:
+        async with db_pool.write() as db:
             await db.execute("""
                 INSERT OR REPLACE INTO workflows (id, name, description, config, updated_at)
                 VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
             """, (workflow_id, name, description, json.dumps(config, ensure_ascii=False)))
-            await db.commit()
 
     async def delete_workflow(self, workflow_id: str) -> bool:
-        import aiosqlite
-        from database import DATABASE_PATH
-        async with aiosqlite.connect(DATABASE_PATH) as db:
+        async with db_pool.write() as db:
+            cursor = await db.execute(
+                "DELETE FROM node_executions WHERE run_id IN (SELECT id FROM execution_history WHERE workflow_id = ?)",
+                (workflow_id,),
+            )
+            await cursor.close()
             cursor = await db.execute("DELETE FROM execution_history WHERE workflow_id = ?", (workflow_id,))
             await cursor.close()
             cursor = await db.execute("DELETE FROM workflows WHERE id = ?", (workflow_id,))
             deleted = cursor.rowcount > 0
             await cursor.close()
-            await db.commit()
             return deleted
     
-    async def save_execution_history(self, workflow_id: str, input_files: List, output_file: str, status: str, result_summary: str) -> str:
-        import aiosqlite
-        from database import DATABASE_PATH
-        history_id = str(uuid4())
-        async with aiosqlite.connect(DATABASE_PATH) as db:
+    async def save_execution_history(self, run_id: str, workflow_id: Optional[str], file_ids: List[str],
+                                     output_file: Optional[str], status: str, result_summary: str,
+                                     duration_ms: float, peak_memory_bytes: int,
+                                     node_metrics: Dict[str, Dict[str, Any]]) -> str:
+        """保存一次运行及其节点明细（同一事务）；输入文件记录 file_id 与内容哈希"""
+        async with db_pool.write() as db:
+            hashes: Dict[str, Optional[str]] = {}
+            if file_ids:
+                placeholders = ", ".join("?" for _ in file_ids)
+                async with db.execute(
+                    f"SELECT id, content_hash FROM uploaded_files WHERE id IN ({placeholders})", file_ids
+                ) as cursor:
+                    hashes = {row[0]: row[1] for row in await cursor.fetchall()}
+            input_files = [{"file_id": fid, "content_hash": hashes.get(fid)} for fid in file_ids]
             await db.execute("""
-                INSERT INTO execution_history (id, workflow_id, input_files, output_file, status, result_summary)
-                VALUES (?, ?, ?, ?, ?, ?)
-            """, (history_id, workflow_id, json.dumps(input_files), output_file, status, result_summary))
-            await db.commit()
-        return history_id
+                INSERT OR REPLACE INTO execution_history
+                    (id, workflow_id, input_files, output_file, status, result_summary, duration_ms, peak_memory_bytes, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, strftime('%Y-%m-%d %H:%M:%f', 'now'))
+            """, (run_id, workflow_id, json.dumps(input_files), output_file, status, result_summary,
+                  round(duration_ms, 3), int(peak_memory_bytes)))
+            await db.executemany("""
+                INSERT OR REPLACE INTO node_executions
+                    (run_id, node_id, node_type, status, duration_ms, input_rows, output_rows, output_bytes, error)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, [
+                (run_id, node_id, m.get("node_type"), m.get("status"),
+                 round(m["duration_ms"], 3) if m.get("duration_ms") is not None else None,
+                 int(m.get("input_rows") or 0), int(m.get("output_rows") or 0),
+                 int(m.get("output_bytes") or 0), m.get("error"))
+                for node_id, m in node_metrics.items()
+            ])
+        return run_id
     
-    async def get_execution_history(self, limit: int = 50) -> List[Dict]:
-        import aiosqlite
-        from database import DATABASE_PATH
-        async with aiosqlite.connect(DATABASE_PATH) as db:
-            db.row_factory = aiosqlite.Row
-            cursor = await db.execute("SELECT * FROM execution_history ORDER BY created_at DESC LIMIT ?", (limit,))
-            rows = await cursor.fetchall()
-            return [dict(row) for row in rows]
+    async def get_execution_history(self, limit: int = 50, cursor: Optional[str] = None,
+                                    include_summary: bool = False) -> Tuple[List[Dict], Optional[str]]:
+        """按执行时间倒序分页；result_summary 默认不查询"""
+        columns = ("id, workflow_id, input_files, output_file, status, duration_ms, peak_memory_bytes, created_at"
+                   + (", result_summary" if include_summary else ""))
+        return await fetch_page(columns, "execution_history", "created_at", limit, cursor)
+
+    async def get_execution_detail(self, run_id: str) -> Optional[Dict]:
+        """单次运行的历史记录及节点明细"""
+        async with db_pool.read() as db:
+            async with db.execute("SELECT * FROM execution_history WHERE id = ?", (run_id,)) as cursor:
+                row = await cursor.fetchone()
+            if row is None:
+                return None
+            async with db.execute(
+                "SELECT node_id, node_type, status, duration_ms, input_rows, output_rows, output_bytes, error "
+                "FROM node_executions WHERE run_id = ? ORDER BY duration_ms DESC",
+                (run_id,),
+            ) as cursor:
+                nodes = [dict(r) for r in await cursor.fetchall()]
+        result = dict(row)
+        for key in ("input_files", "result_summary"):
+            if result.get(key):
+                result[key] = json.loads(result[key])
+        result["nodes"] = nodes
+        return result
+
+    async def get_node_duration_stats(self, workflow_id: Optional[str] = None,
+                                      max_runs: int = HISTORY_STATS_MAX_RUNS) -> List[Dict[str, Any]]:
+        """最近 max_runs 次运行中成功节点的耗时分位数，按节点类型汇总，p95 降序"""
+        sql = """
+            SELECT n.node_type, n.duration_ms, n.output_rows FROM node_executions n
+            WHERE n.status = 'success' AND n.duration_ms IS NOT NULL AND n.run_id IN (
+                SELECT id FROM execution_history {where} ORDER BY created_at DESC, id DESC LIMIT ?
+            )
+        """.format(where="WHERE workflow_id = ?" if workflow_id else "")
+        params: List[Any] = ([workflow_id] if workflow_id else []) + [int(max_runs)]
+        async with db_pool.read() as db:
+            async with db.execute(sql, params) as cursor:
+                rows = await cursor.fetchall()
+
+        by_type: Dict[str, List[Tuple[float, int]]] = {}
+        for node_type, duration_ms, output_rows in rows:
+            by_type.setdefault(node_type or "unknown", []).append((duration_ms, output_rows or 0))
+
+        stats = []
+        for node_type, samples in by_type.items():
+            durations = sorted(d for d, _ in samples)
+            stats.append({
+                "node_type": node_type,
+                "count": len(durations),
+                "p50_ms": round(_percentile(durations, 0.5), 3),
+                "p95_ms": round(_percentile(durations, 0.95), 3),
+                "max_ms": round(durations[-1], 3),
+                "avg_output_rows": round(sum(r for _, r in samples) / len(samples), 1),
+            })
+        stats.sort(key=lambda item: item["p95_ms"], reverse=True)
+        return stats
 
 # 单例
 workflow_engine = WorkflowEngine()
@@ -0,0 +1,117 @@
+"""
+工作流 DAG 调度器 - 依赖就绪的节点并发执行
+
+- 节点的 pandas/openpyxl 计算通过 run_sync 放到进程级线程池执行，事件循环保持空闲；
+- 线程池大小即整个服务同时执行的节点上限（WORKFLOW_MAX_WORKERS）；
+- 单个工作流同时在跑的节点数由 max_concurrency 限制（默认 WORKFLOW_MAX_CONCURRENCY）。
+
+调度只关心依赖关系，节点的具体执行由调用方传入的 run_node 协程完成。
+"""
+import asyncio
+import functools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from config import WORKFLOW_MAX_CONCURRENCY, WORKFLOW_MAX_WORKERS
+
+logger = logging.getLogger(__name__)
+
+
+class WorkflowScheduler:
+    """按拓扑依赖并发调度节点"""
+
+    def __init__(self, max_workers: int = WORKFLOW_MAX_WORKERS, default_concurrency: int = WORKFLOW_MAX_CONCURRENCY):
+        self.max_workers = max(1, int(max_workers))
+        self.default_concurrency = max(1, int(default_concurrency))
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="workflow-node")
+
+    async def run_sync(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """在节点线程池中执行同步函数（CPU 密集的 pandas 计算）"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+
+    def resolve_concurrency(self, requested: Any = None) -> int:
+        """工作流配置里的 max_concurrency 只能调小，不能超过服务级上限"""
+        try:
+            value = int(requested) if requested is not None else self.default_concurrency
+        except (TypeError, ValueError):
+            value = self.default_concurrency
+        return max(1, min(value, self.max_workers))
+
+    async def run(
+        self,
+        node_ids: Iterable[str],
+        dependencies: Iterable[Tuple[str, str]],
+        run_node: Callable[[str], Awaitable[None]],
+        max_concurrency: Optional[int] = None,
+    ) -> List[str]:
+        """
+        调度执行一组节点。
+
+        Args:
+            node_ids: 参与调度的节点（其顺序决定同批就绪节点的启动顺序）
+            dependencies: (上游, 下游) 依赖对；不在 node_ids 内的端点会被忽略
+            run_node: 执行单个节点的协程，抛异常即视为该节点失败
+            max_concurrency: 本工作流同时执行的节点数上限
+
+        Returns:
+            节点完成顺序。
+
+        任一节点失败后不再启动新节点，等待已在执行的节点结束后抛出第一个异常。
+        存在环时，环上的节点不会被执行（与原串行拓扑排序行为一致）。
+        """
+        order = list(dict.fromkeys(node_ids))
+        rank = {nid: i for i, nid in enumerate(order)}
+        adj: Dict[str, List[str]] = {nid: [] for nid in order}
+        in_degree: Dict[str, int] = {nid: 0 for nid in order}
+        for src, tgt in dependencies:
+            if src in adj and tgt in in_degree and src != tgt:
+                adj[src].append(tgt)
+                in_degree[tgt] += 1
+
+        limit = self.resolve_concurrency(max_concurrency)
+        ready = [nid for nid in order if in_degree[nid] == 0]
+        running: Dict[asyncio.Task, str] = {}
+        completed: List[str] = []
+        first_error: Optional[BaseException] = None
+
+        try:
+            while ready or running:
+                while ready and len(running) < limit and first_error is None:
+                    nid = ready.pop(0)
+                    running[asyncio.ensure_future(run_node(nid))] = nid
+                if not running:
+                    break
+
+                done, _ = await asyncio.wait(list(running), return_when=asyncio.FIRST_COMPLETED)
+                newly_ready: List[str] = []
+                for task in done:
+                    nid = running.pop(task)
+                    exc = task.exception()
+                    if exc is not None:
+                        if first_error is None:
+                            first_error = exc
+                        continue
+                    completed.append(nid)
+                    for neighbor in adj[nid]:
+                        in_degree[neighbor] -= 1
+                        if in_degree[neighbor] == 0:
+                            newly_ready.append(neighbor)
+
+                if first_error is not None:
+                    ready = []
+                else:
+                    ready.extend(sorted(newly_ready, key=rank.get))
+        except asyncio.CancelledError:
+            for task in running:
+                task.cancel()
+            raise
+
+        if first_error is not None:
+            raise first_error
+        return completed
+
+
+# 单例
+workflow_scheduler = WorkflowScheduler()
@@ -0,0 +1,317 @@
+"""
+xlsx 元数据扫描 - 直接读取 xlsx 包内的 XML 流获取 Sheet 信息，不经过 openpyxl 单元格对象
+
+- Sheet 列表来自 xl/workbook.xml + 关系文件；
+- 行数先取 <dimension ref="A1:K500"/>（只读 Sheet XML 的开头），表头与预览只解析前几行后即停止；
+- 共享字符串只解析到预览用到的最大下标为止；
+- 日期按 styles.xml 中的数字格式识别并转换（支持 1904 日期系统）；
+- 精确行数（最后一个有数据的行）通过 count_rows 单独计算，调用方放到后台执行。
+
+.xls 或 XML 结构无法识别时由调用方退回原有解析方式。
+"""
+import posixpath
+import re
+import time
+import zipfile
+import xml.etree.ElementTree as ET
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+_REL_NS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+# 内置日期/时间数字格式
+_BUILTIN_DATE_FMTS = set(range(14, 23)) | {45, 46, 47}
+_BUILTIN_TIME_FMTS = {18, 19, 20, 21, 45, 46, 47}
+_CELL_REF = re.compile(r"([A-Z]+)(\d+)")
+
+
+def _local(tag: str) -> str:
+    return tag.rsplit("}", 1)[-1]
+
+
+def _col_index(letters: str) -> int:
+    """列字母 → 从 0 开始的列号"""
+    idx = 0
+    for ch in letters:
+        idx = idx * 26 + (ord(ch) - 64)
+    return idx - 1
+
+
+def _parse_ref(ref: str) -> Tuple[Optional[int], Optional[int]]:
+    """'K500' → (10, 500)"""
+    m = _CELL_REF.match(ref or "")
+    if not m:
+        return None, None
+    return _col_index(m.group(1)), int(m.group(2))
+
+
+def _is_date_format(code: str) -> bool:
+    # 去掉引号内文本、转义字符与颜色/条件段后，含 y/m/d/h/s 即视为日期时间格式
+    cleaned = re.sub(r'"[^"]*"|\\.|\[[^\]]*\]', "", code or "").lower()
+    return bool(re.search(r"[ymdhs]", cleaned)) and "general" not in cleaned
+
+
+class XlsxMetadataScanner:
+    """单个 xlsx 文件的元数据扫描"""
+
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+        self._zip = zipfile.ZipFile(file_path)
+        self._date1904 = False
+        self._date_styles: Dict[int, bool] = {}  # 样式下标 → 是否纯时间格式
+
+    def close(self) -> None:
+        self._zip.close()
+
+    # ========== 工作簿结构 ==========
+    def sheet_parts(self) -> List[Tuple[str, str]]:
+        """[(Sheet 名, 包内路径)]，顺序与 Excel 中一致"""
+        rels: Dict[str, str] = {}
+        with self._zip.open("xl/_rels/workbook.xml.rels") as f:
+            for _, elem in ET.iterparse(f):
+                if _local(elem.tag) == "Relationship":
+                    target = elem.get("Target", "")
+                    if target.startswith("/"):
+                        target = target.lstrip("/")
+                    else:
+                        target = posixpath.normpath(posixpath.join("xl", target))
+                    rels[elem.get("Id")] = target
+
+        parts = []
+        with self._zip.open("xl/workbook.xml") as f:
+            for _, elem in ET.iterparse(f):
+                tag = _local(elem.tag)
+                if tag == "workbookPr":
+                    self._date1904 = elem.get("date1904") in ("1", "true")
+                elif tag == "sheet":
+                    rid = elem.get(f"{{{_REL_NS}}}id")
+                    if rid in rels:
+                        parts.append((elem.get("name"), rels[rid]))
+        return parts
+
+    def _load_styles(self) -> None:
+        try:
+            f = self._zip.open("xl/styles.xml")
+        except KeyError:
+            return
+        custom: Dict[int, str] = {}
+        xf_fmts: List[int] = []
+        in_cell_xfs = False
+        with f:
+            for event, elem in ET.iterparse(f, events=("start", "end")):
+                tag = _local(elem.tag)
+                if event == "start":
+                    if tag == "cellXfs":
+                        in_cell_xfs = True
+                    elif tag == "xf" and in_cell_xfs:
+                        xf_fmts.append(int(elem.get("numFmtId", "0")))
+                    continue
+                if tag == "numFmt":
+                    custom[int(elem.get("numFmtId", "0"))] = elem.get("formatCode", "")
+                elif tag == "cellXfs":
+                    in_cell_xfs = False
+        for idx, fmt_id in enumerate(xf_fmts):
+            if fmt_id in _BUILTIN_DATE_FMTS:
+                self._date_styles[idx] = fmt_id in _BUILTIN_TIME_FMTS
+            elif fmt_id in custom and _is_date_format(custom[fmt_id]):
+                code = re.sub(r'"[^"]*"|\\.|\[[^\]]*\]', "", custom[fmt_id]).lower()
+                self._date_styles[idx] = not re.search(r"[yd]", code)
+
+    def _shared_strings(self, needed: Set[int]) -> Dict[int, str]:
+        """只解析到需要的最大下标为止"""
+        if not needed:
+            return {}
+        try:
+            f = self._zip.open("xl/sharedStrings.xml")
+        except KeyError:
+            return {}
+        limit = max(needed)
+        result: Dict[int, str] = {}
+        idx = 0
+        with f:
+            for _, elem in ET.iterparse(f):
+                if _local(elem.tag) != "si":
+                    continue
+                if idx in needed:
+                    # 富文本由多个 <r><t> 组成；<rPh> 是注音，不计入
+                    texts = []
+                    for child in elem:
+                        name = _local(child.tag)
+                        if name == "t":
+                            texts.append(child.text or "")
+                        elif name == "r":
+                            texts.extend(t.text or "" for t in child if _local(t.tag) == "t")
+                    result[idx] = "".join(texts)
+                elem.clear()
+                idx += 1
+                if idx > limit:
+                    break
+        return result
+
+    # ========== Sheet 扫描 ==========
+    def _scan_head(self, part: str, max_row: int) -> Tuple[Optional[str], List[Tuple[int, Dict[int, Tuple[str, Optional[str], Optional[int]]]]]]:
+        """读取 dimension 与前 max_row 行的原始单元格 (类型, 文本, 样式)"""
+        dimension = None
+        rows: List[Tuple[int, Dict[int, Tuple[str, Optional[str], Optional[int]]]]] = []
+        with self._zip.open(part) as f:
+            row_num = 0
+            for event, elem in ET.iterparse(f, events=("start", "end")):
+                tag = _local(elem.tag)
+                if event == "start":
+                    if tag == "row":
+                        row_num = int(elem.get("r") or row_num + 1)
+                        if row_num > max_row:
+                            break
+                    continue
+                if tag == "dimension":
+                    dimension = elem.get("ref")
+                elif tag == "row":
+                    cells: Dict[int, Tuple[str, Optional[str], Optional[int]]] = {}
+                    next_col = 0
+                    for c in elem:
+                        if _local(c.tag) != "c":
+                            continue
+                        col, _ = _parse_ref(c.get("r", ""))
+                        col = next_col if col is None else col
+                        next_col = col + 1
+                        ctype = c.get("t", "n")
+                        style = c.get("s")
+                        text = None
+                        for child in c:
+                            name = _local(child.tag)
+                            if name == "v":
+                                text = child.text
+                            elif name == "is":
+                                text = "".join(t.text or "" for t in child.iter() if _local(t.tag) == "t")
+                        cells[col] = (ctype, text, int(style) if style else None)
+                    rows.append((row_num, cells))
+                    elem.clear()
+                elif tag == "sheetData":
+                    break
+        return dimension, rows
+
+    def _convert(self, ctype: str, text: Optional[str], style: Optional[int], strings: Dict[int, str]) -> Any:
+        if text is None:
+            return None
+        if ctype == "s":
+            return strings.get(int(text))
+        if ctype in ("str", "inlineStr", "e"):
+            return text
+        if ctype == "b":
+            return text == "1"
+        try:
+            num = float(text)
+        except ValueError:
+            return text
+        if style is not None and style in self._date_styles:
+            base = datetime(1904, 1, 1) if self._date1904 else datetime(1899, 12, 30)
+            value = base + timedelta(days=num)
+            if self._date_styles[style] and num < 1:
+                return value.time()
+            return value
+        return int(num) if num.is_integer() and "." not in text and "E" not in text.upper() else num
+
+    def scan(self, preview_rows: int = 5) -> Dict[str, Any]:
+        """
+        Returns:
+            {"sheets": [{name, columns, row_count, row_count_exact, preview}], "timings": {...}}
+        """
+        started = time.perf_counter()
+        self._load_styles()
+        parts = self.sheet_parts()
+
+        heads = []
+        timings: Dict[str, float] = {}
+        needed: Set[int] = set()
+        for name, part in parts:
+            t0 = time.perf_counter()
+            dimension, rows = self._scan_head(part, 1 + preview_rows)
+            timings[name] = (time.perf_counter() - t0) * 1000
+            for _, cells in rows:
+                needed.update(int(text) for ctype, text, _ in cells.values() if ctype == "s" and text is not None)
+            heads.append((name, dimension, rows))
+
+        t0 = time.perf_counter()
+        strings = self._shared_strings(needed)
+        shared_ms = (time.perf_counter() - t0) * 1000
+
+        sheets = []
+        for name, dimension, rows in heads:
+            t0 = time.perf_counter()
+            last_col, last_row = None, None
+            if dimension:
+                last_col, last_row = _parse_ref(dimension.split(":")[-1])
+            seen_cols = [col for _, cells in rows for col in cells]
+            width = max([(last_col + 1) if last_col is not None else 0] + [c + 1 for c in seen_cols])
+            seen_last_row = max((r for r, cells in rows if cells), default=0)
+            # dimension 缺失或只有 A1（部分导出工具不写）时行数不可信，等后台精确统计
+            trusted = last_row is not None and (last_row > 1 or seen_last_row <= 1)
+            total_rows = last_row if trusted else seen_last_row
+            if not seen_last_row and total_rows <= 1:
+                total_rows = 0  # 空表的 dimension 为 A1
+
+            by_row = {r: cells for r, cells in rows}
+
+            def _values(r: int) -> List[Any]:
+                cells = by_row.get(r, {})
+                return [self._convert(*cells[c], strings) if c in cells else None for c in range(width)]
+
+            columns = []
+            if total_rows >= 1:
+                columns = [str(v) if v is not None else f"列{i+1}" for i, v in enumerate(_values(1))]
+            preview = [_values(r) for r in range(2, min(total_rows, 1 + preview_rows) + 1)]
+
+            sheets.append({
+                "name": name,
+                "columns": columns,
+                "row_count": max(total_rows - 1, 0),
+                "row_count_exact": False,
+                "preview": preview,
+            })
+            timings[name] += (time.perf_counter() - t0) * 1000
+
+        return {
+            "sheets": sheets,
+            "timings": {
+                "total_ms": round((time.perf_counter() - started) * 1000, 2),
+                "shared_strings_ms": round(shared_ms, 2),
+                "sheets_ms": {k: round(v, 2) for k, v in timings.items()},
+            },
+        }
+
+    def count_rows(self, sheet_names: Optional[Iterable[str]] = None) -> Dict[str, int]:
+        """精确数据行数（最后一个含值的行号 - 表头行），需要完整扫描 Sheet XML"""
+        wanted = set(sheet_names) if sheet_names is not None else None
+        counts: Dict[str, int] = {}
+        for name, part in self.sheet_parts():
+            if wanted is not None and name not in wanted:
+                continue
+            last_row = 0
+            row_num = 0
+            with self._zip.open(part) as f:
+                for _, elem in ET.iterparse(f):
+                    tag = _local(elem.tag)
+                    if tag == "row":
+                        row_num = int(elem.get("r") or row_num + 1)
+                        if any(_local(v.tag) in ("v", "is") for c in elem for v in c):
+                            last_row = row_num
+                        elem.clear()
+                    elif tag == "sheetData":
+                        break
+            counts[name] = max(last_row - 1, 0)
+        return counts
+
+
+def scan_xlsx(file_path: str, preview_rows: int = 5) -> Dict[str, Any]:
+    scanner = XlsxMetadataScanner(file_path)
+    try:
+        return scanner.scan(preview_rows)
+    finally:
+        scanner.close()
+
+
+def count_xlsx_rows(file_path: str, sheet_names: Optional[Iterable[str]] = None) -> Dict[str, int]:
+    scanner = XlsxMetadataScanner(file_path)
+    try:
+        return scanner.count_rows(sheet_names)
+    finally:
+        scanner.close()
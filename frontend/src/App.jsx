@@ -1084,7 +1084,7 @@ function App() {
     };
 
     const isCanceledRequest = (error) => {
-        return error?.code === 'ERR_CANCELED' || error?.name === 'CanceledError' || error?.message === 'canceled';
+        return error?.code === 'ERR_CANCELED' || error?.name === 'CanceledError' || error?.name === 'AbortError' || error?.message === 'canceled';
     };
 
     const createIslandThreadId = () => {
@@ -2281,7 +2281,10 @@ function App() {
                 nodeName: nodes.find(n => n.id === nodeId)?.data?.label || nodeId,
                 columns: result.columns,
                 data: result.data,
-                totalRows: result.total_rows
+                totalRows: result.total_rows,
+                runId: result.run_id,
+                page: 1,
+                pageSize: 100
             });
             setShowNodeResultModal(true);
         } else {
@@ -2289,6 +2292,27 @@ function App() {
         }
     }, [nodeResults, nodes]);
 
+    // 节点结果分页：完整数据保存在服务端，按页读取
+    const handleNodeResultPageChange = useCallback(async (page, pageSize) => {
+        const current = viewingNodeResult;
+        if (!current?.runId) {
+            setViewingNodeResult(prev => prev && ({ ...prev, page, pageSize }));
+            return;
+        }
+        try {
+            const resp = await workflowApi.getRunNodeRows(current.runId, current.nodeId, (page - 1) * pageSize, pageSize);
+            setViewingNodeResult(prev => prev && prev.nodeId === current.nodeId ? {
+                ...prev,
+                data: resp.data || [],
+                totalRows: resp.total_rows ?? prev.totalRows,
+                page,
+                pageSize
+            } : prev);
+        } catch (error) {
+            message.error('读取节点结果失败（结果可能已过期，请重新执行）');
+        }
+    }, [viewingNodeResult]);
+
     // ============== AI对话功能 ==============
 
 
@@ -2694,19 +2718,35 @@ function App() {
             return;
         }
 
-        setChatMessages(prev => [...prev, { role: 'user', content: userMsg }]);
+        setChatMessages(prev => [...prev, { role: 'user', content: userMsg }, { role: 'assistant', content: '' }]);
         setChatLoading(true);
         const signal = createChatAbortSignal();
 
+        // 流式回复：逐段更新最后一条 AI 消息
+        let streamed = '';
+        const updateReply = (content) => setChatMessages(prev => {
+            const next = [...prev];
+            next[next.length - 1] = { role: 'assistant', content };
+            return next;
+        });
+
         try {
-            const result = await aiApi.chatMessage(chatSessionId, userMsg, { signal });
-            setChatMessages(prev => [...prev, { role: 'assistant', content: result.message }]);
+            const result = await aiApi.chatMessageStream(chatSessionId, userMsg, {
+                signal,
+                onDelta: (text) => {
+                    streamed += text;
+                    updateReply(streamed);
+                }
+            });
+            updateReply(result.message);
 
             if (containsWorkflowJson(result.message)) setChatStatus('workflow_ready');
             else setChatStatus(result.status || '');
         } catch (error) {
             if (isCanceledRequest(error)) return;
             console.error('[AI-Chat] handleIslandSend failed:', error);
+            // 去掉未完成的 AI 消息
+            setChatMessages(prev => prev.slice(0, -1));
             message.error('发送失败: ' + (error.response?.data?.detail || error.message));
         } finally {
             setChatLoading(false);
@@ -3985,6 +4025,18 @@ function App() {
                         <Form.Item label="提示词模板" name="prompt" tooltip="用{{列名}}引用数据">
                             <Input.TextArea rows={6} placeholder="请分析{{content}}的情感，只返回'正面'或'负面'" />
                         </Form.Item>
+                        <Form.Item label="并发请求数" name="concurrency" tooltip="同时进行的请求数，不超过服务端上限">
+                            <InputNumber min={1} placeholder="8" style={{ width: '100%' }} />
+                        </Form.Item>
+                        <Form.Item label="每次合并行数" name="batch_size" tooltip="大于1时多行合并为一次请求，按JSON逐行返回">
+                            <InputNumber min={1} max={50} placeholder="1" style={{ width: '100%' }} />
+                        </Form.Item>
+                        <Form.Item label="最多处理行数" name="max_rows" tooltip="留空处理全部行">
+                            <InputNumber min={1} placeholder="全部" style={{ width: '100%' }} />
+                        </Form.Item>
+                        <Form.Item label="使用结果缓存" name="use_cache" valuePropName="checked" initialValue={true} tooltip="相同Prompt直接复用上次的模型结果">
+                            <Switch />
+                        </Form.Item>
                         <div style={{ fontSize: 12, color: '#888' }}>* AI处理较慢，建议先用小数据测试</div>
                     </>
                 );
@@ -4586,7 +4638,7 @@ function App() {
             >
                 {viewingNodeResult && (
                     <Table
-                        dataSource={viewingNodeResult.data?.map((row, idx) => ({ key: idx, ...row })) || []}
+                        dataSource={viewingNodeResult.data?.map((row, idx) => ({ key: ((viewingNodeResult.page || 1) - 1) * (viewingNodeResult.pageSize || 100) + idx, ...row })) || []}
                         columns={viewingNodeResult.columns?.map(col => ({
                             title: col,
                             dataIndex: col,
@@ -4604,7 +4656,14 @@ function App() {
                         scroll={{ x: 'max-content', y: 500 }}
                         size="small"
                         bordered
-                        pagination={{ pageSize: 100, showSizeChanger: true, showTotal: (total) => `共 ${total} 条` }}
+                        pagination={viewingNodeResult.runId ? {
+                            current: viewingNodeResult.page || 1,
+                            pageSize: viewingNodeResult.pageSize || 100,
+                            total: viewingNodeResult.totalRows || 0,
+                            showSizeChanger: true,
+                            showTotal: (total) => `共 ${total} 条`,
+                            onChange: handleNodeResultPageChange
+                        } : { pageSize: 100, showSizeChanger: true, showTotal: (total) => `共 ${total} 条` }}
                         sticky
                     />
                 )}
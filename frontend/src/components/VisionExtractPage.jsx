@@ -293,7 +293,8 @@ export default function VisionExtractPage() {
   const [errorKind, setErrorKind] = useState('error'); // error | cancel
   const [showSuggestions, setShowSuggestions] = useState(true);
   const [history, setHistory] = useState([]);
-  const [stage, setStage] = useState('idle'); // idle | uploading | model_request_started | generating | done | error | cancelled
+  const [stage, setStage] = useState('idle'); // idle | uploading | queued | model_request_started | generating | done | error | cancelled
+  const [queuePosition, setQueuePosition] = useState(0);
   const [uploadPct, setUploadPct] = useState(0);
   const [startAtMs, setStartAtMs] = useState(0);
   const [elapsedMs, setElapsedMs] = useState(0);
@@ -360,13 +361,14 @@ export default function VisionExtractPage() {
     const suffix = `${batchInfo}${batchName}`;
     if (!isLoading && stage === 'idle') return '';
     if (stage === 'uploading') return uploadPct ? `正在上传… ${uploadPct}%${suffix}` : `正在上传…${suffix}`;
+    if (stage === 'queued') return `排队中，第 ${queuePosition} 位…${suffix}`;
     if (stage === 'model_request_started') return `正在识别…${suffix}`;
     if (stage === 'generating') return `正在生成结果…${suffix}`;
     if (stage === 'cancelled') return '已取消';
     if (stage === 'error') return '识图失败';
     if (stage === 'done') return '已完成';
     return '处理中…';
-  }, [batchActiveName, batchIndex, batchTotal, isLoading, stage, uploadPct]);
+  }, [batchActiveName, batchIndex, batchTotal, isLoading, queuePosition, stage, uploadPct]);
 
   const structured = useMemo(() => {
     if (isLoading) return { ok: false, reason: 'loading' };
@@ -540,6 +542,20 @@ export default function VisionExtractPage() {
       }
     });
 
+    es.addEventListener('queued', (evt) => {
+      try {
+        const payload = JSON.parse(evt.data || '{}');
+        const position = Number(payload?.position) || 0;
+        const seq = payload?.seq;
+        if (Number.isFinite(Number(seq))) lastSeqRef.current = Number(seq) || lastSeqRef.current;
+        setQueuePosition(position);
+        setStage('queued');
+        upsertSystemStatus(`排队中，第 ${position} 位…`);
+      } catch {
+        // ignore
+      }
+    });
+
     es.addEventListener('delta', (evt) => {
       try {
         const payload = JSON.parse(evt.data || '{}');
@@ -950,6 +966,20 @@ export default function VisionExtractPage() {
         }
       });
 
+      es.addEventListener('queued', (evt) => {
+        try {
+          const payload = JSON.parse(evt.data || '{}');
+          const position = Number(payload?.position) || 0;
+          const seq = payload?.seq;
+          if (Number.isFinite(Number(seq))) lastSeqRef.current = Number(seq) || lastSeqRef.current;
+          setQueuePosition(position);
+          setStage('queued');
+          upsertSystemStatus(`排队中，第 ${position} 位…`);
+        } catch {
+          // ignore
+        }
+      });
+
       es.addEventListener('delta', (evt) => {
         try {
           const payload = JSON.parse(evt.data || '{}');
@@ -20,10 +20,18 @@ export const excelApi = {
         return response.data;
     },
 
-    // 获取所有文件
+    // 获取所有文件（含 sheets 元数据，按游标逐页拉取）
     getFiles: async () => {
-        const response = await api.get('/excel/files');
-        return response.data;
+        const files = [];
+        let cursor = null;
+        do {
+            const response = await api.get('/excel/files', {
+                params: { include_sheets: true, limit: 200, ...(cursor ? { cursor } : {}) }
+            });
+            files.push(...(response.data.files || []));
+            cursor = response.data.next_cursor;
+        } while (cursor);
+        return { files };
     },
 
     // 获取文件信息
@@ -33,9 +41,9 @@ export const excelApi = {
     },
 
     // 预览Sheet
-    previewSheet: async (fileId, sheetName, rows = 10) => {
+    previewSheet: async (fileId, sheetName, rows = 10, offset = 0) => {
         const response = await api.get(`/excel/file/${fileId}/sheet/${encodeURIComponent(sheetName)}/preview`, {
-            params: { rows }
+            params: { rows, offset }
         });
         return response.data;
     },
@@ -95,6 +103,48 @@ export const aiApi = {
         return response.data;
     },
 
+    // 发送消息（SSE 流式回复）：每收到一段调用 options.onDelta(text)，返回 done 事件数据 {message, status}
+    chatMessageStream: async (sessionId, message, options = {}) => {
+        const response = await fetch('/api/ai/chat/message/stream', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ session_id: sessionId, message }),
+            signal: options.signal
+        });
+        if (!response.ok) {
+            let detail = `HTTP ${response.status}`;
+            try {
+                detail = (await response.json()).detail || detail;
+            } catch (e) { /* 非 JSON 响应 */ }
+            throw new Error(detail);
+        }
+
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+            let sep;
+            while ((sep = buffer.indexOf('\n\n')) >= 0) {
+                const block = buffer.slice(0, sep);
+                buffer = buffer.slice(sep + 2);
+                let event = 'message';
+                let data = '';
+                block.split('\n').forEach(line => {
+                    if (line.startsWith('event:')) event = line.slice(6).trim();
+                    else if (line.startsWith('data:')) data += line.slice(5).trim();
+                });
+                const payload = data ? JSON.parse(data) : {};
+                if (event === 'delta') options.onDelta?.(payload.text || '');
+                else if (event === 'done') return payload;
+                else if (event === 'chat_error') throw new Error(payload.error || '发送失败');
+            }
+        }
+        throw new Error('连接已断开');
+    },
+
     // 确认生成工作流
     chatGenerate: async (sessionId, options = {}) => {
         console.log('[aiApi] chatGenerate:', sessionId);
@@ -128,10 +178,18 @@ export const workflowApi = {
         return response.data;
     },
 
-    // 获取所有工作流
+    // 获取所有工作流（按游标逐页拉取）
     getList: async () => {
-        const response = await api.get('/workflow/list');
-        return response.data;
+        const workflows = [];
+        let cursor = null;
+        do {
+            const response = await api.get('/workflow/list', {
+                params: { limit: 200, ...(cursor ? { cursor } : {}) }
+            });
+            workflows.push(...(response.data.workflows || []));
+            cursor = response.data.next_cursor;
+        } while (cursor);
+        return { workflows };
     },
 
     // 获取工作流
@@ -147,10 +205,11 @@ export const workflowApi = {
     },
 
     // 执行工作流
-    execute: async (workflowConfig, fileMapping) => {
+    execute: async (workflowConfig, fileMapping, workflowId = null) => {
         const response = await api.post('/workflow/execute', {
             workflow_config: workflowConfig,
-            file_mapping: fileMapping
+            file_mapping: fileMapping,
+            workflow_id: workflowId
         });
         return response.data;
     },
@@ -167,9 +226,63 @@ export const workflowApi = {
         return response.data;
     },
 
+    // 异步执行：提交后返回 run_id，进度通过 SSE 订阅
+    startRun: async (workflowConfig, fileMapping, workflowId = null) => {
+        const response = await api.post('/workflow/runs', {
+            workflow_config: workflowConfig,
+            file_mapping: fileMapping,
+            workflow_id: workflowId
+        });
+        return response.data;
+    },
+
+    getRun: async (runId) => {
+        const response = await api.get(`/workflow/runs/${encodeURIComponent(runId)}`);
+        return response.data;
+    },
+
+    cancelRun: async (runId) => {
+        if (!runId) return { status: 'success' };
+        const response = await api.post(`/workflow/runs/${encodeURIComponent(runId)}/cancel`);
+        return response.data;
+    },
+
+    runEventsUrl: (runId, after) => {
+        const base = `/api/workflow/runs/${encodeURIComponent(runId)}/events`;
+        if (!after) return base;
+        return `${base}?after=${encodeURIComponent(after)}`;
+    },
+
+    // 分页读取某次运行中节点的完整输出
+    getRunNodeRows: async (runId, nodeId, offset = 0, limit = 100) => {
+        const response = await api.get(`/workflow/runs/${runId}/nodes/${encodeURIComponent(nodeId)}/rows`, {
+            params: { offset, limit }
+        });
+        return response.data;
+    },
+
+    // 运行的 Chrome trace 下载地址
+    runTraceUrl: (runId) => `/api/workflow/runs/${runId}/trace`,
+
     // 获取历史记录
-    getHistory: async (limit = 50) => {
-        const response = await api.get('/workflow/history/list', { params: { limit } });
+    getHistory: async (limit = 50, cursor = null) => {
+        const response = await api.get('/workflow/history/list', {
+            params: { limit, ...(cursor ? { cursor } : {}) }
+        });
+        return response.data;
+    },
+
+    // 节点耗时分位数（按节点类型）
+    getNodeStats: async (workflowId = null) => {
+        const response = await api.get('/workflow/history/node-stats', {
+            params: workflowId ? { workflow_id: workflowId } : {}
+        });
+        return response.data;
+    },
+
+    // 单次运行的历史明细
+    getHistoryDetail: async (runId) => {
+        const response = await api.get(`/workflow/history/runs/${runId}`);
         return response.data;
     },
 